@@ -6,206 +6,87 @@ from datetime import date, timedelta
 from PIL import Image
 import time
 import base64
+import hashlib
+import io
+import pickle
+import sys
 from supabase_db import SupabaseDB
 
 
 st.set_page_config("THERAPIEKONZEPT", layout="wide")
 
-# --- Database ---
+# --- Settings / database ---
+def _setting(name, default=None):
+    """Setting from .streamlit/secrets.toml, falling back to the environment."""
+    try:
+        return st.secrets[name]
+    except Exception:
+        return os.environ.get(name, default)
+
 @st.cache_resource
 def get_db():
+    # DB_BACKEND = "sqlite" runs on a local database file instead of Supabase
+    if str(_setting("DB_BACKEND", "supabase")).lower() == "sqlite":
+        from sqlite_db import SQLiteDB
+        return SQLiteDB(_setting("SQLITE_PATH", "app.db"))
     return SupabaseDB()
 
 db = get_db()
 
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+
+@st.cache_resource
+def static_url(name):
+    """URL of a file in static/, versioned by its content hash."""
+    try:
+        with open(os.path.join(STATIC_DIR, name), "rb") as f:
+            version = hashlib.sha1(f.read()).hexdigest()[:10]
+    except OSError:
+        version = "0"
+    return f"app/static/{name}?v={version}"
+
+# TAB_ROUTER = "off" runs all three tab bodies on every rerun
+TAB_ROUTER = str(_setting("TAB_ROUTER", "on")).lower() not in ("off", "0", "false")
+# DEBUG_SESSION_SIZE = "on" logs the session_state size after every full run
+DEBUG_SESSION_SIZE = str(_setting("DEBUG_SESSION_SIZE", "off")).lower() in ("on", "1", "true")
+
+def get_catalog():
+    return db.get_catalog()
+
 def fetch_supplements():
-    return db.fetch_supplements()
+    return get_catalog().df
 
-def fetch_patient_names():
-    return db.fetch_patient_names()
+def get_patient_directory():
+    return db.get_patient_directory()
+
+def saved_sections():
+    """This session's record of the patient as last loaded or saved; lets a
+    save skip the sections the session hasn't changed."""
+    if "saved_sections" not in st.session_state:
+        st.session_state.saved_sections = {}
+    return st.session_state.saved_sections
 
 def save_patient_data(patient_data, nem_prescriptions, therapieplan_data, ernaehrung_data, infusion_data):
-    return db.save_patient_data(patient_data, nem_prescriptions, therapieplan_data, ernaehrung_data, infusion_data)
+    return db.save_patient_data(patient_data, nem_prescriptions, therapieplan_data, ernaehrung_data,
+                                infusion_data, saved_sections())
 
 def delete_patient_data(patient_name):
     return db.delete_patient_data(patient_name)
 
 def load_patient_data(patient_name):
-    return db.load_patient_data(patient_name)
+    return db.load_patient_data(patient_name, saved_sections())
+
+def search_patients(prefix, after=None, limit=50):
+    return db.search_patients(prefix, after, limit)
 
 
 # =========================================================
 # CSS
 # =========================================================
-st.markdown("""
-<style>
-@import url('https://fonts.googleapis.com/css2?family=DM+Sans:ital,opsz,wght@0,9..40,300;0,9..40,400;0,9..40,500;0,9..40,600;0,9..40,700;1,9..40,300&family=DM+Serif+Display:ital@0;1&display=swap');
-
-html, body, [class*="css"], .stApp {
-    font-family: 'DM Sans', sans-serif !important;
-    font-size: 16px !important;
-    color: #1a1a2e !important;
-    background-color: #f8f9fb !important;
-}
-.main > div { padding: 12px 24px !important; }
-
-.stButton > button {
-    background-color: rgb(38, 96, 65) !important; color: white !important; border: none !important;
-    padding: 11px 22px !important; font-size: 15px !important; font-weight: 600 !important;
-    border-radius: 8px !important; letter-spacing: 0.3px !important; transition: all 0.2s ease !important;
-    box-shadow: 0 2px 6px rgba(38,96,65,0.25) !important; font-family: 'DM Sans', sans-serif !important;
-}
-.stButton > button:hover {
-    background-color: rgb(28, 76, 50) !important; box-shadow: 0 4px 12px rgba(38,96,65,0.35) !important;
-    transform: translateY(-1px) !important;
-}
-.stTabs { margin-top: 6px !important; }
-.stTabs [data-baseweb="tab-list"] {
-    gap: 0px !important; width: 100% !important; margin-bottom: 0px !important;
-    background: transparent !important; border-bottom: 2px solid #e0e4ea !important;
-}
-.stTabs [data-baseweb="tab"] {
-    height: 52px !important; background-color: transparent !important; border-radius: 0 !important;
-    padding: 12px 20px !important; color: #666 !important; flex: 1 !important; text-align: center !important;
-    justify-content: center !important; margin: 0 !important; font-size: 16px !important;
-    font-weight: 500 !important; font-family: 'DM Sans', sans-serif !important;
-    border-bottom: 3px solid transparent !important; transition: all 0.2s ease !important;
-}
-.stTabs [aria-selected="true"] {
-    color: rgb(38, 96, 65) !important; border-bottom: 3px solid rgb(38, 96, 65) !important;
-    font-weight: 700 !important; background: transparent !important;
-}
-.stTextInput > div > div > input,
-.stTextArea > div > div > textarea,
-.stNumberInput > div > div > input,
-[data-testid="stDateInput"] > div > div > input {
-    padding: 10px 14px !important; font-size: 16px !important; border-radius: 8px !important;
-    border: 1.5px solid #d4dae3 !important; background: #fff !important;
-    font-family: 'DM Sans', sans-serif !important; transition: border-color 0.2s ease !important;
-}
-.stTextInput > div > div > input:focus, .stTextArea > div > div > textarea:focus {
-    border-color: rgb(38, 96, 65) !important; box-shadow: 0 0 0 3px rgba(38,96,65,0.1) !important;
-}
-textarea { font-size: 16px !important; line-height: 1.7 !important; font-family: 'DM Sans', sans-serif !important; }
-.stTextInput label, .stTextArea label, .stNumberInput label,
-.stDateInput label, .stSelectbox label, .stMultiSelect label,
-.stRadio label, .stCheckbox label {
-    font-size: 15px !important; font-weight: 600 !important; color: #2d3748 !important;
-    margin-bottom: 4px !important; font-family: 'DM Sans', sans-serif !important; letter-spacing: 0.1px !important;
-}
-[data-testid="stCheckbox"] { margin: 3px 0 !important; }
-[data-testid="stCheckbox"] span { color: #2d3748 !important; font-size: 15px !important; font-family: 'DM Sans', sans-serif !important; }
-[data-testid="stCheckbox"] input[type="checkbox"] { accent-color: rgb(38, 96, 65) !important; }
-[data-testid="stRadio"] { margin: 4px 0 !important; }
-[data-testid="stRadio"] span { color: #2d3748 !important; font-size: 16px !important; font-family: 'DM Sans', sans-serif !important; }
-[data-testid="stSelectbox"] div[data-baseweb="select"] > div,
-[data-testid="stMultiSelect"] div[data-baseweb="select"] > div {
-    border-radius: 8px !important; border: 1.5px solid #d4dae3 !important;
-    background: #fff !important; font-size: 15px !important; min-height: 44px !important;
-}
-[data-testid="stSelectbox"] span, [data-testid="stMultiSelect"] span { font-size: 15px !important; font-family: 'DM Sans', sans-serif !important; }
-[data-baseweb="tag"] { background-color: rgba(38,96,65,0.1) !important; border-radius: 6px !important; }
-[data-baseweb="tag"] span { font-size: 14px !important; color: rgb(38,96,65) !important; font-weight: 500 !important; }
-.success-message {
-    background-color: #d4f4e2; color: #1a5c37; padding: 16px 20px !important; border-radius: 10px !important;
-    border: 1.5px solid #a8e0c0; margin: 12px 0 !important; font-size: 15px !important;
-    font-weight: 600 !important; font-family: 'DM Sans', sans-serif !important;
-}
-.green-section-header {
-    background: linear-gradient(135deg, rgb(38, 96, 65) 0%, rgb(50, 120, 82) 100%) !important;
-    color: white !important; padding: 14px 20px !important; border-radius: 10px !important;
-    margin: 8px 0 6px 0 !important; font-weight: 700 !important; font-size: 1.15rem !important;
-    letter-spacing: 0.5px !important; font-family: 'DM Sans', sans-serif !important;
-    box-shadow: 0 3px 10px rgba(38,96,65,0.2) !important;
-}
-.section-subheader {
-    font-weight: 700 !important; font-size: 1.05rem !important; margin: 12px 0 8px 0 !important;
-    color: rgb(38, 96, 65) !important; border-bottom: 2px solid rgba(38,96,65,0.2) !important;
-    padding-bottom: 6px !important; font-family: 'DM Sans', sans-serif !important; letter-spacing: 0.2px !important;
-}
-hr { margin: 16px 0 !important; border-width: 1px !important; border-color: #e8ecf0 !important; }
-.stMarkdown h1 { font-size: 2rem !important; font-family: 'DM Serif Display', serif !important; }
-.stMarkdown h2 { font-size: 1.6rem !important; font-family: 'DM Serif Display', serif !important; }
-.stMarkdown h3 { font-size: 1.35rem !important; font-family: 'DM Serif Display', serif !important; }
-.stMarkdown h4 { font-size: 1.1rem !important; font-family: 'DM Sans', sans-serif !important; font-weight: 700 !important; color: #1a1a2e !important; }
-.streamlit-expanderHeader {
-    font-size: 15px !important; font-weight: 600 !important; padding: 12px 16px !important;
-    background: #f0f4f0 !important; border-radius: 8px !important; color: rgb(38, 96, 65) !important;
-    font-family: 'DM Sans', sans-serif !important; border: 1.5px solid rgba(38,96,65,0.15) !important;
-    transition: background 0.2s ease !important;
-}
-.streamlit-expanderHeader:hover { background: #e6efe9 !important; }
-.streamlit-expanderContent {
-    padding: 16px 12px !important; border: 1.5px solid rgba(38,96,65,0.1) !important;
-    border-top: none !important; border-radius: 0 0 8px 8px !important; background: #fafcfa !important;
-}
-.stAlert { padding: 14px 18px !important; margin: 10px 0 !important; font-size: 15px !important; border-radius: 8px !important; font-family: 'DM Sans', sans-serif !important; }
-.sticky-header { padding: 10px 0 !important; margin-bottom: 6px !important; border-bottom: 2px solid rgb(38, 96, 65) !important; }
-.sticky-header .stMarkdown { font-size: 14px !important; font-weight: 700 !important; color: rgb(38, 96, 65) !important; }
-.infusion-header { font-size: 14px !important; font-weight: 700 !important; color: rgb(38, 96, 65) !important; margin: 0 !important; letter-spacing: 0.3px !important; font-family: 'DM Sans', sans-serif !important; }
-.infusion-label-text { font-size: 15px !important; }
-.info-icon {
-    display: inline-flex; align-items: center; justify-content: center; width: 18px; height: 18px;
-    border-radius: 50%; background-color: rgba(38,96,65,0.15); color: rgb(38, 96, 65);
-    font-size: 11px; font-weight: bold; cursor: help; margin-left: 5px; line-height: 1;
-    position: relative; transition: background 0.2s ease;
-}
-.info-icon:hover { background-color: rgb(38,96,65); color: white; }
-.info-icon:hover::after {
-    content: attr(data-tooltip); position: absolute; left: 22px; top: -10px;
-    background-color: #1a1a2e; color: white; padding: 6px 10px; border-radius: 6px;
-    font-size: 13px; white-space: nowrap; z-index: 1000; box-shadow: 0 4px 12px rgba(0,0,0,0.2);
-}
-div[data-testid="column"] { padding: 0 8px !important; }
-.stMarkdown, .stTextInput, .stNumberInput, .stDateInput,
-.stSelectbox, .stMultiSelect, .stCheckbox, .stRadio, .stButton, .stAlert { margin-bottom: 8px !important; }
-p, li, .stMarkdown p { line-height: 1.65 !important; font-size: 15px !important; font-family: 'DM Sans', sans-serif !important; }
-.stCaption { font-size: 13px !important; color: #888 !important; font-family: 'DM Sans', sans-serif !important; }
-div[role="listbox"] ul li { font-size: 15px !important; padding: 9px 14px !important; font-family: 'DM Sans', sans-serif !important; }
-div[data-testid="stHorizontalBlock"] button { margin: 3px !important; padding: 7px 12px !important; font-size: 14px !important; }
-.stNumberInput button { padding: 0 10px !important; font-size: 15px !important; }
-.progress-container { margin: 16px 0 24px 0 !important; padding: 12px !important; }
-
-/* ===== SCHEDULE TABLE ===== */
-.sched-wrap {
-    background: #f6faf7;
-    border: 1.5px solid rgba(38,96,65,0.18);
-    border-radius: 10px;
-    padding: 14px 16px 10px 16px;
-    margin-top: 4px;
-}
-.sched-item-label {
-    font-size: 13px;
-    font-weight: 600;
-    color: #1a4430;
-    margin: 10px 0 4px 0;
-    font-family: 'DM Sans', sans-serif;
-}
-.sched-pill {
-    display: inline-block;
-    background: rgba(38,96,65,0.12);
-    color: rgb(28,76,50);
-    border-radius: 20px;
-    padding: 3px 12px;
-    font-size: 12px;
-    font-weight: 600;
-    margin-top: 4px;
-    font-family: 'DM Sans', sans-serif;
-}
-.sched-empty {
-    font-size: 13px;
-    color: #aaa;
-    font-style: italic;
-    padding: 6px 0 4px 0;
-    font-family: 'DM Sans', sans-serif;
-}
-.sched-divider {
-    border: none;
-    border-top: 1px solid rgba(38,96,65,0.1);
-    margin: 8px 0 4px 0;
-}
-</style>
-""", unsafe_allow_html=True)
+# Served from static/ (see .streamlit/config.toml) so reruns only resend the
+# <link>; the ?v= hash changes when the file does.
+st.markdown(f'<link rel="stylesheet" href="{static_url("app.css")}">', unsafe_allow_html=True)
 
 
 # =========================================================
@@ -213,12 +94,11 @@ div[data-testid="stHorizontalBlock"] button { margin: 3px !important; padding: 7
 # =========================================================
 col1, col2, col3 = st.columns([1.2, 3, 0.7])
 with col1:
-    st.markdown('<div class="header-logo">', unsafe_allow_html=True)
-    if os.path.exists("clinic_logo.png"):
-        st.image("clinic_logo.png", width=200)
-    st.markdown('</div>', unsafe_allow_html=True)
+    # Pre-resized copy in static/; the full-size clinic_logo.png is for the PDF
+    st.markdown(f'<div class="header-logo"><img src="{static_url("clinic_logo.png")}" width="200" alt="Revita Clinic"></div>',
+                unsafe_allow_html=True)
 with col2:
-    st.markdown("<h1 style='text-align:center;margin:0;font-family:DM Serif Display,serif;color:rgb(38,96,65);'>THERAPIEKONZEPT</h1>", unsafe_allow_html=True)
+    st.markdown("<h1 style='text-align:center;margin:0;font-family:var(--font-serif);color:rgb(38,96,65);'>THERAPIEKONZEPT</h1>", unsafe_allow_html=True)
 with col3:
     st.markdown("""<div style="font-size:14px;line-height:1.8;color:#555;text-align:right;">
     Clausewitzstr. 2<br>10629 Berlin-Charlottenburg<br>+49 30 6633110<br>info@revitaclinic.de<br>www.revitaclinic.de
@@ -291,6 +171,25 @@ DEFAULT_FORMS = {
     "SuperPatches einzeln": "Pflaster", "SuperPatches Packung 28er": "Pflaster",
 }
 
+# NEM option lists, shared by the per-row widgets and the grid editor
+GD_OPTIONS = ["","1","2","3","4","5","6","7","8","9","10","12","14","16","18","20","22","24","26","28","30","35","40","45","50","60","70","80","90","100","120","150","180","200","250","300","400","500"]
+DOSAGE_PRESETS = ["Kapseln","Lösung","Tabletten","Pulver","Tropfen","Sachet","Öl","Spray","Creme","Gel","Flüssig","Tee","Pflaster"]
+DOSE_OPTIONS = ["","1","2","3","4","5"]
+
+
+def get_pro_Einnahme_options(df_form):
+    if not df_form: return [""]
+    f = df_form.lower()
+    if any(x in f for x in ["kapsel","tablette","pflaster"]):
+        return ["","1","2","3","4","5","6","7","8","9","10","½","¼","¾","1½","2½"]
+    elif any(x in f for x in ["tropfen","lösung","flüssig","öl","spray","creme","gel"]):
+        return ["","1","2","3","4","5","6","7","8","9","10","½","¼","¾","1½","2½","Tr","ML"]
+    elif any(x in f for x in ["pulver","sachet"]):
+        return ["","1","2","3","4","5","6","7","8","9","10","½","¼","¾","1½","2½","g","mg","EL","TL","ML"]
+    elif "tee" in f:
+        return ["","1","2","3","4","5","Beutel","TL","EL"]
+    return ["","1","2","3","4","5","6","7","8","9","10","½","¼","¾","1½","2½","g","mg","EL","TL","ML","Tr"]
+
 
 # =========================================================
 # HELPERS
@@ -336,14 +235,14 @@ def therapy_progress_bar(therapiebeginn, dauer_monate,
         marker_labels_html += f"""
 <div style="position:absolute;left:calc({mp}%);transform:translateX(-50%);
             top:42px;font-size:11px;font-weight:600;color:rgb(38,96,65);
-            white-space:nowrap;font-family:'DM Sans',sans-serif;">
+            white-space:nowrap;font-family:var(--font-sans);">
     {name}<br><span style="font-weight:400;font-size:10px;">{d.strftime('%d.%m.%y')}</span>
 </div>"""
 
     extra_mb = "48px" if markers_html else "8px"
     html = f"""
 <div style="margin:12px 0 {extra_mb} 0;padding:16px 20px;background:#f0f4f0;border-radius:12px;border:1.5px solid rgba(38,96,65,0.15);">
-    <div style="font-weight:700;color:rgb(38,96,65);margin-bottom:12px;font-size:15px;font-family:'DM Sans',sans-serif;">
+    <div style="font-weight:700;color:rgb(38,96,65);margin-bottom:12px;font-size:15px;font-family:var(--font-sans);">
         Therapie-Fortschritt: Woche {weeks_passed} von {total_weeks}
     </div>
     <div style="position:relative;height:36px;background:#dde8e2;border-radius:18px;overflow:visible;">
@@ -436,10 +335,10 @@ def _extra_rows(section_key, kp, data_store, therapiebeginn, dauer, schedule_dic
             cb_c, txt_c = st.columns([0.07, 0.93])
             with cb_c:
                 checked = st.checkbox("", value=bool(data_store.get(cb_key, False)),
-                    key=cb_key, label_visibility="collapsed")
+                    key=widget_key(cb_key, "tab", cb_key), label_visibility="collapsed")
             with txt_c:
                 val = st.text_input("", value=data_store.get(slug + "_text", ""),
-                    key=slug + "_text_input", placeholder=f"Zusatz {i}...", label_visibility="collapsed")
+                    key=widget_key(slug + "_text_input", "tab", slug + "_text"), placeholder=f"Zusatz {i}...", label_visibility="collapsed")
         _tb = None if (no_auto_date and not data_store.get(f"{kp}_{slug}_date_start")) else therapiebeginn
         schedule_dict.update(
             _inline_timing(checked and bool(val), slug, _tb, dauer, kp, data_store, cols))
@@ -449,9 +348,10 @@ def _extra_rows(section_key, kp, data_store, therapiebeginn, dauer, schedule_dic
 
 def _inline_timing(is_checked, slug, therapiebeginn, dauer_monate, key_prefix, data_store, cols):
     """
-    Renders timing inputs into cols[1..5].
+    Renders timing inputs into cols[1..5] for a checked row.
     Wo von / Wo bis = dropdowns bounded by dauer_monate.
     Von/Bis Datum always auto-calculated from therapiebeginn + chosen week.
+    Unchecked rows get a placeholder and keep their stored timing unchanged.
     Returns dict to merge into schedule_data.
     """
     total_weeks  = max(1, int(dauer_monate) * 4)
@@ -475,6 +375,10 @@ def _inline_timing(is_checked, slug, therapiebeginn, dauer_monate, key_prefix, d
     de_key      = f"{key_prefix}_{slug}_date_end"
     freq_key    = f"{key_prefix}_{slug}_freq"
 
+    if not is_checked:
+        cols[1].markdown('<div class="sched-empty">–</div>', unsafe_allow_html=True)
+        return {k: data_store[k] for k in (w_start_key, w_end_key, ds_key, de_key, freq_key) if k in data_store}
+
     week_opts = [str(w) for w in range(1, total_weeks + 1)]
 
     saved_ws = str(data_store.get(w_start_key, 1))
@@ -487,7 +391,7 @@ def _inline_timing(is_checked, slug, therapiebeginn, dauer_monate, key_prefix, d
     # Wo von dropdown
     ws_idx = week_opts.index(saved_ws)
     w_start_sel = cols[1].selectbox("", week_opts, index=ws_idx,
-        key=f"ws_{key_prefix}_{slug}", disabled=not is_checked, label_visibility="collapsed")
+        key=widget_key(f"ws_{key_prefix}_{slug}", "tab", w_start_key, dated=True), label_visibility="collapsed")
 
     # Wo bis dropdown — options filtered so min = w_start
     w_start_int = int(w_start_sel)
@@ -495,11 +399,11 @@ def _inline_timing(is_checked, slug, therapiebeginn, dauer_monate, key_prefix, d
     if saved_we not in we_opts: saved_we = w_start_sel
     we_idx = we_opts.index(saved_we)
     w_end_sel = cols[2].selectbox("", we_opts, index=we_idx,
-        key=f"we_{key_prefix}_{slug}", disabled=not is_checked, label_visibility="collapsed")
+        key=widget_key(f"we_{key_prefix}_{slug}", "tab", w_end_key, dated=True), label_visibility="collapsed")
 
     fi   = freq_options.index(saved_freq) if saved_freq in freq_options else 0
     freq = cols[3].selectbox("", freq_options, index=fi,
-        key=f"fr_{key_prefix}_{slug}", disabled=not is_checked, label_visibility="collapsed")
+        key=widget_key(f"fr_{key_prefix}_{slug}", "tab", freq_key), label_visibility="collapsed")
 
     w_start_int = int(w_start_sel)
     w_end_int   = int(w_end_sel)
@@ -507,17 +411,17 @@ def _inline_timing(is_checked, slug, therapiebeginn, dauer_monate, key_prefix, d
         auto_ds = tb + timedelta(weeks=w_start_int - 1)
         auto_de = tb + timedelta(weeks=w_end_int) - timedelta(days=1)
         date_start = cols[4].date_input("", value=auto_ds, format="DD.MM.YYYY",
-            key=f"ds_{key_prefix}_{slug}_{auto_ds.isoformat()}", disabled=not is_checked, label_visibility="collapsed")
+            key=widget_key(f"ds_{key_prefix}_{slug}_{auto_ds.isoformat()}", "tab", ds_key, dated=True), label_visibility="collapsed")
         date_end   = cols[5].date_input("", value=auto_de, format="DD.MM.YYYY",
-            key=f"de_{key_prefix}_{slug}_{auto_de.isoformat()}", disabled=not is_checked, label_visibility="collapsed")
+            key=widget_key(f"de_{key_prefix}_{slug}_{auto_de.isoformat()}", "tab", de_key, dated=True), label_visibility="collapsed")
     else:
         # No auto-date: empty calendar, patient picks manually
         _ds_saved = _coerce_date(data_store.get(ds_key)) if data_store.get(ds_key) else None
         _de_saved = _coerce_date(data_store.get(de_key)) if data_store.get(de_key) else None
         date_start = cols[4].date_input("", value=_ds_saved, format="DD.MM.YYYY",
-            key=f"ds_{key_prefix}_{slug}_free", disabled=not is_checked, label_visibility="collapsed")
+            key=widget_key(f"ds_{key_prefix}_{slug}_free", "tab", ds_key), label_visibility="collapsed")
         date_end   = cols[5].date_input("", value=_de_saved, format="DD.MM.YYYY",
-            key=f"de_{key_prefix}_{slug}_free", disabled=not is_checked, label_visibility="collapsed")
+            key=widget_key(f"de_{key_prefix}_{slug}_free", "tab", de_key), label_visibility="collapsed")
         auto_ds = date_start or _dt.date.today()
         auto_de = date_end   or _dt.date.today()
 
@@ -557,6 +461,13 @@ def render_schedule_panel(title, items, therapiebeginn, dauer_monate, key_prefix
             f'{label}</div>',
             unsafe_allow_html=True)
 
+        # Unchecked: no inputs, stored timing is kept as is
+        if not is_checked:
+            st.markdown('<div class="sched-empty">Nicht ausgewählt</div>', unsafe_allow_html=True)
+            schedule_data.update({k: data_store[k] for k in (w_start_key, w_end_key, ds_key, de_key, freq_key)
+                                  if k in data_store})
+            continue
+
         c1, c2, c3 = st.columns([1, 1, 1])
 
         with c1:
@@ -566,8 +477,7 @@ def render_schedule_panel(title, items, therapiebeginn, dauer_monate, key_prefix
             w_start = st.number_input(
                 "Woche von", min_value=1, max_value=total_weeks,
                 value=min(saved_ws, total_weeks),
-                key=f"sched_{key_prefix}_{key}_ws", step=1,
-                disabled=not is_checked)
+                key=f"sched_{key_prefix}_{key}_ws", step=1)
 
         with c2:
             saved_we = data_store.get(w_end_key, w_start)
@@ -576,16 +486,14 @@ def render_schedule_panel(title, items, therapiebeginn, dauer_monate, key_prefix
             w_end = st.number_input(
                 "Woche bis", min_value=w_start, max_value=total_weeks,
                 value=min(max(saved_we, w_start), total_weeks),
-                key=f"sched_{key_prefix}_{key}_we", step=1,
-                disabled=not is_checked)
+                key=f"sched_{key_prefix}_{key}_we", step=1)
 
         with c3:
             saved_freq = data_store.get(freq_key, "")
             freq_idx = freq_options.index(saved_freq) if saved_freq in freq_options else 0
             freq = st.selectbox(
                 "Häufigkeit", freq_options, index=freq_idx,
-                key=f"sched_{key_prefix}_{key}_freq",
-                disabled=not is_checked)
+                key=f"sched_{key_prefix}_{key}_freq")
 
         # Auto-calculate dates
         auto_start, auto_end = compute_week_dates(therapiebeginn, w_start, w_end)
@@ -602,8 +510,7 @@ def render_schedule_panel(title, items, therapiebeginn, dauer_monate, key_prefix
                 saved_ds = auto_start
             date_start = st.date_input(
                 "Von (Datum)", value=saved_ds,
-                key=f"sched_{key_prefix}_{key}_ds", format="DD.MM.YYYY",
-                disabled=not is_checked)
+                key=f"sched_{key_prefix}_{key}_ds", format="DD.MM.YYYY")
 
         with d2:
             fallback_de = auto_end or therapiebeginn or date.today()
@@ -616,8 +523,7 @@ def render_schedule_panel(title, items, therapiebeginn, dauer_monate, key_prefix
                 saved_de = auto_end
             date_end = st.date_input(
                 "Bis (Datum)", value=saved_de,
-                key=f"sched_{key_prefix}_{key}_de", format="DD.MM.YYYY",
-                disabled=not is_checked)
+                key=f"sched_{key_prefix}_{key}_de", format="DD.MM.YYYY")
 
         # Pill — only when checked
         if is_checked:
@@ -1240,181 +1146,297 @@ def generate_pdf(patient, supplements, tab_name="NEM"):
     return bytes(pdf.output(dest="S"))
 
 
+# =========================================================
+# NEM PRESCRIPTION INDEX
+# Per-session lookup of the NEM rows by supplement id and by name, so the
+# render loop and the load push don't scan the list for every supplement.
+# Edits update single rows (widget callbacks, grid diff); the DataFrame for
+# the column-wise save and PDF filters is only built when they ask for it.
+# =========================================================
+def _nem_keep(p):
+    """Rows worth storing: values, or a non-default Darreichungsform. The rest
+    are implied by the catalog defaults."""
+    return _nem_has_values(p) or p.get("Darreichungsform", "") not in ("", DEFAULT_FORMS.get(p.get("name"), "Kapseln"))
+
+
+def set_nem_prescriptions(prescriptions):
+    """Store the NEM rows and rebuild their index (load, save, reset)."""
+    prescriptions = [p for p in (prescriptions or []) if _nem_keep(p)]
+    catalog = get_catalog()
+    by_name = {p.get("name"): p for p in prescriptions}
+    by_id = {}
+    for name, p in by_name.items():
+        sid = catalog.id_for(name)
+        if sid is not None:
+            by_id[sid] = p
+    st.session_state.nem_prescriptions = prescriptions
+    st.session_state.nem_index = {"rows": prescriptions, "by_id": by_id, "by_name": by_name, "table": None}
+
+
+def update_nem_rows(rows):
+    """Apply edited NEM rows ({supplement id: row}) to the index. Rows equal to
+    the stored ones are skipped; any change drops the cached table."""
+    idx = nem_index()
+    by_id, by_name = idx["by_id"], idx["by_name"]
+    changed = False
+    for sid, rec in rows.items():
+        old = by_id.get(sid)
+        if _nem_keep(rec):
+            if old is not None and all(_same(old.get(f), rec.get(f)) for f, _ in NEM_FIELDS):
+                continue
+            by_id[sid] = by_name[rec["name"]] = rec
+        elif old is not None:
+            del by_id[sid]
+            by_name.pop(old.get("name"), None)
+        else:
+            continue
+        changed = True
+    if not changed:
+        return
+    # Keep the catalog order the list and the PDF use
+    catalog = get_catalog()
+    ordered = [by_id[r["id"]] for group in catalog.categories.values() for r in group if r["id"] in by_id]
+    in_catalog = {id(p) for p in ordered}
+    rows = ordered + [p for p in by_name.values() if id(p) not in in_catalog]
+    idx["rows"] = rows
+    idx["table"] = None
+    st.session_state.nem_prescriptions = rows
+
+
+def nem_index():
+    """The index for the current nem_prescriptions. Rebuilt when the list was
+    replaced without set_nem_prescriptions (e.g. by the session reset paths)."""
+    idx = st.session_state.get("nem_index")
+    if idx is None or idx["rows"] is not st.session_state.get("nem_prescriptions"):
+        set_nem_prescriptions(st.session_state.get("nem_prescriptions"))
+        idx = st.session_state.nem_index
+    return idx
+
+
+def nem_table():
+    """The NEM rows as one DataFrame indexed by supplement id, built on first
+    use after a change."""
+    idx = nem_index()
+    if idx["table"] is None:
+        columns = ["name"] + [f for f, _ in NEM_FIELDS]
+        idx["table"] = (pd.DataFrame.from_dict(idx["by_id"], orient="index")
+                          .reindex(columns=columns).fillna("").astype(str))
+    return idx["table"]
+
+
+# =========================================================
+# SESSION MODEL
+# patient_data, nem_prescriptions, therapieplan_data, ernaehrung_data and
+# infusion_data are the session's single copy of the patient. Every tab widget
+# takes its initial value from them and registers its key with widget_key(),
+# so the registry knows which model field each widget shows. A patient switch
+# drops the keys whose value the new patient changes, and every key that was
+# never registered.
+# =========================================================
+SESSION_MODEL_KEYS = {
+    "patient_data", "nem_prescriptions", "nem_index", "therapieplan_data",
+    "ernaehrung_data", "infusion_data", "patient_header", "widget_fields",
+    "last_loaded_patient", "display_patient_name", "just_loaded_patient",
+    "_tabs_rendered_with",
+    "_set_dropdown", "_reset_dropdown", "_do_full_wipe",
+    "show_delete_confirmation", "show_save_success", "auto_download_pdf", "nem_pdf_bytes",
+    "category_states", "nem_form_initialized", "last_main_dauer", "nem_grid_base", "nem_grid_rev",
+    # UI widgets that outlive a patient switch
+    "patient_dropdown_select", "patient_name_input", "active_tab", "nem_view_mode", "nem_batch_mode",
+    "patient_picker", "picker_query", "saved_sections",
+}
+
+
+def widget_key(key, model, field=None, dated=False):
+    """Register widget ``key`` as showing ``field`` of the session model and
+    return the key. ``model`` is "patient" (header fields), "tab" (therapieplan /
+    infusion / ernaehrung data), "nem" (field = supplement id) or "nem_grid".
+    ``dated`` widgets also follow Therapiebeginn and Dauer (week bounds, auto dates)."""
+    fields = st.session_state.get("widget_fields")
+    if fields is None:
+        fields = st.session_state.widget_fields = {}
+    fields[key] = (model, field, dated)
+    return key
+
+
+def _same(a, b):
+    """Equal as rendered: dates vs ISO strings, numbers vs their text, None vs ""."""
+    def norm(v):
+        if isinstance(v, date): return v.isoformat()
+        return "" if v is None else str(v)
+    return norm(a) == norm(b)
+
+
+def _nem_rows_changed(old, new):
+    """Supplement ids whose NEM row differs between two nem_index()["by_id"] maps."""
+    return {sid for sid in old.keys() | new.keys()
+            if any(not _same(old.get(sid, {}).get(f), new.get(sid, {}).get(f)) for f, _ in NEM_FIELDS)}
+
+
+def _stale_widget_keys(old_patient, old_stores, nem_changed):
+    """Widget keys whose value differs from what the session model now renders.
+    ``old_patient`` / ``old_stores`` are the header and tab data before the
+    switch; a key only survives if it matches both sides. Keys missing from
+    the widget_key() registry are stale."""
+    catalog = get_catalog()
+    fields = st.session_state.get("widget_fields", {})
+    new_patient = st.session_state.patient_data
+    new_nem = nem_index()["by_id"]
+    new_stores = [st.session_state.therapieplan_data, st.session_state.infusion_data,
+                  st.session_state.ernaehrung_data]
+    # Week bounds and auto dates also follow Therapiebeginn and Dauer
+    moved = any(not _same(old_patient.get(f), new_patient.get(f)) for f in ("therapiebeginn", "dauer"))
+
+    def lookup(stores, key):
+        for s in stores:
+            if key in s:
+                return True, s[key]
+        return False, None
+
+    def keeps(value, key):
+        found_old, old = lookup(old_stores, key)
+        found_new, new = lookup(new_stores, key)
+        return (found_old or found_new) and _same(value, old) and _same(value, new)
+
+    def nem_expected(sid, field):
+        value = new_nem.get(sid, {}).get(field) or ""
+        if field == "Darreichungsform" and not value:
+            value = DEFAULT_FORMS.get(catalog.by_id[sid].get("name"), "Kapseln")
+        return value
+
+    stale, nem_stale = [], {}
+    for k in list(st.session_state.keys()):
+        if k in SESSION_MODEL_KEYS or k.startswith("nem_cat_"):
+            continue
+        value = st.session_state[k]
+        model, field, dated = fields.get(k, (None, None, False))
+
+        if model == "nem_grid":
+            if nem_changed: stale.append(k)
+        elif model == "nem" and field in catalog.by_id:
+            # A row's keys are seeded together, so they are dropped together
+            if field not in nem_stale:
+                nem_stale[field] = any(f"{field}_{s}" in st.session_state
+                                       and not _same(st.session_state[f"{field}_{s}"], nem_expected(field, f))
+                                       for f, s in NEM_FIELDS)
+            if nem_stale[field]: stale.append(k)
+        elif model == "patient":
+            if not (_same(value, old_patient.get(field)) and _same(value, new_patient.get(field))):
+                stale.append(k)
+        elif model == "tab":
+            if (dated and moved) or not keeps(value, field):
+                stale.append(k)
+        else:
+            stale.append(k)
+    return stale
+
+
+def session_footprint():
+    """(number of keys, approximate bytes) held in this session's st.session_state.
+    All values go through one pickler, so objects shared between keys count once."""
+    keys = list(st.session_state.keys())
+    buf = io.BytesIO()
+    pickler = pickle.Pickler(buf, protocol=pickle.HIGHEST_PROTOCOL)
+    unpicklable = 0
+    for k in keys:
+        v = st.session_state[k]
+        start = buf.tell()
+        try:
+            pickler.dump(v)
+        except Exception:
+            buf.seek(start)
+            buf.truncate()
+            unpicklable += sys.getsizeof(v)
+    return len(keys), buf.tell() + unpicklable
+
+
 # =========================================================
 # PATIENT INPUTS
 # =========================================================
 def _apply_patient_to_session(pd_, nem, tp, ern, inf, name):
-    """Push ALL loaded patient data into session state AND widget keys.
-    Call this before st.rerun() so the next render picks up correct values."""
+    """Make the loaded patient the session's patient model. Widgets take their
+    values from it on first render, so only the keys whose value changes are
+    dropped; the rest of the previous patient's widget state stays."""
+    old_patient = dict(st.session_state.get("patient_header") or {})
+    old_stores  = [st.session_state.get(k) or {} for k in ("therapieplan_data", "infusion_data", "ernaehrung_data")]
+    old_nem     = nem_index()["by_id"]
+
     st.session_state.patient_data      = pd_ or {}
-    st.session_state.nem_prescriptions = nem or []
+    set_nem_prescriptions(nem)
     st.session_state.therapieplan_data = tp  or {}
     st.session_state.ernaehrung_data   = ern or {}
     st.session_state.infusion_data     = inf or {}
     st.session_state.last_loaded_patient  = name
-    st.session_state.display_patient_name = name
-    st.session_state.just_loaded_patient  = True
+    st.session_state.display_patient_name = name or ""
+    st.session_state.just_loaded_patient  = bool(name)
 
-    def _dt(v):
-        if isinstance(v, date): return v
-        if isinstance(v, str):
-            try: return date.fromisoformat(v)
-            except: pass
-        return date.today()
-
-    # ── Patient detail widgets ──
-    st.session_state["geburtsdatum_input"]                = _dt(pd_.get("geburtsdatum"))
-    st.session_state["therapiebeginn_input"]              = _dt(pd_.get("therapiebeginn"))
-    st.session_state["geschlecht_input"]                  = pd_.get("geschlecht","M")
-    try:    st.session_state["groesse_input"]             = int(pd_.get("groesse") or 0)
-    except: st.session_state["groesse_input"]             = 0
-    try:    st.session_state["gewicht_input"]             = int(pd_.get("gewicht") or 0)
-    except: st.session_state["gewicht_input"]             = 0
-    try:    st.session_state["dauer_input"]               = int(pd_.get("dauer") or 6)
-    except: st.session_state["dauer_input"]               = 6
-    st.session_state["tw_besprochen_input"]               = pd_.get("tw_besprochen","Ja")
-    st.session_state["allergie_input"]                    = pd_.get("allergie","")
-    st.session_state["diagnosen_input"]                   = pd_.get("diagnosen","")
-    st.session_state["kontrolltermin_4_input"]            = bool(pd_.get("kontrolltermin_4",False))
-    st.session_state["kontrolltermin_12_input"]           = bool(pd_.get("kontrolltermin_12",False))
-    st.session_state["kontrolltermin_24_input"]           = bool(pd_.get("kontrolltermin_24",False))
-    st.session_state["kontrolltermin_kommentar_input"]    = pd_.get("kontrolltermin_kommentar","")
-    if pd_.get("kt4_date"):  st.session_state["kt4_date_input"]  = _dt(pd_.get("kt4_date"))
-    if pd_.get("kt12_date"): st.session_state["kt12_date_input"] = _dt(pd_.get("kt12_date"))
-    if pd_.get("kt24_date"): st.session_state["kt24_date_input"] = _dt(pd_.get("kt24_date"))
-
-    # ── Therapieplan widgets — map widget_key → tp dict key ──
-    _tp = tp or {}
-    _tp_map = {
-        "zaehne_checkbox":                   "zaehne",
-        "zaehne_zu_pruefen_input":           "zaehne_zu_pruefen",
-        "analyse_bewegungsapparat_checkbox": "analyse_bewegungsapparat",
-        "schwermetalltest_tp_checkbox":      "schwermetalltest_tp",
-        "lab_imd_cb":       "lab_imd_cb",   "lab_imd_input":       "lab_imd",
-        "lab_mmd_cb":       "lab_mmd_cb",   "lab_mmd_input":       "lab_mmd",
-        "lab_nextgen_cb":   "lab_nextgen_cb","lab_nextgen_input":   "lab_nextgen",
-        "lab_sonstiges_cb": "lab_sonstiges_cb","lab_sonstiges_input":"lab_sonstiges",
-        "darm_biofilm_checkbox":     "darm_biofilm",
-        "darmsanierung_checkbox":    "darmsanierung",
-        "darmsanierung_dauer_select":"darmsanierung_dauer",
-        "hydrocolon_checkbox":       "hydrocolon",
-        "parasiten_checkbox":        "parasiten",
-        "parasiten_bio_checkbox":    "parasiten_bio",
-        "leberdetox_checkbox":       "leberdetox",
-        "nierenprogramm_checkbox":   "nierenprogramm",
-        "mikronaehrstoffe_checkbox": "mikronaehrstoffe",
-        "infusionsbehandlung_checkbox":"infusionsbehandlung",
-        "neuraltherapie_checkbox":   "neuraltherapie",
-        "eigenblut_checkbox":        "eigenblut",
-        "ozontherapie_checkbox":     "ozontherapie",
-        "ausleitung_inf_checkbox":   "ausleitung_inf",
-        "ausleitung_oral_checkbox":  "ausleitung_oral",
-        "infektion_bakt_cb":         "infektion_bakt_cb",
-        "infektion_bakt_txt":        "infektion_bakt",
-        "infektion_virus_cb":        "infektion_virus_cb",
-        "infektion_virus_txt":       "infektion_virus",
-        "medikamente_text_cb":       "medikamente_text_cb",
-        "medikamente_text_txt":      "medikamente_text",
-        "bio_isopath_checkbox":      "bio_isopath",
-        "akupunktur_checkbox":       "akupunktur",
-        "homoeopathie_checkbox":     "homoeopathie",
-        "bioresonanz_checkbox":      "bioresonanz",
-        "timewaver_freq_checkbox":   "timewaver_freq",
-        "hypnose_checkbox":          "hypnose",
-        "hypnose_noreen_checkbox":   "hypnose_noreen",
-        "hypnose_martin_checkbox":   "hypnose_martin",
-        "hypnose_miro_checkbox":     "hypnose_miro",
-        "hypnose_typ_input":         "hypnose_typ",
-        "yager_checkbox":            "yager",
-        "energie_behandlungen_checkbox":"energie_behandlungen",
-        "atemtherapie":              "atemtherapie",
-        "atemtherapie_comment":      "atemtherapie_comment",
-        "bewegung":                  "bewegung",
-        "bewegung_comment":          "bewegung_comment",
-        "ernaehrung":                "ernaehrung",
-        "ernaehrung_comment":        "ernaehrung_comment",
-        "aethetisch_checkbox":       "aethetisch",
-        "aethetisch_comment_input":  "aethetisch_comment",
-        "aethetisch_botox_checkbox": "aethetisch_botox",
-        "aethetisch_prp_checkbox":   "aethetisch_prp",
-        "aethetisch_faeden_checkbox":"aethetisch_faeden",
-        "aethetisch_hyaloron_checkbox":"aethetisch_hyaloron",
-        "lowcarb":                   "lowcarb",
-        "lowcarb_comment":           "lowcarb_comment",
-        "fasten":                    "fasten",
-        "fasten_comment":            "fasten_comment",
-        "krebsdiaet":                "krebsdiaet",
-        "krebsdiaet_comment":        "krebsdiaet_comment",
-        "ketogene":                  "ketogene",
-        "ketogene_comment":          "ketogene_comment",
-        "basisch":                   "basisch",
-        "basisch_comment":           "basisch_comment",
-        "naehrstoff_ausgleich_cb":   "naehrstoff_ausgleich_cb",
-        "naehrstoff_ausgleich_input":"naehrstoff_ausgleich",
-        "therapie_sonstiges_cb":     "therapie_sonstiges_cb",
-        "therapie_sonstiges_input":  "therapie_sonstiges",
-        "zwischengespraech_4_checkbox":"zwischengespraech_4",
-        "zwischengespraech_8_checkbox":"zwischengespraech_8",
-    }
-    for wk, dk in _tp_map.items():
-        if dk in _tp:
-            st.session_state[wk] = _tp[dk]
-
-    # ── Infusion checkbox widgets ──
-    _inf = inf or {}
-    for ik in ["revita_immune","revita_immune_plus","revita_heal","revita_bludder",
-               "revita_ferro","revita_energy","revita_focus","revita_nad","revita_relax",
-               "revita_fit","revita_hangover","revita_beauty","revita_antiaging",
-               "revita_detox","revita_chelate","revita_liver","revita_leakygut",
-               "revita_infection","revita_joint","std_mito_energy","std_oxyvenierung",
-               "std_schwermetalltest","std_procain_basen","std_artemisinin",
-               "std_perioperative","std_detox_standard","std_detox_maxi",
-               "std_aufbauinfusion","std_anti_aging","std_nerven_aufbau",
-               "std_leberentgiftung","std_anti_oxidantien","std_aminoinfusion",
-               "std_relax_infusion","single_vitamin_c","single_vitamin_b_komplex",
-               "single_vitamin_d","single_vitamin_b6_b12_folsaeure","single_vitamin_b3"]:
-        if ik in _inf:
-            st.session_state[f"inf_{ik}_cb"] = bool(_inf[ik])
-    for wk in ["infektions_infusion_cb","immun_booster_cb","energetisierungsinfusion_cb",
-               "naehrstoffinfusion_cb","eisen_infusion_cb"]:
-        if wk in _inf: st.session_state[wk] = bool(_inf[wk])
-    for wk in ["infektions_infusion_inp","immun_booster_sel","energetisierungsinfusion_sel",
-               "naehrstoffinfusion_sel","eisen_infusion_inp"]:
-        base = wk.rsplit("_",1)[0]
-        if base in _inf: st.session_state[wk] = _inf[base]
-    if "zusaetze" in _inf: st.session_state["zusaetze_select"] = _inf["zusaetze"]
-
-    # ── Restore ALL timing widget keys (Wo von, Wo bis, Häufigkeit) ──
-    # Keys in tp/inf data: "{prefix}_{slug}_w_start", "{prefix}_{slug}_freq" etc.
-    # Widget keys: "ws_{prefix}_{slug}", "we_{prefix}_{slug}", "fr_{prefix}_{slug}"
-    for data_dict, prefix_list in [
-        (tp or {}, ["diag","haupt","bio","gesp"]),
-        (inf or {}, ["inf"]),
-    ]:
-        for k, v in data_dict.items():
-            if k.endswith("_w_start"):
-                base = k[:-len("_w_start")]
-                st.session_state[f"ws_{base}"] = str(v)
-            elif k.endswith("_w_end"):
-                base = k[:-len("_w_end")]
-                st.session_state[f"we_{base}"] = str(v)
-            elif k.endswith("_freq"):
-                base = k[:-len("_freq")]
-                st.session_state[f"fr_{base}"] = str(v) if v else ""
+    nem_changed = bool(_nem_rows_changed(old_nem, nem_index()["by_id"]))
+    if nem_changed:
+        reset_nem_grid()
+    for k in _stale_widget_keys(old_patient, old_stores, nem_changed):
+        del st.session_state[k]
+
+
+def _switch_patient(name):
+    """Load ``name`` into the session. Used as a widget callback: callbacks run
+    before the script, so the switch renders in the same pass as the click."""
+    if not name or name == st.session_state.get("last_loaded_patient"):
+        return
+    result = load_patient_data(name)
+    if result[0]:
+        _apply_patient_to_session(*result, name)
+        st.session_state.patient_name_input = name
+        st.session_state.patient_dropdown_select = name
+
+
+def _on_patient_selected():
+    sel = st.session_state.get("patient_dropdown_select")
+    if sel and sel != "— Patient auswählen —":
+        _switch_patient(sel)
+
+
+def _on_patient_typed():
+    """Exact name: load it. A new name while a patient is loaded starts an
+    empty patient under that name."""
+    typed = st.session_state.get("patient_name_input", "")
+    if typed and typed in get_patient_directory():
+        _switch_patient(typed)
+    elif typed and st.session_state.get("last_loaded_patient"):
+        _apply_patient_to_session({}, [], {}, {}, {}, None)
+        st.session_state.display_patient_name = typed
+        st.session_state.patient_dropdown_select = "— Patient auswählen —"
+
+
+# Header dropdown: one page of names from the database at a time, filtered
+# by the prefix in "picker_query" and cached in st.session_state.patient_picker
+# until the prefix changes or a save adds a name.
+PICKER_PAGE_SIZE = 50
 
-    # ── NEM: flag for main() to push after df is available ──
-    st.session_state["_pending_nem_push"] = True
+
+def patient_picker():
+    query = st.session_state.get("picker_query", "").strip()
+    picker = st.session_state.get("patient_picker")
+    if picker is None or picker["query"] != query:
+        names, more = search_patients(query, None, PICKER_PAGE_SIZE)
+        picker = st.session_state.patient_picker = {"query": query, "names": names, "more": more}
+    return picker
+
+
+def _load_more_patients():
+    picker = st.session_state.patient_picker
+    after = picker["names"][-1] if picker["names"] else None
+    names, more = search_patients(picker["query"], after, PICKER_PAGE_SIZE)
+    picker["names"] = picker["names"] + names
+    picker["more"] = more
 
 
 def patient_inputs():
-    patient_names_df = fetch_patient_names()
-    patient_names = patient_names_df["patient_name"].tolist() if not patient_names_df.empty else []
+    patient_directory = get_patient_directory()
 
     defaults = {
         "patient_data": {}, "nem_prescriptions": [], "therapieplan_data": {},
         "ernaehrung_data": {}, "infusion_data": {}, "last_loaded_patient": None,
-        "just_loaded_patient": False, "current_patient_input": "",
-        "clicked_suggestion": None, "display_patient_name": "",
+        "just_loaded_patient": False, "display_patient_name": "",
     }
     for k, v in defaults.items():
         if k not in st.session_state:
@@ -1425,7 +1447,8 @@ def patient_inputs():
     with hdr_col:
         st.markdown("#### Patientendaten")
     with dd_col:
-        dd_options = ["— Patient auswählen —"] + patient_names
+        picker = patient_picker()
+        dd_options = ["— Patient auswählen —"] + picker["names"]
         dd_key = "patient_dropdown_select"
         # Apply deferred dropdown resets (must happen before widget renders)
         if st.session_state.pop("_reset_dropdown", False):
@@ -1434,72 +1457,57 @@ def patient_inputs():
             st.session_state[dd_key] = st.session_state.pop("_set_dropdown")
         # After first render Streamlit stores the selected string, not an int
         _stored = st.session_state.get(dd_key, "— Patient auswählen —")
+        # The current patient stays selectable when it isn't on a loaded page
+        if isinstance(_stored, str) and _stored and _stored not in dd_options:
+            dd_options.insert(1, _stored)
         if isinstance(_stored, int):
             _dd_idx = min(_stored, len(dd_options) - 1)
         elif isinstance(_stored, str) and _stored in dd_options:
             _dd_idx = dd_options.index(_stored)
         else:
             _dd_idx = 0
-        sel_idx = st.selectbox("", dd_options, index=_dd_idx,
-            key=dd_key, label_visibility="collapsed")
-        if sel_idx and sel_idx != "— Patient auswählen —" and sel_idx != st.session_state.get("last_loaded_patient"):
-            st.session_state.clicked_suggestion = sel_idx
-
-    # ── Load patient (from dropdown or suggestion button) ──
-    if st.session_state.clicked_suggestion:
-        name   = st.session_state.clicked_suggestion
-        result = load_patient_data(name)
-        if result[0]:
-            _apply_patient_to_session(*result, name)
-        st.session_state.clicked_suggestion = None
-        st.rerun()
-
-    display_value = (st.session_state.display_patient_name
-                     if st.session_state.display_patient_name
-                     else st.session_state.patient_data.get("patient", ""))
-
+        st.selectbox("", dd_options, index=_dd_idx,
+            key=dd_key, label_visibility="collapsed", on_change=_on_patient_selected)
+        q_col, more_col = st.columns([3, 1])
+        with q_col:
+            st.text_input("Patienten filtern", key="picker_query",
+                placeholder="Namensanfang filtern…", label_visibility="collapsed")
+        with more_col:
+            if picker["more"]:
+                st.button("Mehr laden", key="picker_more", on_click=_load_more_patients,
+                          use_container_width=True)
+
+    if "patient_name_input" not in st.session_state:
+        st.session_state.patient_name_input = (st.session_state.display_patient_name
+                                               or st.session_state.patient_data.get("patient", ""))
     typed = st.text_input(
         "Name eingeben (Enter für Vorschläge) oder oben aus Dropdown wählen:",
-        value=display_value, placeholder="Vor- und Nachname",
+        key="patient_name_input", on_change=_on_patient_typed, placeholder="Vor- und Nachname",
     )
 
-    if typed != st.session_state.current_patient_input:
-        st.session_state.current_patient_input = typed
-        if (st.session_state.last_loaded_patient and typed and typed not in patient_names):
-            for k in ["patient_data","nem_prescriptions","therapieplan_data","ernaehrung_data","infusion_data"]:
-                st.session_state[k] = {} if k != "nem_prescriptions" else []
-            st.session_state.last_loaded_patient = None
-            st.session_state.display_patient_name = ""
-            st.session_state.just_loaded_patient = False
-            st.rerun()
-
     st.session_state.display_patient_name = typed
 
     # Vorschläge: show matching buttons when typing
-    if typed and typed not in patient_names and not st.session_state.just_loaded_patient:
-        _typed_words = [w.strip() for w in typed.lower().split() if w.strip()]
-        suggestions = [n for n in patient_names if any(w in n.lower() for w in _typed_words)]
+    if typed and typed not in patient_directory:
+        suggestions = patient_directory.search(typed, limit=9)
         if suggestions:
             st.markdown("**Vorschläge:**")
             cols = st.columns(min(len(suggestions), 3))
-            for i, name in enumerate(suggestions[:9]):
+            for i, name in enumerate(suggestions):
                 with cols[i % 3]:
-                    if st.button(name, key=f"suggest_{name}", use_container_width=True):
-                        st.session_state.clicked_suggestion = name
-                        st.rerun()
-
-    # Auto-load when exact name is typed
-    if (typed and typed in patient_names
-            and typed != st.session_state.last_loaded_patient
-            and not st.session_state.just_loaded_patient):
-        result = load_patient_data(typed)
-        if result[0]:
-            _apply_patient_to_session(*result, typed)
-        st.rerun()
+                    st.button(name, key=f"suggest_{name}", use_container_width=True,
+                              on_click=_switch_patient, args=(name,))
 
     if st.session_state.just_loaded_patient:
         st.session_state.just_loaded_patient = False
 
+    return patient_details(typed)
+
+
+@st.fragment
+def patient_details(name):
+    """Patient detail widgets. Reruns on its own; the result is shared with
+    the tabs and the save handler through st.session_state.patient_header."""
     pdata = st.session_state.patient_data or {}
 
     def parse_date(v):
@@ -1527,28 +1535,28 @@ def patient_inputs():
     c1,c2,c3,c4,c5,c6,c7 = st.columns(7)
     with c1:
         geburtsdatum = st.date_input("Geburtsdatum", value=default_geburtsdatum,
-            min_value=date(1900,1,1), max_value=date.today(), format="DD.MM.YYYY", key="geburtsdatum_input")
+            min_value=date(1900,1,1), max_value=date.today(), format="DD.MM.YYYY", key=widget_key("geburtsdatum_input", "patient", "geburtsdatum"))
     with c2:
         geschlecht = st.radio("Geschlecht", ["M","W"], horizontal=True,
-            index=0 if default_geschlecht=="M" else 1, key="geschlecht_input")
+            index=0 if default_geschlecht=="M" else 1, key=widget_key("geschlecht_input", "patient", "geschlecht"))
     with c3:
-        groesse = st.number_input("Grösse (cm)", min_value=0, value=default_groesse, key="groesse_input")
+        groesse = st.number_input("Grösse (cm)", min_value=0, value=default_groesse, key=widget_key("groesse_input", "patient", "groesse"))
     with c4:
-        gewicht = st.number_input("Gewicht (kg)", min_value=0, value=default_gewicht, key="gewicht_input")
+        gewicht = st.number_input("Gewicht (kg)", min_value=0, value=default_gewicht, key=widget_key("gewicht_input", "patient", "gewicht"))
     with c5:
         therapiebeginn = st.date_input("Therapiebeginn", value=default_therapiebeginn,
-            format="DD.MM.YYYY", key="therapiebeginn_input")
+            format="DD.MM.YYYY", key=widget_key("therapiebeginn_input", "patient", "therapiebeginn"))
     with c6:
         dauer = st.selectbox("Dauer (Monate)", list(range(1,13)),
-            index=default_dauer_value-1 if 1<=default_dauer_value<=12 else 5, key="dauer_input")
+            index=default_dauer_value-1 if 1<=default_dauer_value<=12 else 5, key=widget_key("dauer_input", "patient", "dauer"))
     with c7:
         tw_besprochen = st.radio("TW besprochen?", ["Ja","Nein"], horizontal=True,
-            index=0 if default_tw_besprochen=="Ja" else 1, key="tw_besprochen_input")
+            index=0 if default_tw_besprochen=="Ja" else 1, key=widget_key("tw_besprochen_input", "patient", "tw_besprochen"))
 
     bekannte_allergie = st.text_area("Bekannte Allergien", value=default_allergie, height=90,
-        placeholder="Bekannte Allergien eintragen...", key="allergie_input")
+        placeholder="Bekannte Allergien eintragen...", key=widget_key("allergie_input", "patient", "allergie"))
     diagnosen = st.text_area("Diagnosen", value=default_diagnosen, height=160,
-        placeholder="Relevante Diagnosen...", key="diagnosen_input")
+        placeholder="Relevante Diagnosen...", key=widget_key("diagnosen_input", "patient", "diagnosen"))
 
     st.markdown("---")
     st.markdown("#### Kontrolltermine")
@@ -1558,13 +1566,13 @@ def patient_inputs():
     _kt12_ok = _total_weeks >= 12
     _kt24_ok = _total_weeks >= 24
     with col1:
-        kontrolltermin_4  = st.checkbox("4 Wochen",  value=default_kt4  and _kt4_ok,  key="kontrolltermin_4_input",  disabled=not _kt4_ok,  help=None if _kt4_ok  else f"Dauer {dauer} Mon. zu kurz")
+        kontrolltermin_4  = st.checkbox("4 Wochen",  value=default_kt4  and _kt4_ok,  key=widget_key("kontrolltermin_4_input", "patient", "kontrolltermin_4"),  disabled=not _kt4_ok,  help=None if _kt4_ok  else f"Dauer {dauer} Mon. zu kurz")
     with col2:
-        kontrolltermin_12 = st.checkbox("12 Wochen", value=default_kt12 and _kt12_ok, key="kontrolltermin_12_input", disabled=not _kt12_ok, help=None if _kt12_ok else f"Dauer {dauer} Mon. zu kurz")
+        kontrolltermin_12 = st.checkbox("12 Wochen", value=default_kt12 and _kt12_ok, key=widget_key("kontrolltermin_12_input", "patient", "kontrolltermin_12"), disabled=not _kt12_ok, help=None if _kt12_ok else f"Dauer {dauer} Mon. zu kurz")
     with col3:
-        kontrolltermin_24 = st.checkbox("24 Wochen", value=default_kt24 and _kt24_ok, key="kontrolltermin_24_input", disabled=not _kt24_ok, help=None if _kt24_ok else f"Dauer {dauer} Mon. zu kurz")
+        kontrolltermin_24 = st.checkbox("24 Wochen", value=default_kt24 and _kt24_ok, key=widget_key("kontrolltermin_24_input", "patient", "kontrolltermin_24"), disabled=not _kt24_ok, help=None if _kt24_ok else f"Dauer {dauer} Mon. zu kurz")
     kontrolltermin_kommentar = st.text_area("Kommentar:", value=default_kt_kommentar, height=100,
-        placeholder="Kommentar zu Kontrollterminen...", key="kontrolltermin_kommentar_input")
+        placeholder="Kommentar zu Kontrollterminen...", key=widget_key("kontrolltermin_kommentar_input", "patient", "kontrolltermin_kommentar"))
 
     # Editable Kontrolltermin dates (shown only when checked)
     kt4_date = kt12_date = kt24_date = None
@@ -1574,17 +1582,17 @@ def patient_inputs():
             def_kt4d = parse_date(pdata.get("kt4_date", (therapiebeginn + timedelta(weeks=4)).isoformat()))
             with kd1:
                 kt4_date = st.date_input("Datum 4 Wochen", value=def_kt4d,
-                    format="DD.MM.YYYY", key="kt4_date_input")
+                    format="DD.MM.YYYY", key=widget_key("kt4_date_input", "patient", "kt4_date"))
         if kontrolltermin_12:
             def_kt12d = parse_date(pdata.get("kt12_date", (therapiebeginn + timedelta(weeks=12)).isoformat()))
             with kd2:
                 kt12_date = st.date_input("Datum 12 Wochen", value=def_kt12d,
-                    format="DD.MM.YYYY", key="kt12_date_input")
+                    format="DD.MM.YYYY", key=widget_key("kt12_date_input", "patient", "kt12_date"))
         if kontrolltermin_24:
             def_kt24d = parse_date(pdata.get("kt24_date", (therapiebeginn + timedelta(weeks=96)).isoformat()))
             with kd3:
                 kt24_date = st.date_input("Datum 24 Monate", value=def_kt24d,
-                    format="DD.MM.YYYY", key="kt24_date_input")
+                    format="DD.MM.YYYY", key=widget_key("kt24_date_input", "patient", "kt24_date"))
 
     st.markdown("---")
     therapy_progress_bar(
@@ -1593,8 +1601,8 @@ def patient_inputs():
         kt4_date=kt4_date, kt12_date=kt12_date, kt24_date=kt24_date,
     )
 
-    return {
-        "patient": typed, "geburtsdatum": geburtsdatum, "geschlecht": geschlecht,
+    header = {
+        "patient": name, "geburtsdatum": geburtsdatum, "geschlecht": geschlecht,
         "groesse": groesse, "gewicht": gewicht, "therapiebeginn": therapiebeginn,
         "dauer": dauer, "tw_besprochen": tw_besprochen, "allergie": bekannte_allergie,
         "diagnosen": diagnosen, "kontrolltermin_4": kontrolltermin_4,
@@ -1602,473 +1610,543 @@ def patient_inputs():
         "kontrolltermin_kommentar": kontrolltermin_kommentar,
         "kt4_date": kt4_date, "kt12_date": kt12_date, "kt24_date": kt24_date,
     }
+    st.session_state.patient_header = header
 
-
-# =========================================================
-# MAIN
-# =========================================================
-def main():
-    df = fetch_supplements()
-
-    if st.session_state.get('just_loaded_patient', False):
-        st.session_state.just_loaded_patient = False
-
-    # ── Full wipe after delete ───────────────────────────────────────────
-    # st.session_state.clear() removes ALL keys including widget keys.
-    # This is safe here because we are BEFORE patient_inputs() renders,
-    # so no widgets have been instantiated in this run yet.
-    if st.session_state.get("_do_full_wipe"):
-        st.session_state.clear()
-        st.session_state["patient_data"]      = {}
-        st.session_state["nem_prescriptions"] = []
-        st.session_state["therapieplan_data"] = {}
-        st.session_state["ernaehrung_data"]   = {}
-        st.session_state["infusion_data"]     = {}
-        st.session_state["_reset_dropdown"]   = True
+    # The tabs' timing rows are computed from Therapiebeginn and Dauer, so a
+    # change to either has to rerun the whole app, not just this fragment.
+    rendered_with = st.session_state.get("_tabs_rendered_with")
+    if rendered_with is not None and rendered_with != (therapiebeginn, dauer):
         st.rerun()
+    return header
 
-    patient = patient_inputs()
-
-    # ── Push NEM prescription values into widget keys after patient load ──
-    if st.session_state.pop("_pending_nem_push", False):
-        for presc in (st.session_state.nem_prescriptions or []):
-            s_name = presc.get("name","")
-            match = df[df["name"] == s_name]
-            if match.empty: continue
-            row_id = match.iloc[0]["id"]
-            # Force-set widget keys so they display loaded values on next render
-            st.session_state[f"{row_id}_gesamt_dosierung"]  = presc.get("Gesamt-dosierung","")
-            st.session_state[f"{row_id}_darreichungsform"]  = presc.get("Darreichungsform", DEFAULT_FORMS.get(s_name,"Kapseln"))
-            st.session_state[f"{row_id}_pro_Einnahme"]      = presc.get("Pro Einnahme","")
-            st.session_state[f"{row_id}_Nuechtern"]         = presc.get("Nüchtern","")
-            st.session_state[f"{row_id}_Morgens"]           = presc.get("Morgens","")
-            st.session_state[f"{row_id}_Mittags"]           = presc.get("Mittags","")
-            st.session_state[f"{row_id}_Abends"]            = presc.get("Abends","")
-            st.session_state[f"{row_id}_Nachts"]            = presc.get("Nachts","")
-            st.session_state[f"{row_id}_comment"]           = presc.get("Kommentar","")
-
-    for _, row in df.iterrows():
-        override_key = f"gesamt_dosierung_override_{row['id']}"
-        if override_key not in st.session_state:
-            st.session_state[override_key] = None
-
-    for k in ['show_delete_confirmation','show_save_success']:
-        if k not in st.session_state:
-            st.session_state[k] = False
-    if 'auto_download_pdf' not in st.session_state:
-        st.session_state.auto_download_pdf = None
-    if 'nem_pdf_bytes' not in st.session_state:
-        st.session_state.nem_pdf_bytes = None
-
-    patient_names_df = fetch_patient_names()
-    patient_names = patient_names_df["patient_name"].tolist() if not patient_names_df.empty else []
-    # Also treat as saved if we just saved this patient (DB list may be stale)
-    _just_saved = st.session_state.get("_just_saved_patient", "")
-    is_saved_patient = bool(
-        patient["patient"] and (
-            patient["patient"] in patient_names or
-            patient["patient"] == _just_saved
-        )
-    )
-
-    # ── Action buttons row ──────────────────────────────────────────────────
-    if "show_delete_confirmation" not in st.session_state:
-        st.session_state.show_delete_confirmation = False
-    _btn_cols = st.columns([1, 1, 6])
-    with _btn_cols[0]:
-        save_button = st.button("💾 Speichern", key="save_btn_main", use_container_width=True)
-    with _btn_cols[1]:
-        # Always render button (avoids widget key lifecycle issues),
-        # but only enable it for saved patients
-        del_clicked = st.button("🗑 Löschen", key="del_btn_main",
-                                use_container_width=True,
-                                disabled=not is_saved_patient)
-        if del_clicked and is_saved_patient:
-            st.session_state.show_delete_confirmation = True
-
-    delete_button = False  # legacy compat
-
-    if st.session_state.get("show_save_success", False):
-        st.markdown('<div class="success-message">✅ Alle Daten wurden erfolgreich gespeichert!</div>', unsafe_allow_html=True)
-        time.sleep(3)
-        st.session_state.show_save_success = False
-        st.rerun()
-
-    if st.session_state.get("show_delete_confirmation", False):
-        st.markdown("---")
-        st.warning("⚠️ **ACHTUNG: Dieser Vorgang kann nicht rückgängig gemacht werden!**")
-        st.error(f"Das Löschen wird alle Daten für Patient '{patient['patient']}' unwiderruflich entfernen.")
-        cc1, cc2 = st.columns(2)
-        with cc1:
-            if st.button("Ja, endgültig löschen", use_container_width=True, key="confirm_delete"):
-                if delete_patient_data(patient["patient"]):
-                    # DB deleted. Now wipe session state via two-pass flag.
-                    st.session_state["_do_full_wipe"] = True
-                    st.rerun()
-                else:
-                    st.error("Fehler beim Löschen — prüfen Sie die Konsole.")
-        with cc2:
-            if st.button("Abbrechen", use_container_width=True, key="cancel_delete"):
-                st.session_state.show_delete_confirmation = False
-                st.info("Löschen abgebrochen")
-                st.rerun()
-
-    st.markdown("---")
-    tabs = st.tabs(["Therapieplan", "Nahrungsergänzungsmittel (NEM)", "Infusionstherapie"])
 
-    # =========================================================
-    # TAB 0: THERAPIEPLAN
-    # Left side: exact Doc3 content unchanged.
-    # Each checkbox row wrapped in st.columns(ROW_COLS) so timing
-    # inputs appear inline on the same row — no separate right panel.
-    # =========================================================
-    with tabs[0]:
-        tp = st.session_state.therapieplan_data
-        therapieplan_schedule_data = {}
-
-        def _row(label, cb_key, cb_val, slug, kp, no_auto_date=False):
+# =========================================================
+# TAB 0: THERAPIEPLAN
+# Left side: exact Doc3 content unchanged.
+# Each checkbox row wrapped in st.columns(ROW_COLS) so timing
+# inputs appear inline on the same row — no separate right panel.
+# =========================================================
+@st.fragment
+def therapieplan_tab():
+    patient = st.session_state.patient_header
+    tp = st.session_state.therapieplan_data
+    therapieplan_schedule_data = {}
+
+    def _row(label, cb_key, cb_val, slug, kp, no_auto_date=False):
+        cols = st.columns(ROW_COLS)
+        with cols[0]:
+            checked = st.checkbox(label, value=cb_val, key=widget_key(cb_key, "tab", slug))
+        _tb = None if (no_auto_date and not tp.get(f"{kp}_{slug}_date_start")) else patient["therapiebeginn"]
+        therapieplan_schedule_data.update(
+            _inline_timing(checked, slug, _tb, patient["dauer"], kp, tp, cols))
+        return checked
+
+    # ---- SECTION 1: Diagnostik & Überprüfung ----
+    with st.expander("Diagnostik", expanded=tp.get("_sec_diagnostik_open", True)):
+        _sched_header()
+        st.markdown('<div class="section-subheader">Zähne</div>', unsafe_allow_html=True)
+        zaehne = _row(
+            "Überprüfung der Zähne/Kieferknochen mittels OPG (Panoramaaufnahme mit lachendem Gebiss) / DVT",
+            "zaehne_checkbox", tp.get("zaehne", False), "zaehne", "diag", no_auto_date=True)
+        zaehne_zu_pruefen = ""
+        if zaehne:
+            zaehne_zu_pruefen = st.text_input("Zähne zu überprüfen (OPG/DVT):",
+                value=tp.get("zaehne_zu_pruefen", ""), key=widget_key("zaehne_zu_pruefen_input", "tab", "zaehne_zu_pruefen"))
+
+        st.markdown('<div class="section-subheader">Bewegungsapparat & Schwermetalltest</div>', unsafe_allow_html=True)
+        analyse_bewegungsapparat = _row("Analyse Bewegungsapparat (Martin)",
+            "analyse_bewegungsapparat_checkbox", tp.get("analyse_bewegungsapparat", False),
+            "analyse_bewegungsapparat", "diag", no_auto_date=True)
+        schwermetalltest_tp = _row("Schwermetalltest mit DMSA und Ca EDTA",
+            "schwermetalltest_tp_checkbox", tp.get("schwermetalltest_tp", False),
+            "schwermetalltest_tp", "diag", no_auto_date=True)
+
+        st.markdown('<div class="section-subheader">Labor & Diagnostik</div>', unsafe_allow_html=True)
+
+        def _text_timing(label, key_input, key_slug, kp, no_auto_date=False):
+            """Checkbox + text input on left (same row), timing on right."""
+            cb_key = key_input + "_cb"
             cols = st.columns(ROW_COLS)
             with cols[0]:
-                checked = st.checkbox(label, value=cb_val, key=cb_key)
-            _tb = None if (no_auto_date and not tp.get(f"{kp}_{slug}_date_start")) else patient["therapiebeginn"]
+                r1, r2 = st.columns([2.0, 2.0])
+                with r1: checked = st.checkbox(label, value=tp.get(cb_key, False), key=widget_key(cb_key, "tab", cb_key))
+                with r2: val = st.text_input("", value=tp.get(key_input, ""),
+                    key=widget_key(key_input + "_input", "tab", key_input), placeholder="Details...",
+                    label_visibility="collapsed", disabled=not checked)
+            _tb = None if (no_auto_date and not tp.get(f"{kp}_{key_slug}_date_start")) else patient["therapiebeginn"]
             therapieplan_schedule_data.update(
-                _inline_timing(checked, slug, _tb, patient["dauer"], kp, tp, cols))
-            return checked
-
-        # ---- SECTION 1: Diagnostik & Überprüfung ----
-        with st.expander("Diagnostik", expanded=tp.get("_sec_diagnostik_open", True)):
-            _sched_header()
-            st.markdown('<div class="section-subheader">Zähne</div>', unsafe_allow_html=True)
-            zaehne = _row(
-                "Überprüfung der Zähne/Kieferknochen mittels OPG (Panoramaaufnahme mit lachendem Gebiss) / DVT",
-                "zaehne_checkbox", tp.get("zaehne", False), "zaehne", "diag", no_auto_date=True)
-            zaehne_zu_pruefen = ""
-            if zaehne:
-                zaehne_zu_pruefen = st.text_input("Zähne zu überprüfen (OPG/DVT):",
-                    value=tp.get("zaehne_zu_pruefen", ""), key="zaehne_zu_pruefen_input")
-
-            st.markdown('<div class="section-subheader">Bewegungsapparat & Schwermetalltest</div>', unsafe_allow_html=True)
-            analyse_bewegungsapparat = _row("Analyse Bewegungsapparat (Martin)",
-                "analyse_bewegungsapparat_checkbox", tp.get("analyse_bewegungsapparat", False),
-                "analyse_bewegungsapparat", "diag", no_auto_date=True)
-            schwermetalltest_tp = _row("Schwermetalltest mit DMSA und Ca EDTA",
-                "schwermetalltest_tp_checkbox", tp.get("schwermetalltest_tp", False),
-                "schwermetalltest_tp", "diag", no_auto_date=True)
-
-            st.markdown('<div class="section-subheader">Labor & Diagnostik</div>', unsafe_allow_html=True)
-
-            def _text_timing(label, key_input, key_slug, kp, no_auto_date=False):
-                """Checkbox + text input on left (same row), timing on right."""
-                cb_key = key_input + "_cb"
-                cols = st.columns(ROW_COLS)
-                with cols[0]:
-                    r1, r2 = st.columns([2.0, 2.0])
-                    with r1: checked = st.checkbox(label, value=tp.get(cb_key, False), key=cb_key)
-                    with r2: val = st.text_input("", value=tp.get(key_input, ""),
-                        key=key_input + "_input", placeholder="Details...",
-                        label_visibility="collapsed", disabled=not checked)
-                _tb = None if (no_auto_date and not tp.get(f"{kp}_{key_slug}_date_start")) else patient["therapiebeginn"]
-                therapieplan_schedule_data.update(
-                    _inline_timing(checked, key_slug, _tb, patient["dauer"], kp, tp, cols))
-                tp[cb_key] = checked
-                return val if checked else ""
-
-            lab_imd       = _text_timing("IMD:",          "lab_imd",       "lab_imd",       "diag", no_auto_date=True)
-            lab_mmd       = _text_timing("MMD:",          "lab_mmd",       "lab_mmd",       "diag", no_auto_date=True)
-            lab_nextgen   = _text_timing("NextGen Onco:", "lab_nextgen",   "lab_nextgen",   "diag", no_auto_date=True)
-            lab_sonstiges = _text_timing("Sonstiges:",    "lab_sonstiges", "lab_sonstiges", "diag", no_auto_date=True)
-            _extra_rows("diag", "diag", tp, patient["therapiebeginn"], patient["dauer"], therapieplan_schedule_data, no_auto_date=True)
-
-        # ---- SECTION 2: Haupttherapien ----
-        with st.expander("Haupttherapien", expanded=tp.get("_sec_haupttherapien_open", False)):
-            _sched_header()
-            st.markdown('<div class="section-subheader">Darm & Entgiftung</div>', unsafe_allow_html=True)
-            darm_biofilm = _row(
-                "Darm - Biofilmentfernung nach www.regenbogenkreis.de (Express-Darmkur 4 Tageskur)",
-                "darm_biofilm_checkbox", tp.get("darm_biofilm", False), "darm_biofilm", "haupt")
-            darmsanierung = _row("Darmsanierung nach Paracelsus Klinik (Rezept von Praxis)",
-                "darmsanierung_checkbox", tp.get("darmsanierung", False), "darmsanierung", "haupt")
-            darmsanierung_dauer = []
-            if darmsanierung:
-                darmsanierung_dauer = st.multiselect("Darmsanierung Dauer:", ["4 Wo","6 Wo","8 Wo"],
-                    default=tp.get("darmsanierung_dauer", []), key="darmsanierung_dauer_select")
-            hydrocolon = _row(
-                "mit Hydrocolon (Darmspülung) 2x insgesamt, Abstand 14 Tage mit Rekolonisierungs-Shot",
-                "hydrocolon_checkbox", tp.get("hydrocolon", False), "hydrocolon", "haupt")
-            parasiten = _row("Parasitenbehandlung mit Vermox (3 Tage)",
-                "parasiten_checkbox", tp.get("parasiten", False), "parasiten", "haupt")
-            parasiten_bio = _row("Biologisches Parasitenprogramm (z. B. www.drclarkcenter.de)",
-                "parasiten_bio_checkbox", tp.get("parasiten_bio", False), "parasiten_bio", "haupt")
-            leberdetox = _row("Leberdetox Behandlung nach Paracelsus Klinik (2-Tageskur, 4–5x alle 4–6 Wochen)",
-                "leberdetox_checkbox", tp.get("leberdetox", False), "leberdetox", "haupt")
-            nierenprogramm = _row("Nierenprogramm nach Dr. Clark – 4 Wochen",
-                "nierenprogramm_checkbox", tp.get("nierenprogramm", False), "nierenprogramm", "haupt")
-            mikronaehrstoffe = _row("Einnahme Mikronährstoffen (NEM-Verordnung) (siehe separate PDF)",
-                "mikronaehrstoffe_checkbox", tp.get("mikronaehrstoffe", False), "mikronaehrstoffe", "haupt")
-            infusionsbehandlung = _row("Infusionstherapie (siehe separate PDF)",
-                "infusionsbehandlung_checkbox", tp.get("infusionsbehandlung", False), "infusionsbehandlung", "haupt")
-            neuraltherapie = _row("Neuraltherapie",
-                "neuraltherapie_checkbox", tp.get("neuraltherapie", False), "neuraltherapie", "haupt")
-            eigenblut = _row("Eigenbluttherapie",
-                "eigenblut_checkbox", tp.get("eigenblut", False), "eigenblut", "haupt")
-            ozontherapie = _row("Ozontherapie",
-                "ozontherapie_checkbox", tp.get("ozontherapie", False), "ozontherapie", "haupt")
-
-            st.markdown('<div class="section-subheader">Ausleitung & Infektionen</div>', unsafe_allow_html=True)
-            ausleitung_inf = _row("Schwermetallausleitung Infusion (siehe separate Infusion PDF)",
-                "ausleitung_inf_checkbox", tp.get("ausleitung_inf", False), "ausleitung_inf", "haupt")
-            ausleitung_oral = _row("Schwermetallausleitung oral",
-                "ausleitung_oral_checkbox", tp.get("ausleitung_oral", False), "ausleitung_oral", "haupt")
-            # Checkbox rows with free-text detail field (label visible, checkbox prescribes it)
-            def _cb_text_row(label, cb_key, text_key, cb_val, text_val, slug, kp):
-                cols = st.columns(ROW_COLS)
-                with cols[0]:
-                    r1, r2 = st.columns([2.0, 2.0])
-                    with r1: checked = st.checkbox(label, value=cb_val, key=cb_key)
-                    with r2: txt = st.text_input("", value=text_val, key=text_key+"_txt",
-                        placeholder="Details...", label_visibility="collapsed")
-                therapieplan_schedule_data.update(
-                    _inline_timing(checked, slug, patient["therapiebeginn"], patient["dauer"], kp, tp, cols))
-                return checked, txt
-
-            infektion_bakt, infektion_bakt_detail = _cb_text_row(
-                "Infektionsbehandlung für Bakterien (Borr./Helicob.)",
-                "infektion_bakt_cb", "infektion_bakt",
-                tp.get("infektion_bakt_cb", False), tp.get("infektion_bakt", ""),
-                "infektion_bakt", "haupt")
-            infektion_virus, infektion_virus_detail = _cb_text_row(
-                "Infektionsbehandlung für Viren (EBV, HPV, Herpes, Corona)",
-                "infektion_virus_cb", "infektion_virus",
-                tp.get("infektion_virus_cb", False), tp.get("infektion_virus", ""),
-                "infektion_virus", "haupt")
-            medikamente_text, medikamente_text_detail = _cb_text_row(
-                "Medikamentenverordnung - Rezept für",
-                "medikamente_text_cb", "medikamente_text",
-                tp.get("medikamente_text_cb", False), tp.get("medikamente_text", ""),
-                "medikamente_text", "haupt")
-            _extra_rows("haupt", "haupt", tp, patient["therapiebeginn"], patient["dauer"], therapieplan_schedule_data)
-
-        # ---- SECTION 3: Biologische & Komplementäre Therapien ----
-        with st.expander("Biologische & Komplementäre Therapien", expanded=tp.get("_sec_bio_open", False)):
-            _sched_header()
-            bio_isopath = _row("Biologische Isopathische Therapie",
-                "bio_isopath_checkbox", tp.get("bio_isopath", False), "bio_isopath", "bio")
-            akupunktur = _row("Akupunktur",
-                "akupunktur_checkbox", tp.get("akupunktur", False), "akupunktur", "bio")
-            homoeopathie = _row("Homöopathie (Anna)",
-                "homoeopathie_checkbox", tp.get("homoeopathie", False), "homoeopathie", "bio")
-            bioresonanz = _row("Bioresonanz (Anna)",
-                "bioresonanz_checkbox", tp.get("bioresonanz", False), "bioresonanz", "bio")
-            timewaver_freq = _row("TimeWaver Frequency Behandlung",
-                "timewaver_freq_checkbox", tp.get("timewaver_freq", False), "timewaver_freq", "bio")
-
-            st.markdown('<div class="section-subheader">Hypnosetherapie</div>', unsafe_allow_html=True)
-            hypnose = _row("Hypnosetherapie",
-                "hypnose_checkbox", tp.get("hypnose", False), "hypnose", "bio")
-            # Noreen / Martin / Miro compact on left, Hypnose Typ wide on right
-            hc1, hc2, hc3, hc4, hc5 = st.columns([0.7, 0.7, 0.7, 0.3, 2.6])
-            with hc1: hypnose_noreen = st.checkbox("Noreen", value=tp.get("hypnose_noreen", False), key="hypnose_noreen_checkbox")
-            with hc2: hypnose_martin = st.checkbox("Martin", value=tp.get("hypnose_martin", False), key="hypnose_martin_checkbox")
-            with hc3: hypnose_miro   = st.checkbox("Miro",   value=tp.get("hypnose_miro",   False), key="hypnose_miro_checkbox")
-            with hc4: st.markdown("<div style='padding-top:8px;font-size:14px;white-space:nowrap;'>Typ:</div>", unsafe_allow_html=True)
-            with hc5: hypnose_typ = st.text_input("", key="hypnose_typ_input", placeholder="Hypnose Typ...",
-                    label_visibility="collapsed", value=tp.get("hypnose_typ", ""))
-            yager = _row("Yagertherapie", "yager_checkbox", tp.get("yager", False), "yager", "bio")
-            energie_behandlungen = _row("Energiebehandlungen bei Marie",
-                "energie_behandlungen_checkbox", tp.get("energie_behandlungen", False), "energie_behandlungen", "bio")
-
-            st.markdown('<div class="section-subheader">Ernährung & Bewegung</div>', unsafe_allow_html=True)
-
-            def tight_row(label, key_cb, key_input, cb_val, input_val):
-                cols = st.columns(ROW_COLS)
-                with cols[0]:
+                _inline_timing(checked, key_slug, _tb, patient["dauer"], kp, tp, cols))
+            tp[cb_key] = checked
+            return val if checked else ""
+
+        lab_imd       = _text_timing("IMD:",          "lab_imd",       "lab_imd",       "diag", no_auto_date=True)
+        lab_mmd       = _text_timing("MMD:",          "lab_mmd",       "lab_mmd",       "diag", no_auto_date=True)
+        lab_nextgen   = _text_timing("NextGen Onco:", "lab_nextgen",   "lab_nextgen",   "diag", no_auto_date=True)
+        lab_sonstiges = _text_timing("Sonstiges:",    "lab_sonstiges", "lab_sonstiges", "diag", no_auto_date=True)
+        _extra_rows("diag", "diag", tp, patient["therapiebeginn"], patient["dauer"], therapieplan_schedule_data, no_auto_date=True)
+
+    # ---- SECTION 2: Haupttherapien ----
+    with st.expander("Haupttherapien", expanded=tp.get("_sec_haupttherapien_open", False)):
+        _sched_header()
+        st.markdown('<div class="section-subheader">Darm & Entgiftung</div>', unsafe_allow_html=True)
+        darm_biofilm = _row(
+            "Darm - Biofilmentfernung nach www.regenbogenkreis.de (Express-Darmkur 4 Tageskur)",
+            "darm_biofilm_checkbox", tp.get("darm_biofilm", False), "darm_biofilm", "haupt")
+        darmsanierung = _row("Darmsanierung nach Paracelsus Klinik (Rezept von Praxis)",
+            "darmsanierung_checkbox", tp.get("darmsanierung", False), "darmsanierung", "haupt")
+        darmsanierung_dauer = []
+        if darmsanierung:
+            darmsanierung_dauer = st.multiselect("Darmsanierung Dauer:", ["4 Wo","6 Wo","8 Wo"],
+                default=tp.get("darmsanierung_dauer", []), key=widget_key("darmsanierung_dauer_select", "tab", "darmsanierung_dauer"))
+        hydrocolon = _row(
+            "mit Hydrocolon (Darmspülung) 2x insgesamt, Abstand 14 Tage mit Rekolonisierungs-Shot",
+            "hydrocolon_checkbox", tp.get("hydrocolon", False), "hydrocolon", "haupt")
+        parasiten = _row("Parasitenbehandlung mit Vermox (3 Tage)",
+            "parasiten_checkbox", tp.get("parasiten", False), "parasiten", "haupt")
+        parasiten_bio = _row("Biologisches Parasitenprogramm (z. B. www.drclarkcenter.de)",
+            "parasiten_bio_checkbox", tp.get("parasiten_bio", False), "parasiten_bio", "haupt")
+        leberdetox = _row("Leberdetox Behandlung nach Paracelsus Klinik (2-Tageskur, 4–5x alle 4–6 Wochen)",
+            "leberdetox_checkbox", tp.get("leberdetox", False), "leberdetox", "haupt")
+        nierenprogramm = _row("Nierenprogramm nach Dr. Clark – 4 Wochen",
+            "nierenprogramm_checkbox", tp.get("nierenprogramm", False), "nierenprogramm", "haupt")
+        mikronaehrstoffe = _row("Einnahme Mikronährstoffen (NEM-Verordnung) (siehe separate PDF)",
+            "mikronaehrstoffe_checkbox", tp.get("mikronaehrstoffe", False), "mikronaehrstoffe", "haupt")
+        infusionsbehandlung = _row("Infusionstherapie (siehe separate PDF)",
+            "infusionsbehandlung_checkbox", tp.get("infusionsbehandlung", False), "infusionsbehandlung", "haupt")
+        neuraltherapie = _row("Neuraltherapie",
+            "neuraltherapie_checkbox", tp.get("neuraltherapie", False), "neuraltherapie", "haupt")
+        eigenblut = _row("Eigenbluttherapie",
+            "eigenblut_checkbox", tp.get("eigenblut", False), "eigenblut", "haupt")
+        ozontherapie = _row("Ozontherapie",
+            "ozontherapie_checkbox", tp.get("ozontherapie", False), "ozontherapie", "haupt")
+
+        st.markdown('<div class="section-subheader">Ausleitung & Infektionen</div>', unsafe_allow_html=True)
+        ausleitung_inf = _row("Schwermetallausleitung Infusion (siehe separate Infusion PDF)",
+            "ausleitung_inf_checkbox", tp.get("ausleitung_inf", False), "ausleitung_inf", "haupt")
+        ausleitung_oral = _row("Schwermetallausleitung oral",
+            "ausleitung_oral_checkbox", tp.get("ausleitung_oral", False), "ausleitung_oral", "haupt")
+        # Checkbox rows with free-text detail field (label visible, checkbox prescribes it)
+        def _cb_text_row(label, cb_key, text_key, cb_val, text_val, slug, kp):
+            cols = st.columns(ROW_COLS)
+            with cols[0]:
+                r1, r2 = st.columns([2.0, 2.0])
+                with r1: checked = st.checkbox(label, value=cb_val, key=widget_key(cb_key, "tab", cb_key))
+                with r2: txt = st.text_input("", value=text_val, key=widget_key(text_key + "_txt", "tab", text_key),
+                    placeholder="Details...", label_visibility="collapsed")
+            therapieplan_schedule_data.update(
+                _inline_timing(checked, slug, patient["therapiebeginn"], patient["dauer"], kp, tp, cols))
+            return checked, txt
+
+        infektion_bakt, infektion_bakt_detail = _cb_text_row(
+            "Infektionsbehandlung für Bakterien (Borr./Helicob.)",
+            "infektion_bakt_cb", "infektion_bakt",
+            tp.get("infektion_bakt_cb", False), tp.get("infektion_bakt", ""),
+            "infektion_bakt", "haupt")
+        infektion_virus, infektion_virus_detail = _cb_text_row(
+            "Infektionsbehandlung für Viren (EBV, HPV, Herpes, Corona)",
+            "infektion_virus_cb", "infektion_virus",
+            tp.get("infektion_virus_cb", False), tp.get("infektion_virus", ""),
+            "infektion_virus", "haupt")
+        medikamente_text, medikamente_text_detail = _cb_text_row(
+            "Medikamentenverordnung - Rezept für",
+            "medikamente_text_cb", "medikamente_text",
+            tp.get("medikamente_text_cb", False), tp.get("medikamente_text", ""),
+            "medikamente_text", "haupt")
+        _extra_rows("haupt", "haupt", tp, patient["therapiebeginn"], patient["dauer"], therapieplan_schedule_data)
+
+    # ---- SECTION 3: Biologische & Komplementäre Therapien ----
+    with st.expander("Biologische & Komplementäre Therapien", expanded=tp.get("_sec_bio_open", False)):
+        _sched_header()
+        bio_isopath = _row("Biologische Isopathische Therapie",
+            "bio_isopath_checkbox", tp.get("bio_isopath", False), "bio_isopath", "bio")
+        akupunktur = _row("Akupunktur",
+            "akupunktur_checkbox", tp.get("akupunktur", False), "akupunktur", "bio")
+        homoeopathie = _row("Homöopathie (Anna)",
+            "homoeopathie_checkbox", tp.get("homoeopathie", False), "homoeopathie", "bio")
+        bioresonanz = _row("Bioresonanz (Anna)",
+            "bioresonanz_checkbox", tp.get("bioresonanz", False), "bioresonanz", "bio")
+        timewaver_freq = _row("TimeWaver Frequency Behandlung",
+            "timewaver_freq_checkbox", tp.get("timewaver_freq", False), "timewaver_freq", "bio")
+
+        st.markdown('<div class="section-subheader">Hypnosetherapie</div>', unsafe_allow_html=True)
+        hypnose = _row("Hypnosetherapie",
+            "hypnose_checkbox", tp.get("hypnose", False), "hypnose", "bio")
+        # Noreen / Martin / Miro compact on left, Hypnose Typ wide on right
+        hc1, hc2, hc3, hc4, hc5 = st.columns([0.7, 0.7, 0.7, 0.3, 2.6])
+        with hc1: hypnose_noreen = st.checkbox("Noreen", value=tp.get("hypnose_noreen", False), key=widget_key("hypnose_noreen_checkbox", "tab", "hypnose_noreen"))
+        with hc2: hypnose_martin = st.checkbox("Martin", value=tp.get("hypnose_martin", False), key=widget_key("hypnose_martin_checkbox", "tab", "hypnose_martin"))
+        with hc3: hypnose_miro   = st.checkbox("Miro",   value=tp.get("hypnose_miro",   False), key=widget_key("hypnose_miro_checkbox", "tab", "hypnose_miro"))
+        with hc4: st.markdown("<div style='padding-top:8px;font-size:14px;white-space:nowrap;'>Typ:</div>", unsafe_allow_html=True)
+        with hc5: hypnose_typ = st.text_input("", key=widget_key("hypnose_typ_input", "tab", "hypnose_typ"), placeholder="Hypnose Typ...",
+                label_visibility="collapsed", value=tp.get("hypnose_typ", ""))
+        yager = _row("Yagertherapie", "yager_checkbox", tp.get("yager", False), "yager", "bio")
+        energie_behandlungen = _row("Energiebehandlungen bei Marie",
+            "energie_behandlungen_checkbox", tp.get("energie_behandlungen", False), "energie_behandlungen", "bio")
+
+        st.markdown('<div class="section-subheader">Ernährung & Bewegung</div>', unsafe_allow_html=True)
+
+        def tight_row(label, key_cb, key_input, cb_val, input_val):
+            cols = st.columns(ROW_COLS)
+            with cols[0]:
+                r1, r2 = st.columns([2.0, 2.0])
+                with r1: val = st.checkbox(label, value=cb_val, key=widget_key(key_cb, "tab", key_cb))
+                with r2: txt = st.text_input("", key=widget_key(key_input, "tab", key_input), value=input_val,
+                                              placeholder="Kommentar...", label_visibility="collapsed")
+            therapieplan_schedule_data.update(
+                _inline_timing(val, key_cb, patient["therapiebeginn"], patient["dauer"], "bio", tp, cols))
+            return val, txt
+
+        atemtherapie, atemtherapie_comment = tight_row("Atemtherapie", "atemtherapie", "atemtherapie_comment",
+            tp.get("atemtherapie", False), tp.get("atemtherapie_comment", ""))
+        bewegung, bewegung_comment = tight_row("Bewegung", "bewegung", "bewegung_comment",
+            tp.get("bewegung", False), tp.get("bewegung_comment", ""))
+        ernaehrung, ernaehrung_comment = tight_row("Ernährungsberatung", "ernaehrung", "ernaehrung_comment",
+            tp.get("ernaehrung", False), tp.get("ernaehrung_comment", ""))
+
+        # Sub-items of Ernährungsberatung — indented, disabled when ernaehrung unchecked
+        def sub_ern_row(label, key_cb, key_input, cb_val, input_val):
+            cols = st.columns(ROW_COLS)
+            with cols[0]:
+                sub_c1, sub_c2 = st.columns([0.06, 0.94])
+                with sub_c2:
                     r1, r2 = st.columns([2.0, 2.0])
-                    with r1: val = st.checkbox(label, value=cb_val, key=key_cb)
-                    with r2: txt = st.text_input("", key=key_input, value=input_val,
-                                                  placeholder="Kommentar...", label_visibility="collapsed")
-                therapieplan_schedule_data.update(
-                    _inline_timing(val, key_cb, patient["therapiebeginn"], patient["dauer"], "bio", tp, cols))
-                return val, txt
-
-            atemtherapie, atemtherapie_comment = tight_row("Atemtherapie", "atemtherapie", "atemtherapie_comment",
-                tp.get("atemtherapie", False), tp.get("atemtherapie_comment", ""))
-            bewegung, bewegung_comment = tight_row("Bewegung", "bewegung", "bewegung_comment",
-                tp.get("bewegung", False), tp.get("bewegung_comment", ""))
-            ernaehrung, ernaehrung_comment = tight_row("Ernährungsberatung", "ernaehrung", "ernaehrung_comment",
-                tp.get("ernaehrung", False), tp.get("ernaehrung_comment", ""))
-
-            # Sub-items of Ernährungsberatung — indented, disabled when ernaehrung unchecked
-            def sub_ern_row(label, key_cb, key_input, cb_val, input_val):
-                cols = st.columns(ROW_COLS)
-                with cols[0]:
-                    sub_c1, sub_c2 = st.columns([0.06, 0.94])
-                    with sub_c2:
-                        r1, r2 = st.columns([2.0, 2.0])
-                        with r1: val = st.checkbox(label, value=cb_val and ernaehrung, key=key_cb, disabled=not ernaehrung)
-                        with r2: txt = st.text_input("", key=key_input, value=input_val,
-                                                      placeholder="Kommentar...", label_visibility="collapsed",
-                                                      disabled=not ernaehrung)
-                therapieplan_schedule_data.update(
-                    _inline_timing(val and ernaehrung, key_cb, patient["therapiebeginn"], patient["dauer"], "bio", tp, cols))
-                return val, txt
-
-            def sub_ern_text(label, key_cb, key_input, key_slug, cb_val, input_val):
-                cols = st.columns(ROW_COLS)
-                with cols[0]:
-                    sub_c1, sub_c2 = st.columns([0.06, 0.94])
-                    with sub_c2:
-                        r1, r2 = st.columns([2.0, 2.0])
-                        with r1: checked = st.checkbox(label, value=cb_val and ernaehrung, key=key_cb, disabled=not ernaehrung)
-                        with r2: val = st.text_input("", value=input_val,
-                            key=key_input + "_input", placeholder="Details...",
-                            label_visibility="collapsed", disabled=not ernaehrung)
-                therapieplan_schedule_data.update(
-                    _inline_timing(checked and ernaehrung, key_slug, patient["therapiebeginn"], patient["dauer"], "bio", tp, cols))
-                return checked, val
-
-            st.markdown('<div style="border-left:2px solid rgba(38,96,65,0.25);margin-left:10px;padding-left:6px;">', unsafe_allow_html=True)
-            lowcarb, lowcarb_comment = sub_ern_row("Low Carb Ernährung", "lowcarb", "lowcarb_comment",
-                tp.get("lowcarb", False), tp.get("lowcarb_comment", ""))
-            fasten, fasten_comment = sub_ern_row("Intermittierendes Fasten", "fasten", "fasten_comment",
-                tp.get("fasten", False), tp.get("fasten_comment", ""))
-            krebsdiaet, krebsdiaet_comment = sub_ern_row("Krebs Diät", "krebsdiaet", "krebsdiaet_comment",
-                tp.get("krebsdiaet", False), tp.get("krebsdiaet_comment", ""))
-            ketogene, ketogene_comment = sub_ern_row("Ketogene Ernährung", "ketogene", "ketogene_comment",
-                tp.get("ketogene", False), tp.get("ketogene_comment", ""))
-            basisch, basisch_comment = sub_ern_row("Basische Ernährung", "basisch", "basisch_comment",
-                tp.get("basisch", False), tp.get("basisch_comment", ""))
-            naehrstoff_ausgleich, naehrstoff_ausgleich_comment = sub_ern_text(
-                "Nährstoffmängel ausgleichen:", "naehrstoff_ausgleich_cb", "naehrstoff_ausgleich", "naehrstoff_ausgleich",
-                tp.get("naehrstoff_ausgleich_cb", False), tp.get("naehrstoff_ausgleich", ""))
-            therapie_sonstiges, therapie_sonstiges_comment = sub_ern_text(
-                "Sonstiges:", "therapie_sonstiges_cb", "therapie_sonstiges", "therapie_sonstiges",
-                tp.get("therapie_sonstiges_cb", False), tp.get("therapie_sonstiges", ""))
-            st.markdown('</div>', unsafe_allow_html=True)
+                    with r1: val = st.checkbox(label, value=cb_val and ernaehrung, key=widget_key(key_cb, "tab", key_cb), disabled=not ernaehrung)
+                    with r2: txt = st.text_input("", key=widget_key(key_input, "tab", key_input), value=input_val,
+                                                  placeholder="Kommentar...", label_visibility="collapsed",
+                                                  disabled=not ernaehrung)
+            therapieplan_schedule_data.update(
+                _inline_timing(val and ernaehrung, key_cb, patient["therapiebeginn"], patient["dauer"], "bio", tp, cols))
+            return val, txt
 
-            # Ästhetische Behandlung — inline timing + comment (2:2 split) + sub-checkboxes
-            aet_cols = st.columns(ROW_COLS)
-            with aet_cols[0]:
-                ac1, ac2 = st.columns([2.0, 2.0])
-                with ac1: aethetisch = st.checkbox("Ästhetische Behandlung",
-                    value=tp.get("aethetisch", False), key="aethetisch_checkbox")
-                with ac2: aethetisch_comment = st.text_input("", key="aethetisch_comment_input",
-                    value=tp.get("aethetisch_comment", ""), placeholder="Kommentar...", label_visibility="collapsed")
+        def sub_ern_text(label, key_cb, key_input, key_slug, cb_val, input_val):
+            cols = st.columns(ROW_COLS)
+            with cols[0]:
+                sub_c1, sub_c2 = st.columns([0.06, 0.94])
+                with sub_c2:
+                    r1, r2 = st.columns([2.0, 2.0])
+                    with r1: checked = st.checkbox(label, value=cb_val and ernaehrung, key=widget_key(key_cb, "tab", key_cb), disabled=not ernaehrung)
+                    with r2: val = st.text_input("", value=input_val,
+                        key=widget_key(key_input + "_input", "tab", key_input), placeholder="Details...",
+                        label_visibility="collapsed", disabled=not ernaehrung)
             therapieplan_schedule_data.update(
-                _inline_timing(aethetisch, "aethetisch", patient["therapiebeginn"], patient["dauer"], "bio", tp, aet_cols))
-            st.markdown('<span style="font-size:13px;color:#555;">Behandlungsart:</span>', unsafe_allow_html=True)
-            c1,c2,c3,c4 = st.columns(4)
-            with c1: aethetisch_botox    = st.checkbox("Botox",   value=tp.get("aethetisch_botox", False),    key="aethetisch_botox_checkbox",    disabled=not aethetisch)
-            with c2: aethetisch_prp      = st.checkbox("PRP",     value=tp.get("aethetisch_prp", False),      key="aethetisch_prp_checkbox",      disabled=not aethetisch)
-            with c3: aethetisch_faeden   = st.checkbox("Fäden",   value=tp.get("aethetisch_faeden", False),   key="aethetisch_faeden_checkbox",   disabled=not aethetisch)
-            with c4: aethetisch_hyaloron = st.checkbox("Hyaloron",value=tp.get("aethetisch_hyaloron", False), key="aethetisch_hyaloron_checkbox", disabled=not aethetisch)
-
-            _extra_rows("bio", "bio", tp, patient["therapiebeginn"], patient["dauer"], therapieplan_schedule_data)
-
-        # Gespräche removed
-        zwischengespraech_4 = tp.get("zwischengespraech_4", False)
-        zwischengespraech_8 = tp.get("zwischengespraech_8", False)
-
-        # Update session state
-        new_tp = {
-            "zaehne": zaehne, "zaehne_zu_pruefen": zaehne_zu_pruefen,
-            "analyse_bewegungsapparat": analyse_bewegungsapparat,
-            "schwermetalltest_tp": schwermetalltest_tp,
-            "lab_imd": lab_imd, "lab_mmd": lab_mmd, "lab_nextgen": lab_nextgen, "lab_sonstiges": lab_sonstiges,
-            "darm_biofilm": darm_biofilm, "darmsanierung": darmsanierung, "darmsanierung_dauer": darmsanierung_dauer,
-            "hydrocolon": hydrocolon, "parasiten": parasiten, "parasiten_bio": parasiten_bio,
-            "leberdetox": leberdetox, "nierenprogramm": nierenprogramm,
-            "ausleitung_inf": ausleitung_inf, "ausleitung_oral": ausleitung_oral,
-            "infektion_bakt_cb": infektion_bakt, "infektion_bakt": infektion_bakt_detail,
-            "infektion_virus_cb": infektion_virus, "infektion_virus": infektion_virus_detail,
-            "medikamente_text_cb": medikamente_text, "medikamente_text": medikamente_text_detail,
-            "mikronaehrstoffe": mikronaehrstoffe, "infusionsbehandlung": infusionsbehandlung,
-            "neuraltherapie": neuraltherapie, "eigenblut": eigenblut, "ozontherapie": ozontherapie,
-            "bio_isopath": bio_isopath, "akupunktur": akupunktur, "homoeopathie": homoeopathie,
-            "bioresonanz": bioresonanz, "timewaver_freq": timewaver_freq,
-            "hypnose": hypnose, "hypnose_noreen": hypnose_noreen, "hypnose_martin": hypnose_martin,
-            "hypnose_miro": hypnose_miro, "hypnose_typ": hypnose_typ,
-            "yager": yager, "energie_behandlungen": energie_behandlungen,
-            "atemtherapie": atemtherapie, "atemtherapie_comment": atemtherapie_comment,
-            "bewegung": bewegung, "bewegung_comment": bewegung_comment,
-            "ernaehrung": ernaehrung, "ernaehrung_comment": ernaehrung_comment,
-            "lowcarb": lowcarb, "lowcarb_comment": lowcarb_comment,
-            "fasten": fasten, "fasten_comment": fasten_comment,
-            "krebsdiaet": krebsdiaet, "krebsdiaet_comment": krebsdiaet_comment,
-            "ketogene": ketogene, "ketogene_comment": ketogene_comment,
-            "basisch": basisch, "basisch_comment": basisch_comment,
-            "naehrstoff_ausgleich_cb": naehrstoff_ausgleich, "naehrstoff_ausgleich": naehrstoff_ausgleich_comment,
-            "therapie_sonstiges_cb": therapie_sonstiges, "therapie_sonstiges": therapie_sonstiges_comment,
-            "aethetisch": aethetisch, "aethetisch_botox": aethetisch_botox,
-            "aethetisch_prp": aethetisch_prp, "aethetisch_faeden": aethetisch_faeden,
-            "aethetisch_hyaloron": aethetisch_hyaloron, "aethetisch_comment": aethetisch_comment,
-            "zwischengespraech_4": zwischengespraech_4, "zwischengespraech_8": zwischengespraech_8,
+                _inline_timing(checked and ernaehrung, key_slug, patient["therapiebeginn"], patient["dauer"], "bio", tp, cols))
+            return checked, val
+
+        st.markdown('<div style="border-left:2px solid rgba(38,96,65,0.25);margin-left:10px;padding-left:6px;">', unsafe_allow_html=True)
+        lowcarb, lowcarb_comment = sub_ern_row("Low Carb Ernährung", "lowcarb", "lowcarb_comment",
+            tp.get("lowcarb", False), tp.get("lowcarb_comment", ""))
+        fasten, fasten_comment = sub_ern_row("Intermittierendes Fasten", "fasten", "fasten_comment",
+            tp.get("fasten", False), tp.get("fasten_comment", ""))
+        krebsdiaet, krebsdiaet_comment = sub_ern_row("Krebs Diät", "krebsdiaet", "krebsdiaet_comment",
+            tp.get("krebsdiaet", False), tp.get("krebsdiaet_comment", ""))
+        ketogene, ketogene_comment = sub_ern_row("Ketogene Ernährung", "ketogene", "ketogene_comment",
+            tp.get("ketogene", False), tp.get("ketogene_comment", ""))
+        basisch, basisch_comment = sub_ern_row("Basische Ernährung", "basisch", "basisch_comment",
+            tp.get("basisch", False), tp.get("basisch_comment", ""))
+        naehrstoff_ausgleich, naehrstoff_ausgleich_comment = sub_ern_text(
+            "Nährstoffmängel ausgleichen:", "naehrstoff_ausgleich_cb", "naehrstoff_ausgleich", "naehrstoff_ausgleich",
+            tp.get("naehrstoff_ausgleich_cb", False), tp.get("naehrstoff_ausgleich", ""))
+        therapie_sonstiges, therapie_sonstiges_comment = sub_ern_text(
+            "Sonstiges:", "therapie_sonstiges_cb", "therapie_sonstiges", "therapie_sonstiges",
+            tp.get("therapie_sonstiges_cb", False), tp.get("therapie_sonstiges", ""))
+        st.markdown('</div>', unsafe_allow_html=True)
+
+        # Ästhetische Behandlung — inline timing + comment (2:2 split) + sub-checkboxes
+        aet_cols = st.columns(ROW_COLS)
+        with aet_cols[0]:
+            ac1, ac2 = st.columns([2.0, 2.0])
+            with ac1: aethetisch = st.checkbox("Ästhetische Behandlung",
+                value=tp.get("aethetisch", False), key=widget_key("aethetisch_checkbox", "tab", "aethetisch"))
+            with ac2: aethetisch_comment = st.text_input("", key=widget_key("aethetisch_comment_input", "tab", "aethetisch_comment"),
+                value=tp.get("aethetisch_comment", ""), placeholder="Kommentar...", label_visibility="collapsed")
+        therapieplan_schedule_data.update(
+            _inline_timing(aethetisch, "aethetisch", patient["therapiebeginn"], patient["dauer"], "bio", tp, aet_cols))
+        st.markdown('<span style="font-size:13px;color:#555;">Behandlungsart:</span>', unsafe_allow_html=True)
+        c1,c2,c3,c4 = st.columns(4)
+        with c1: aethetisch_botox    = st.checkbox("Botox",   value=tp.get("aethetisch_botox", False),    key=widget_key("aethetisch_botox_checkbox", "tab", "aethetisch_botox"),    disabled=not aethetisch)
+        with c2: aethetisch_prp      = st.checkbox("PRP",     value=tp.get("aethetisch_prp", False),      key=widget_key("aethetisch_prp_checkbox", "tab", "aethetisch_prp"),      disabled=not aethetisch)
+        with c3: aethetisch_faeden   = st.checkbox("Fäden",   value=tp.get("aethetisch_faeden", False),   key=widget_key("aethetisch_faeden_checkbox", "tab", "aethetisch_faeden"),   disabled=not aethetisch)
+        with c4: aethetisch_hyaloron = st.checkbox("Hyaloron",value=tp.get("aethetisch_hyaloron", False), key=widget_key("aethetisch_hyaloron_checkbox", "tab", "aethetisch_hyaloron"), disabled=not aethetisch)
+
+        _extra_rows("bio", "bio", tp, patient["therapiebeginn"], patient["dauer"], therapieplan_schedule_data)
+
+    # Gespräche removed
+    zwischengespraech_4 = tp.get("zwischengespraech_4", False)
+    zwischengespraech_8 = tp.get("zwischengespraech_8", False)
+
+    # Update session state
+    new_tp = {
+        "zaehne": zaehne, "zaehne_zu_pruefen": zaehne_zu_pruefen,
+        "analyse_bewegungsapparat": analyse_bewegungsapparat,
+        "schwermetalltest_tp": schwermetalltest_tp,
+        "lab_imd": lab_imd, "lab_mmd": lab_mmd, "lab_nextgen": lab_nextgen, "lab_sonstiges": lab_sonstiges,
+        "darm_biofilm": darm_biofilm, "darmsanierung": darmsanierung, "darmsanierung_dauer": darmsanierung_dauer,
+        "hydrocolon": hydrocolon, "parasiten": parasiten, "parasiten_bio": parasiten_bio,
+        "leberdetox": leberdetox, "nierenprogramm": nierenprogramm,
+        "ausleitung_inf": ausleitung_inf, "ausleitung_oral": ausleitung_oral,
+        "infektion_bakt_cb": infektion_bakt, "infektion_bakt": infektion_bakt_detail,
+        "infektion_virus_cb": infektion_virus, "infektion_virus": infektion_virus_detail,
+        "medikamente_text_cb": medikamente_text, "medikamente_text": medikamente_text_detail,
+        "mikronaehrstoffe": mikronaehrstoffe, "infusionsbehandlung": infusionsbehandlung,
+        "neuraltherapie": neuraltherapie, "eigenblut": eigenblut, "ozontherapie": ozontherapie,
+        "bio_isopath": bio_isopath, "akupunktur": akupunktur, "homoeopathie": homoeopathie,
+        "bioresonanz": bioresonanz, "timewaver_freq": timewaver_freq,
+        "hypnose": hypnose, "hypnose_noreen": hypnose_noreen, "hypnose_martin": hypnose_martin,
+        "hypnose_miro": hypnose_miro, "hypnose_typ": hypnose_typ,
+        "yager": yager, "energie_behandlungen": energie_behandlungen,
+        "atemtherapie": atemtherapie, "atemtherapie_comment": atemtherapie_comment,
+        "bewegung": bewegung, "bewegung_comment": bewegung_comment,
+        "ernaehrung": ernaehrung, "ernaehrung_comment": ernaehrung_comment,
+        "lowcarb": lowcarb, "lowcarb_comment": lowcarb_comment,
+        "fasten": fasten, "fasten_comment": fasten_comment,
+        "krebsdiaet": krebsdiaet, "krebsdiaet_comment": krebsdiaet_comment,
+        "ketogene": ketogene, "ketogene_comment": ketogene_comment,
+        "basisch": basisch, "basisch_comment": basisch_comment,
+        "naehrstoff_ausgleich_cb": naehrstoff_ausgleich, "naehrstoff_ausgleich": naehrstoff_ausgleich_comment,
+        "therapie_sonstiges_cb": therapie_sonstiges, "therapie_sonstiges": therapie_sonstiges_comment,
+        "aethetisch": aethetisch, "aethetisch_botox": aethetisch_botox,
+        "aethetisch_prp": aethetisch_prp, "aethetisch_faeden": aethetisch_faeden,
+        "aethetisch_hyaloron": aethetisch_hyaloron, "aethetisch_comment": aethetisch_comment,
+        "zwischengespraech_4": zwischengespraech_4, "zwischengespraech_8": zwischengespraech_8,
+    }
+    new_tp.update(therapieplan_schedule_data)
+    st.session_state.therapieplan_data = new_tp
+
+    if st.button("Therapieplan PDF generieren", key="therapieplan_pdf_button"):
+        pdf_bytes = generate_pdf(patient, st.session_state.therapieplan_data, "THERAPIEPLAN")
+        st.session_state.auto_download_pdf = {
+            "data": pdf_bytes,
+            "filename": f"RevitaClinic_Therapieplan_{patient.get('patient','')}.pdf",
+            "mime": "application/pdf"
         }
-        new_tp.update(therapieplan_schedule_data)
-        st.session_state.therapieplan_data = new_tp
-
-        if st.button("Therapieplan PDF generieren", key="therapieplan_pdf_button"):
-            pdf_bytes = generate_pdf(patient, st.session_state.therapieplan_data, "THERAPIEPLAN")
-            st.session_state.auto_download_pdf = {
-                "data": pdf_bytes,
-                "filename": f"RevitaClinic_Therapieplan_{patient.get('patient','')}.pdf",
-                "mime": "application/pdf"
-            }
-            st.rerun()
+        st.rerun()
+
+
+# =========================================================
+# NEM GRID EDITOR
+# One st.data_editor for all supplements instead of ten widgets per row.
+# Values are written back to the per-row widget keys, so the list view,
+# the PDF and the save handler read the same data in either mode.
+# =========================================================
+# NEM column -> widget key suffix ({supplement_id}_{suffix})
+NEM_FIELDS = [
+    ("Gesamt-dosierung", "gesamt_dosierung"), ("Darreichungsform", "darreichungsform"),
+    ("Pro Einnahme", "pro_Einnahme"), ("Nüchtern", "Nuechtern"), ("Morgens", "Morgens"),
+    ("Mittags", "Mittags"), ("Abends", "Abends"), ("Nachts", "Nachts"), ("Kommentar", "comment"),
+]
+NEM_DOSE_FIELDS = ["Nüchtern", "Morgens", "Mittags", "Abends", "Nachts"]
+
+
+def _nem_has_values(p):
+    """True if a NEM row carries anything worth saving (form alone doesn't count)."""
+    return any(str(p.get(f) or "").strip() for f, _ in NEM_FIELDS if f != "Darreichungsform")
+
+
+def _nem_has_values_mask(table):
+    """Column-wise _nem_has_values over a NEM table."""
+    cols = [f for f, _ in NEM_FIELDS if f != "Darreichungsform"]
+    return table[cols].apply(lambda c: c.str.strip().ne("")).any(axis=1)
+
+
+def _nem_stored_row(row, loaded):
+    """A NEM row without widgets: widget keys first, then the loaded prescription
+    (``loaded`` is nem_index()["by_id"])."""
+    name  = row["name"]
+    presc = loaded.get(row["id"], {})
+    rec   = {"name": name}
+    for field, suffix in NEM_FIELDS:
+        rec[field] = str(st.session_state.get(f"{row['id']}_{suffix}", presc.get(field, "")) or "")
+    if not rec["Darreichungsform"]:
+        rec["Darreichungsform"] = DEFAULT_FORMS.get(name, "Kapseln")
+    return rec
+
+
+def _on_nem_row_edit(row):
+    """Widget callback: store the edited list row in the NEM index."""
+    update_nem_rows({row["id"]: _nem_stored_row(row, nem_index()["by_id"])})
+
+
+def _on_nem_form_submit():
+    """"Übernehmen" in the batch list: widgets in a form have no callbacks of
+    their own, so every row is compared once here."""
+    loaded = nem_index()["by_id"]
+    update_nem_rows({r["id"]: _nem_stored_row(r, loaded)
+                     for group in get_catalog().categories.values() for r in group})
+
+
+def _keep_nem_keys(row):
+    """Unrendered widgets lose their state at the end of the run; re-assigning
+    the keys keeps a collapsed row's values for save and PDF."""
+    for _, suffix in NEM_FIELDS:
+        key = f"{row['id']}_{suffix}"
+        if key in st.session_state:
+            st.session_state[key] = st.session_state[key]
+
+
+def _nem_grid_base(catalog):
+    """Grid rows seeded from the widget keys, then the loaded prescriptions."""
+    loaded = nem_index()["by_id"]
+    rows = []
+    for category_name, supplement_rows in catalog.categories.items():
+        for row in supplement_rows:
+            rec = _nem_stored_row(row, loaded)
+            rows.append({"id": row["id"], "Kategorie": category_name, "Supplement": rec.pop("name"), **rec})
+    columns = ["id", "Kategorie", "Supplement"] + [f for f, _ in NEM_FIELDS]
+    return pd.DataFrame(rows, columns=columns).set_index("id")
+
+
+def _options_with(options, values):
+    """Column options plus any stored value outside them (free-text entries)."""
+    extra = sorted({v for v in values if v and v not in options})
+    return list(options) + extra
+
+
+def reset_nem_grid():
+    """Drop the grid's rows and edits; the next render rebuilds them."""
+    if st.session_state.pop("nem_grid_base", None) is not None:
+        st.session_state.nem_grid_rev = st.session_state.get("nem_grid_rev", 0) + 1
+
+
+def nem_grid_editor(catalog, parent=st):
+    """Render the grid into ``parent`` (st or the NEM batch form) and apply
+    its edited rows to the NEM index."""
+    if "nem_grid_base" not in st.session_state:
+        st.session_state.nem_grid_base = _nem_grid_base(catalog)
+    base = st.session_state.nem_grid_base
+
+    # Pro Einnahme must fit the row's Darreichungsform, as in the list view.
+    # Pending edits are checked before the grid renders; only edited rows are
+    # checked, so saved free-text values stay untouched.
+    grid_key = f"nem_grid_{st.session_state.get('nem_grid_rev', 0)}"
+    edits = (st.session_state.get(grid_key) or {}).get("edited_rows", {})
+    invalid, refixed = [], []
+    for pos, change in edits.items():
+        if "Pro Einnahme" in change or "Darreichungsform" in change:
+            sid  = base.index[int(pos)]
+            form = change.get("Darreichungsform", base.at[sid, "Darreichungsform"]) or ""
+            pe   = change.get("Pro Einnahme", base.at[sid, "Pro Einnahme"]) or ""
+            if pe not in get_pro_Einnahme_options(form):
+                invalid.append(sid)
+    if invalid:
+        fixed = base.copy()
+        for pos, change in edits.items():
+            for field, val in change.items():
+                fixed.at[base.index[int(pos)], field] = val or ""
+        fixed.loc[invalid, "Pro Einnahme"] = ""
+        st.warning("⚠️ Pro Einnahme passt nicht zur Darreichungsform und wurde geleert: "
+                   + ", ".join(fixed.loc[invalid, "Supplement"]))
+        reset_nem_grid()
+        st.session_state.nem_grid_base = base = fixed
+        grid_key = f"nem_grid_{st.session_state.nem_grid_rev}"
+        refixed = [base.index[int(pos)] for pos in edits]
+
+    pe_all = list(dict.fromkeys(o for form in DOSAGE_PRESETS for o in get_pro_Einnahme_options(form)))
+    col_cfg = {
+        "Kategorie":        st.column_config.TextColumn("Kategorie", width="small"),
+        "Supplement":       st.column_config.TextColumn("Supplement", width="medium"),
+        "Gesamt-dosierung": st.column_config.SelectboxColumn(
+            "Gesamt-dosierung", options=_options_with(GD_OPTIONS, base["Gesamt-dosierung"])),
+        "Darreichungsform": st.column_config.SelectboxColumn(
+            "Darreichungsform", options=_options_with(DOSAGE_PRESETS, base["Darreichungsform"]), required=True),
+        "Pro Einnahme":     st.column_config.SelectboxColumn(
+            "Pro Einnahme", options=_options_with(pe_all, base["Pro Einnahme"]),
+            help="Erlaubte Werte hängen von der Darreichungsform ab"),
+        "Kommentar":        st.column_config.TextColumn("Kommentar", width="large"),
+    }
+    for field in NEM_DOSE_FIELDS:
+        col_cfg[field] = st.column_config.SelectboxColumn(
+            field, options=_options_with(DOSE_OPTIONS, base[field]), width="small")
+
+    edited = parent.data_editor(
+        base, key=widget_key(grid_key, "nem_grid"),
+        column_config=col_cfg, disabled=["Kategorie", "Supplement"],
+        hide_index=True, num_rows="fixed", height=600, use_container_width=True,
+    ).fillna("")
+
+    # Unrendered widgets lose their state, so every non-empty value is
+    # re-assigned on each run while the grid is shown
+    for sid, r in edited.iterrows():
+        for field, suffix in NEM_FIELDS:
+            key = f"{sid}_{suffix}"
+            if r[field] or key in st.session_state:
+                st.session_state[widget_key(key, "nem", sid)] = r[field]
+
+    # Only rows the grid reports as edited (or just re-based) reach the index
+    touched = set(refixed)
+    touched.update(base.index[int(pos)] for pos in (st.session_state.get(grid_key) or {}).get("edited_rows", {}))
+    update_nem_rows({sid: {"name": edited.at[sid, "Supplement"],
+                           **{field: edited.at[sid, field] for field, _ in NEM_FIELDS}}
+                     for sid in touched})
 
-    # =========================================================
-    # TAB 1: NEM
-    # =========================================================
-    with tabs[1]:
-        nem_container = st.container()
-        with nem_container:
-            if 'nem_form_initialized' not in st.session_state:
-                st.session_state.nem_form_initialized = True
-            if 'category_states' not in st.session_state:
-                st.session_state.category_states = {}
-
-            # No st.form wrapper — widgets update immediately, enabling
-            # save-on-demand without requiring form submission first.
-            if "last_main_dauer" not in st.session_state:
-                st.session_state.last_main_dauer = patient["dauer"]
-
-            def get_pro_Einnahme_options(df_form):
-                    if not df_form: return [""]
-                    f = df_form.lower()
-                    if any(x in f for x in ["kapsel","tablette","pflaster"]):
-                        return ["","1","2","3","4","5","6","7","8","9","10","½","¼","¾","1½","2½"]
-                    elif any(x in f for x in ["tropfen","lösung","flüssig","öl","spray","creme","gel"]):
-                        return ["","1","2","3","4","5","6","7","8","9","10","½","¼","¾","1½","2½","Tr","ML"]
-                    elif any(x in f for x in ["pulver","sachet"]):
-                        return ["","1","2","3","4","5","6","7","8","9","10","½","¼","¾","1½","2½","g","mg","EL","TL","ML"]
-                    elif "tee" in f:
-                        return ["","1","2","3","4","5","Beutel","TL","EL"]
-                    return ["","1","2","3","4","5","6","7","8","9","10","½","¼","¾","1½","2½","g","mg","EL","TL","ML","Tr"]
 
+# =========================================================
+# TAB 1: NEM
+# =========================================================
+@st.fragment
+def nem_tab():
+    patient = st.session_state.patient_header
+    catalog = get_catalog()
+    nem_container = st.container()
+    with nem_container:
+        if 'nem_form_initialized' not in st.session_state:
+            st.session_state.nem_form_initialized = True
+        if 'category_states' not in st.session_state:
+            st.session_state.category_states = {}
+
+        # By default no st.form wrapper — widgets update immediately, enabling
+        # save-on-demand without requiring form submission first.
+        # "Gesammelt bearbeiten" puts the rows in a form instead: edits stay in
+        # the browser until "Übernehmen", then land in the same widget keys.
+        if "last_main_dauer" not in st.session_state:
+            st.session_state.last_main_dauer = patient["dauer"]
+
+        mode_col, batch_col = st.columns([3, 2])
+        with mode_col:
+            nem_mode = st.radio("Ansicht", ["Liste", "Tabelle"], horizontal=True,
+                key="nem_view_mode", help="Tabelle: alle Supplemente in einem editierbaren Raster")
+        with batch_col:
+            batch = st.toggle("Gesammelt bearbeiten", key="nem_batch_mode",
+                help="Änderungen erst mit „Übernehmen“ anwenden. Speichern sieht nur übernommene Werte; "
+                     "Pro-Einnahme-Optionen folgen der Darreichungsform nach dem Übernehmen.")
+        nem_parent = st.form("nem_batch_form", border=False) if batch else st
+
+        if nem_mode == "Tabelle":
+            nem_grid_editor(catalog, nem_parent)
+        else:
+            # Rebuilt from the widget keys when switching back to the grid
+            reset_nem_grid()
             st.markdown('<div class="sticky-header">', unsafe_allow_html=True)
             header_cols = st.columns([2.3, 0.8, 1.2, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 2])
             for col, text in zip(header_cols, ["Supplement","Gesamt-dosierung","Darreichungsform","Pro Einnahme","Nüchtern","Morgens","Mittags","Abends","Nachts","Kommentar"]):
                 col.markdown(f"**{text}**")
             st.markdown('</div>', unsafe_allow_html=True)
 
-            scroll_container = st.container(height=600, border=True)
+            scroll_container = nem_parent.container(height=600, border=True)
             with scroll_container:
-                all_supplements_data = []
-                categories = {}
-                current_category_name = None
-
-                for _, row in df.iterrows():
-                    if row["id"].startswith("CAT"):
-                        current_category_name = row["name"].replace("CATEGORY: ", "")
-                        categories[current_category_name] = []
-                    elif current_category_name:
-                        categories[current_category_name].append(row)
-
-                for category_name, supplement_rows in categories.items():
+                loaded = nem_index()["by_id"]
+
+                for category_name, supplement_rows in catalog.categories.items():
                     if not supplement_rows: continue
                     if category_name not in st.session_state.category_states:
                         st.session_state.category_states[category_name] = False
 
-                    with st.expander(f" {category_name}", expanded=st.session_state.category_states[category_name]):
+                    # on_change="rerun" makes .open track the expander, so a
+                    # collapsed category can skip building its widgets. Inside
+                    # the batch form expanders can't rerun, so all rows render.
+                    if batch:
+                        exp = st.expander(f" {category_name}", expanded=st.session_state.category_states[category_name])
+                    else:
+                        exp = st.expander(f" {category_name}", expanded=st.session_state.category_states[category_name],
+                                          key=f"nem_cat_{category_name}", on_change="rerun")
+                        st.session_state.category_states[category_name] = bool(exp.open)
+                    prescribed = any(_nem_has_values(loaded.get(r["id"], {})) for r in supplement_rows)
+                    if exp.open is False and not prescribed:
+                        for row in supplement_rows:
+                            _keep_nem_keys(row)
+                        continue
+
+                    category_rows = []
+                    with exp:
                         for row in supplement_rows:
                             cols = st.columns([2.2, 0.9, 1.2, 1, 0.7, 0.7, 0.7, 0.7, 0.7, 2.3])
                             supplement_name = row["name"]
@@ -2087,11 +2165,9 @@ def main():
                             nacht_key= f"{row['id']}_Nachts"
                             com_key  = f"{row['id']}_comment"
 
-                            loaded_prescription = None
-                            for p in (st.session_state.nem_prescriptions or []):
-                                if p.get("name") == supplement_name:
-                                    loaded_prescription = p
-                                    break
+                            loaded_prescription = loaded.get(row["id"])
+                            # Widgets in the batch form can't have callbacks
+                            on_edit = {} if batch else {"on_change": _on_nem_row_edit, "args": (row,)}
 
                             # If session state key doesn't exist yet, seed it from loaded data
                             if gd_key not in st.session_state and loaded_prescription:
@@ -2115,302 +2191,414 @@ def main():
                             i_nacht = st.session_state.get(nacht_key, "")
                             i_com   = st.session_state.get(com_key,   "")
 
-                            gd_options = ["","1","2","3","4","5","6","7","8","9","10","12","14","16","18","20","22","24","26","28","30","35","40","45","50","60","70","80","90","100","120","150","180","200","250","300","400","500"]
+                            gd_options = GD_OPTIONS
                             gd_val = cols[1].selectbox("", gd_options,
                                 index=gd_options.index(i_gd) if i_gd in gd_options else 0,
-                                key=gd_key, label_visibility="collapsed", accept_new_options=True)
+                                key=widget_key(gd_key, "nem", row["id"]), label_visibility="collapsed", accept_new_options=True, **on_edit)
 
-                            dosage_presets = ["Kapseln","Lösung","Tabletten","Pulver","Tropfen","Sachet","Öl","Spray","Creme","Gel","Flüssig","Tee","Pflaster"]
+                            dosage_presets = DOSAGE_PRESETS
                             sel_form = cols[2].selectbox("", dosage_presets,
                                 index=dosage_presets.index(i_form) if i_form in dosage_presets else 0,
-                                key=form_key, label_visibility="collapsed", accept_new_options=True)
+                                key=widget_key(form_key, "nem", row["id"]), label_visibility="collapsed", accept_new_options=True, **on_edit)
 
                             pe_options = get_pro_Einnahme_options(sel_form)
                             pe_val = cols[3].selectbox("", pe_options,
                                 index=pe_options.index(i_pe) if i_pe in pe_options else 0,
-                                key=pe_key, label_visibility="collapsed", accept_new_options=True)
+                                key=widget_key(pe_key, "nem", row["id"]), label_visibility="collapsed", accept_new_options=True, **on_edit)
 
-                            dose_options = ["","1","2","3","4","5"]
-                            nue_val  = cols[4].selectbox("", dose_options, index=dose_options.index(i_nue)   if i_nue   in dose_options else 0, key=nue_key,  label_visibility="collapsed")
-                            morg_val = cols[5].selectbox("", dose_options, index=dose_options.index(i_morg)  if i_morg  in dose_options else 0, key=morg_key, label_visibility="collapsed")
-                            mitt_val = cols[6].selectbox("", dose_options, index=dose_options.index(i_mitt)  if i_mitt  in dose_options else 0, key=mitt_key, label_visibility="collapsed")
-                            abend_val= cols[7].selectbox("", dose_options, index=dose_options.index(i_abend) if i_abend in dose_options else 0, key=abend_key,label_visibility="collapsed")
-                            nacht_val= cols[8].selectbox("", dose_options, index=dose_options.index(i_nacht) if i_nacht in dose_options else 0, key=nacht_key,label_visibility="collapsed")
-                            comment  = cols[9].text_input("", key=com_key, placeholder="Kommentar", value=i_com or "", label_visibility="collapsed")
+                            dose_options = DOSE_OPTIONS
+                            nue_val  = cols[4].selectbox("", dose_options, index=dose_options.index(i_nue)   if i_nue   in dose_options else 0, key=widget_key(nue_key, "nem", row["id"]),  label_visibility="collapsed", **on_edit)
+                            morg_val = cols[5].selectbox("", dose_options, index=dose_options.index(i_morg)  if i_morg  in dose_options else 0, key=widget_key(morg_key, "nem", row["id"]), label_visibility="collapsed", **on_edit)
+                            mitt_val = cols[6].selectbox("", dose_options, index=dose_options.index(i_mitt)  if i_mitt  in dose_options else 0, key=widget_key(mitt_key, "nem", row["id"]), label_visibility="collapsed", **on_edit)
+                            abend_val= cols[7].selectbox("", dose_options, index=dose_options.index(i_abend) if i_abend in dose_options else 0, key=widget_key(abend_key, "nem", row["id"]),label_visibility="collapsed", **on_edit)
+                            nacht_val= cols[8].selectbox("", dose_options, index=dose_options.index(i_nacht) if i_nacht in dose_options else 0, key=widget_key(nacht_key, "nem", row["id"]),label_visibility="collapsed", **on_edit)
+                            comment  = cols[9].text_input("", key=widget_key(com_key, "nem", row["id"]), placeholder="Kommentar", value=i_com or "", label_visibility="collapsed", **on_edit)
 
-                            all_supplements_data.append({
+                            category_rows.append({
                                 "name": supplement_name, "Gesamt-dosierung": gd_val,
                                 "Darreichungsform": sel_form, "Pro Einnahme": pe_val,
                                 "Nüchtern": nue_val, "Morgens": morg_val, "Mittags": mitt_val,
                                 "Abends": abend_val, "Nachts": nacht_val, "Kommentar": comment
                             })
 
-            # Update nem_prescriptions every render (no form boundary)
-            st.session_state.nem_prescriptions = all_supplements_data
+                    # Summary row for a collapsed category
+                    if exp.open is False:
+                        n_prescribed = sum(_nem_has_values(p) for p in category_rows)
+                        if n_prescribed:
+                            st.caption(f"↳ {n_prescribed} verordnet")
 
-            if st.button("NEM PDF generieren", key="nem_pdf_button"):
-                pdf_submitted = True
+        if batch:
+            # The grid applies its own diff when it renders
+            nem_parent.form_submit_button("Übernehmen", type="primary",
+                                          on_click=_on_nem_form_submit if nem_mode == "Liste" else None)
+
+        if st.button("NEM PDF generieren", key="nem_pdf_button"):
+            pdf_submitted = True
+        else:
+            pdf_submitted = False
+
+        if pdf_submitted:
+            # Rows with values, or with a non-default Darreichungsform
+            table        = nem_table()
+            form         = table["Darreichungsform"]
+            default_form = table["name"].map(DEFAULT_FORMS).fillna("Kapseln")
+            pdf_mask     = _nem_has_values_mask(table) | (form.ne(default_form) & form.str.strip().ne(""))
+            pdf_data     = table[pdf_mask].to_dict("records")
+            if pdf_data:
+                pdf_bytes = generate_pdf(patient, pdf_data, "NEM")
+                st.session_state.auto_download_pdf = {
+                    "data": pdf_bytes,
+                    "filename": f"RevitaClinic_NEM_{patient.get('patient','')}.pdf",
+                    "mime": "application/pdf"
+                }
+                st.success(f"✅ PDF mit {len(pdf_data)} NEM-Supplement(en) generiert!")
+                st.rerun()
             else:
-                pdf_submitted = False
-
-            if pdf_submitted:
-                pass  # nem_prescriptions already updated above
-                pdf_data = [p for p in all_supplements_data if (
-                    any(p.get(f,"").strip() for f in ["Nüchtern","Morgens","Mittags","Abends","Nachts"])
-                    or p.get("Gesamt-dosierung","").strip()
-                    or p.get("Pro Einnahme","").strip()
-                    or p.get("Kommentar","").strip()
-                    or (p.get("Darreichungsform","") != DEFAULT_FORMS.get(p["name"],"Kapseln") and p.get("Darreichungsform","").strip())
-                )]
-                if pdf_data:
-                    pdf_bytes = generate_pdf(patient, pdf_data, "NEM")
-                    st.session_state.auto_download_pdf = {
-                        "data": pdf_bytes,
-                        "filename": f"RevitaClinic_NEM_{patient.get('patient','')}.pdf",
-                        "mime": "application/pdf"
-                    }
-                    st.success(f"✅ PDF mit {len(pdf_data)} NEM-Supplement(en) generiert!")
-                    st.rerun()
-                else:
-                    st.warning("⚠️ Keine NEM-Supplemente ausgewählt.")
+                st.warning("⚠️ Keine NEM-Supplemente ausgewählt.")
 
-    # =========================================================
-    # TAB 2: INFUSIONSTHERAPIE
-    # Left side content 100% unchanged. Each checkbox row now uses
-    # ROW_COLS so timing appears inline (no separate right panel).
-    # =========================================================
-    with tabs[2]:
-        infusion_schedule_data = {}
-        inf = st.session_state.infusion_data
 
-        def _inf_row(label, key_prefix, tooltip, default_checked=False):
-            """Infusion checkbox with label+tooltip on left, timing on right."""
+# =========================================================
+# TAB 2: INFUSIONSTHERAPIE
+# Left side content 100% unchanged. Each checkbox row now uses
+# ROW_COLS so timing appears inline (no separate right panel).
+# =========================================================
+@st.fragment
+def infusion_tab():
+    patient = st.session_state.patient_header
+    infusion_schedule_data = {}
+    inf = st.session_state.infusion_data
+
+    def _inf_row(label, key_prefix, tooltip, default_checked=False):
+        """Infusion checkbox with label+tooltip on left, timing on right."""
+        cols = st.columns(ROW_COLS)
+        with cols[0]:
+            cb_cols = st.columns([0.07, 0.93])
+            with cb_cols[0]:
+                value = st.checkbox("", value=inf.get(key_prefix, default_checked),
+                    key=widget_key(f"inf_{key_prefix}_cb", "tab", key_prefix), label_visibility="collapsed")
+            with cb_cols[1]:
+                st.markdown(
+                    f'<div style="display:flex;align-items:center;gap:4px;margin-top:8px;">' +
+                    f'<span style="font-size:14px;font-family:var(--font-sans);">{label}</span>' +
+                    f'<span class="info-icon" data-tooltip="{tooltip}">ⓘ</span></div>',
+                    unsafe_allow_html=True)
+        infusion_schedule_data.update(
+            _inline_timing(value, key_prefix, patient["therapiebeginn"], patient["dauer"], "inf", inf, cols))
+        return value
+
+    def _procain_row(label, key_prefix, tooltip):
+        ml_key = f"{key_prefix}_ml"
+        cols = st.columns(ROW_COLS)
+        with cols[0]:
+            cb_cols = st.columns([0.07, 0.6, 0.33])
+            with cb_cols[0]:
+                value = st.checkbox(" ", value=inf.get(key_prefix, False),
+                    key=widget_key(f"inf_{key_prefix}_cb", "tab", key_prefix), label_visibility="collapsed")
+            with cb_cols[1]:
+                st.markdown(
+                    f'<div style="display:flex;align-items:center;gap:4px;margin-top:8px;">' +
+                    f'<span style="font-size:14px;white-space:nowrap;font-family:var(--font-sans);">{label}</span>' +
+                    f'<span class="info-icon" data-tooltip="{tooltip}">ⓘ</span></div>',
+                    unsafe_allow_html=True)
+            with cb_cols[2]:
+                ml_val = st.text_input("ml", value=inf.get(ml_key, ""),
+                    key=widget_key(ml_key, "tab", ml_key), placeholder="ml",
+                    label_visibility="collapsed", disabled=not value)
+        infusion_schedule_data.update(
+            _inline_timing(value, key_prefix, patient["therapiebeginn"], patient["dauer"], "inf", inf, cols))
+        return value, ml_val
+
+    st.markdown('<div class="green-section-header">Infusionstherapie</div>', unsafe_allow_html=True)
+
+    with st.expander("RevitaClinic Infusionen", expanded=inf.get("_sec_revita_open", True)):
+        _sched_header()
+        revita_immune        = _inf_row("RevitaImmune",        "revita_immune",        "Vitamin C, Zink, Selen, Magnesium, B-Vitamine")
+        revita_immune_plus   = _inf_row("RevitaImmunePlus",    "revita_immune_plus",   "Hochdosiert: Vitamin C, Zink, Selen, Magnesium, B-Vitamine, Glutathion")
+        revita_heal          = _inf_row("Revita Heal (2x)",    "revita_heal",          "Vitamin C, Zink, Arginin, Glutamin, B-Vitamine, Magnesium")
+        revita_bludder       = _inf_row("RevitaBludder",       "revita_bludder",       "Eisen, Vitamin B12, Folsäure, Vitamin C")
+        revita_ferro         = _inf_row("RevitaFerro",         "revita_ferro",         "Ferinject (Eisen), Vitamin C")
+        revita_energy        = _inf_row("RevitaEnergyBoost",   "revita_energy",        "Magnesium, B-Vitamine, Vitamin C, Coenzym Q10")
+        revita_focus         = _inf_row("RevitaFocus",         "revita_focus",         "Magnesium, B-Vitamine, Vitamin C, Zink, Alpha-Liponsäure")
+        revita_nad           = _inf_row("RevitaNAD+",          "revita_nad",           "NAD+ 500mg (oder 125mg), Magnesium, B-Vitamine")
+        revita_relax         = _inf_row("RevitaRelax",         "revita_relax",         "Magnesium, B-Vitamine, Vitamin C, Calcium")
+        revita_fit           = _inf_row("RevitaFit",           "revita_fit",           "Magnesium, B-Vitamine, Vitamin C, Aminosäuren, Coenzym Q10")
+        revita_hangover      = _inf_row("RevitaHangover",      "revita_hangover",      "Elektrolyte, Vitamin C, B-Vitamine, Magnesium, Glutathion")
+        revita_beauty        = _inf_row("RevitaBeauty",        "revita_beauty",        "Vitamin C, Biotin, Zink, Selen, B-Vitamine")
+        revita_antiaging     = _inf_row("RevitaAnti-Aging",    "revita_antiaging",     "Glutathion, Vitamin C, Alpha-Liponsäure, Selen, Zink")
+        revita_detox         = _inf_row("RevitaDetox",         "revita_detox",         "Glutathion, Vitamin C, Magnesium, B-Vitamine")
+        revita_chelate       = _inf_row("RevitaChelate",       "revita_chelate",       "EDTA, DMSA, Vitamin C, Magnesium, Zink")
+        revita_liver         = _inf_row("RevitaLiver",         "revita_liver",         "Glutathion, Vitamin C, B-Vitamine, Magnesium, Mariendistel-Extrakt")
+        revita_leakygut      = _inf_row("RevitaLeaky-gut",     "revita_leakygut",      "Glutamin, Zink, Vitamin C, B-Vitamine, Magnesium")
+        revita_infection     = _inf_row("RevitaInfection",     "revita_infection",     "Vitamin C, Zink, Selen, Magnesium, B-Vitamine, Glutathion")
+        revita_joint         = _inf_row("RevitaJoint",         "revita_joint",         "Vitamin C, Magnesium, Zink, Mangan, B-Vitamine")
+
+    with st.expander("Sonstiges", expanded=inf.get("_sec_sonstiges_open", False)):
+        _sched_header()
+        mito_energy      = _inf_row("Mito-Energy Behandlung (Mito-Gerät, Wirkbooster)", "std_mito_energy",     "Mito-Energy Behandlung mit Wirkbooster")
+        oxyvenierung     = _inf_row("Oxyvenierung (10–40 ml, 10er Serie)",              "std_oxyvenierung",    "Oxyvenierung (10–40 ml, 10er Serie)")
+
+        # 2 additional free-text checkbox rows with timing
+        def _inf_custom_row(idx):
+            key_cb   = f"inf_custom{idx}_cb"
+            key_text = f"inf_custom{idx}_text"
+            key_slug = f"inf_custom{idx}"
             cols = st.columns(ROW_COLS)
             with cols[0]:
-                cb_cols = st.columns([0.07, 0.93])
-                with cb_cols[0]:
-                    value = st.checkbox("", value=inf.get(key_prefix, default_checked),
-                        key=f"inf_{key_prefix}_cb", label_visibility="collapsed")
-                with cb_cols[1]:
-                    st.markdown(
-                        f'<div style="display:flex;align-items:center;gap:4px;margin-top:8px;">' +
-                        f'<span style="font-size:14px;font-family:DM Sans,sans-serif;">{label}</span>' +
-                        f'<span class="info-icon" data-tooltip="{tooltip}">ⓘ</span></div>',
-                        unsafe_allow_html=True)
+                cb_c, txt_c = st.columns([0.07, 0.93])
+                with cb_c:
+                    checked = st.checkbox("", value=inf.get(key_cb, False),
+                        key=widget_key(key_cb, "tab", key_cb), label_visibility="collapsed")
+                with txt_c:
+                    txt = st.text_input("", value=inf.get(key_text, ""),
+                        key=widget_key(key_text, "tab", key_text), placeholder=f"Zusatz {idx}...",
+                        label_visibility="collapsed", disabled=not checked)
             infusion_schedule_data.update(
-                _inline_timing(value, key_prefix, patient["therapiebeginn"], patient["dauer"], "inf", inf, cols))
-            return value
-
-        def _procain_row(label, key_prefix, tooltip):
-            ml_key = f"{key_prefix}_ml"
+                _inline_timing(checked, key_slug, patient["therapiebeginn"], patient["dauer"], "inf", inf, cols))
+            return checked, txt
+
+        inf_custom1_cb, inf_custom1_text = _inf_custom_row(1)
+        inf_custom2_cb, inf_custom2_text = _inf_custom_row(2)
+
+    with st.expander("Standard Infusionen", expanded=inf.get("_sec_standard_open", False)):
+        _sched_header()
+        schwermetalltest = _inf_row("Schwermetalltest mit DMSA und Ca EDTA",            "std_schwermetalltest","Test mit DMSA und Ca EDTA")
+        procain_basen, procain_2percent = _procain_row("Procain Baseninfusion mit Magnesium", "std_procain_basen","Procain Baseninfusion mit Magnesium")
+        artemisinin      = _inf_row("Artemisinin Infusion mit 2x Lysin",                "std_artemisinin",     "Artemisinin Infusion mit 2x Lysin")
+        perioperative    = _inf_row("Perioperative Infusion (3 Infusionen)",            "std_perioperative",   "Perioperative Infusion (3 Infusionen)")
+        detox_standard   = _inf_row("Detox-Infusion Standard",                          "std_detox_standard",  "Detox-Infusion Standard")
+        detox_maxi       = _inf_row("Detox-Infusion Maxi",                              "std_detox_maxi",      "Detox-Infusion Maxi")
+        aufbauinfusion   = _inf_row("Aufbauinfusion nach Detox",                        "std_aufbauinfusion",  "Aufbauinfusion nach Detox")
+        anti_aging       = _inf_row("Anti Aging Infusion komplett",                     "std_anti_aging",      "Anti Aging Infusion komplett")
+        nerven_aufbau    = _inf_row("Nerven Aufbau Infusion",                           "std_nerven_aufbau",   "Nerven Aufbau Infusion")
+        leberentgiftung  = _inf_row("Leberentgiftungsinfusion",                         "std_leberentgiftung", "Leberentgiftungsinfusion")
+        anti_oxidantien  = _inf_row("Anti-Oxidantien Infusion",                         "std_anti_oxidantien", "Anti-Oxidantien Infusion")
+        aminoinfusion    = _inf_row("Aminoinfusion leaky gut (5–10)",                   "std_aminoinfusion",   "Aminoinfusion leaky gut (5–10)")
+        relax_infusion   = _inf_row("Relax Infusion",                                   "std_relax_infusion",  "Relax Infusion")
+
+    with st.expander("Weitere Angaben", expanded=inf.get("_sec_weitere_open", False)):
+        _sched_header()
+
+        def _wa_row(label, cb_key, text_key, text_opts=None, is_select=False, is_multi=False):
+            """Checkbox + optional widget, timing on right. Checked = goes to PDF."""
             cols = st.columns(ROW_COLS)
             with cols[0]:
-                cb_cols = st.columns([0.07, 0.6, 0.33])
-                with cb_cols[0]:
-                    value = st.checkbox(" ", value=inf.get(key_prefix, False),
-                        key=f"inf_{key_prefix}_cb", label_visibility="collapsed")
-                with cb_cols[1]:
-                    st.markdown(
-                        f'<div style="display:flex;align-items:center;gap:4px;margin-top:8px;">' +
-                        f'<span style="font-size:14px;white-space:nowrap;font-family:DM Sans,sans-serif;">{label}</span>' +
-                        f'<span class="info-icon" data-tooltip="{tooltip}">ⓘ</span></div>',
-                        unsafe_allow_html=True)
-                with cb_cols[2]:
-                    ml_val = st.text_input("ml", value=inf.get(ml_key, ""),
-                        key=ml_key, placeholder="ml",
-                        label_visibility="collapsed", disabled=not value)
+                cb_c, wid_c = st.columns([2.0, 2.0])
+                with cb_c:
+                    checked = st.checkbox(label, value=inf.get(cb_key, False), key=widget_key(cb_key, "tab", cb_key))
+                with wid_c:
+                    if is_multi and text_opts:
+                        val = st.multiselect("", text_opts,
+                            default=inf.get(text_key, []) if isinstance(inf.get(text_key,[]),list) else [],
+                            key=widget_key(text_key + "_sel", "tab", text_key),
+                            label_visibility="collapsed",
+                            disabled=not checked)
+                    elif is_select and text_opts:
+                        val = st.selectbox("", text_opts,
+                            index=text_opts.index(inf.get(text_key, text_opts[0])) if inf.get(text_key, "") in text_opts else 0,
+                            key=widget_key(text_key + "_sel", "tab", text_key),
+                            label_visibility="collapsed",
+                            disabled=not checked)
+                    else:
+                        val = st.text_input("", value=inf.get(text_key, ""),
+                            key=widget_key(text_key + "_inp", "tab", text_key),
+                            placeholder="Details...",
+                            label_visibility="collapsed",
+                            disabled=not checked)
             infusion_schedule_data.update(
-                _inline_timing(value, key_prefix, patient["therapiebeginn"], patient["dauer"], "inf", inf, cols))
-            return value, ml_val
-
-        st.markdown('<div class="green-section-header">Infusionstherapie</div>', unsafe_allow_html=True)
-
-        with st.expander("RevitaClinic Infusionen", expanded=inf.get("_sec_revita_open", True)):
-            _sched_header()
-            revita_immune        = _inf_row("RevitaImmune",        "revita_immune",        "Vitamin C, Zink, Selen, Magnesium, B-Vitamine")
-            revita_immune_plus   = _inf_row("RevitaImmunePlus",    "revita_immune_plus",   "Hochdosiert: Vitamin C, Zink, Selen, Magnesium, B-Vitamine, Glutathion")
-            revita_heal          = _inf_row("Revita Heal (2x)",    "revita_heal",          "Vitamin C, Zink, Arginin, Glutamin, B-Vitamine, Magnesium")
-            revita_bludder       = _inf_row("RevitaBludder",       "revita_bludder",       "Eisen, Vitamin B12, Folsäure, Vitamin C")
-            revita_ferro         = _inf_row("RevitaFerro",         "revita_ferro",         "Ferinject (Eisen), Vitamin C")
-            revita_energy        = _inf_row("RevitaEnergyBoost",   "revita_energy",        "Magnesium, B-Vitamine, Vitamin C, Coenzym Q10")
-            revita_focus         = _inf_row("RevitaFocus",         "revita_focus",         "Magnesium, B-Vitamine, Vitamin C, Zink, Alpha-Liponsäure")
-            revita_nad           = _inf_row("RevitaNAD+",          "revita_nad",           "NAD+ 500mg (oder 125mg), Magnesium, B-Vitamine")
-            revita_relax         = _inf_row("RevitaRelax",         "revita_relax",         "Magnesium, B-Vitamine, Vitamin C, Calcium")
-            revita_fit           = _inf_row("RevitaFit",           "revita_fit",           "Magnesium, B-Vitamine, Vitamin C, Aminosäuren, Coenzym Q10")
-            revita_hangover      = _inf_row("RevitaHangover",      "revita_hangover",      "Elektrolyte, Vitamin C, B-Vitamine, Magnesium, Glutathion")
-            revita_beauty        = _inf_row("RevitaBeauty",        "revita_beauty",        "Vitamin C, Biotin, Zink, Selen, B-Vitamine")
-            revita_antiaging     = _inf_row("RevitaAnti-Aging",    "revita_antiaging",     "Glutathion, Vitamin C, Alpha-Liponsäure, Selen, Zink")
-            revita_detox         = _inf_row("RevitaDetox",         "revita_detox",         "Glutathion, Vitamin C, Magnesium, B-Vitamine")
-            revita_chelate       = _inf_row("RevitaChelate",       "revita_chelate",       "EDTA, DMSA, Vitamin C, Magnesium, Zink")
-            revita_liver         = _inf_row("RevitaLiver",         "revita_liver",         "Glutathion, Vitamin C, B-Vitamine, Magnesium, Mariendistel-Extrakt")
-            revita_leakygut      = _inf_row("RevitaLeaky-gut",     "revita_leakygut",      "Glutamin, Zink, Vitamin C, B-Vitamine, Magnesium")
-            revita_infection     = _inf_row("RevitaInfection",     "revita_infection",     "Vitamin C, Zink, Selen, Magnesium, B-Vitamine, Glutathion")
-            revita_joint         = _inf_row("RevitaJoint",         "revita_joint",         "Vitamin C, Magnesium, Zink, Mangan, B-Vitamine")
-
-        with st.expander("Sonstiges", expanded=inf.get("_sec_sonstiges_open", False)):
-            _sched_header()
-            mito_energy      = _inf_row("Mito-Energy Behandlung (Mito-Gerät, Wirkbooster)", "std_mito_energy",     "Mito-Energy Behandlung mit Wirkbooster")
-            oxyvenierung     = _inf_row("Oxyvenierung (10–40 ml, 10er Serie)",              "std_oxyvenierung",    "Oxyvenierung (10–40 ml, 10er Serie)")
-
-            # 2 additional free-text checkbox rows with timing
-            def _inf_custom_row(idx):
-                key_cb   = f"inf_custom{idx}_cb"
-                key_text = f"inf_custom{idx}_text"
-                key_slug = f"inf_custom{idx}"
-                cols = st.columns(ROW_COLS)
-                with cols[0]:
-                    cb_c, txt_c = st.columns([0.07, 0.93])
-                    with cb_c:
-                        checked = st.checkbox("", value=inf.get(key_cb, False),
-                            key=key_cb, label_visibility="collapsed")
-                    with txt_c:
-                        txt = st.text_input("", value=inf.get(key_text, ""),
-                            key=key_text, placeholder=f"Zusatz {idx}...",
-                            label_visibility="collapsed", disabled=not checked)
-                infusion_schedule_data.update(
-                    _inline_timing(checked, key_slug, patient["therapiebeginn"], patient["dauer"], "inf", inf, cols))
-                return checked, txt
-
-            inf_custom1_cb, inf_custom1_text = _inf_custom_row(1)
-            inf_custom2_cb, inf_custom2_text = _inf_custom_row(2)
-
-        with st.expander("Standard Infusionen", expanded=inf.get("_sec_standard_open", False)):
-            _sched_header()
-            schwermetalltest = _inf_row("Schwermetalltest mit DMSA und Ca EDTA",            "std_schwermetalltest","Test mit DMSA und Ca EDTA")
-            procain_basen, procain_2percent = _procain_row("Procain Baseninfusion mit Magnesium", "std_procain_basen","Procain Baseninfusion mit Magnesium")
-            artemisinin      = _inf_row("Artemisinin Infusion mit 2x Lysin",                "std_artemisinin",     "Artemisinin Infusion mit 2x Lysin")
-            perioperative    = _inf_row("Perioperative Infusion (3 Infusionen)",            "std_perioperative",   "Perioperative Infusion (3 Infusionen)")
-            detox_standard   = _inf_row("Detox-Infusion Standard",                          "std_detox_standard",  "Detox-Infusion Standard")
-            detox_maxi       = _inf_row("Detox-Infusion Maxi",                              "std_detox_maxi",      "Detox-Infusion Maxi")
-            aufbauinfusion   = _inf_row("Aufbauinfusion nach Detox",                        "std_aufbauinfusion",  "Aufbauinfusion nach Detox")
-            anti_aging       = _inf_row("Anti Aging Infusion komplett",                     "std_anti_aging",      "Anti Aging Infusion komplett")
-            nerven_aufbau    = _inf_row("Nerven Aufbau Infusion",                           "std_nerven_aufbau",   "Nerven Aufbau Infusion")
-            leberentgiftung  = _inf_row("Leberentgiftungsinfusion",                         "std_leberentgiftung", "Leberentgiftungsinfusion")
-            anti_oxidantien  = _inf_row("Anti-Oxidantien Infusion",                         "std_anti_oxidantien", "Anti-Oxidantien Infusion")
-            aminoinfusion    = _inf_row("Aminoinfusion leaky gut (5–10)",                   "std_aminoinfusion",   "Aminoinfusion leaky gut (5–10)")
-            relax_infusion   = _inf_row("Relax Infusion",                                   "std_relax_infusion",  "Relax Infusion")
-
-        with st.expander("Weitere Angaben", expanded=inf.get("_sec_weitere_open", False)):
-            _sched_header()
-
-            def _wa_row(label, cb_key, text_key, text_opts=None, is_select=False, is_multi=False):
-                """Checkbox + optional widget, timing on right. Checked = goes to PDF."""
-                cols = st.columns(ROW_COLS)
-                with cols[0]:
-                    cb_c, wid_c = st.columns([2.0, 2.0])
-                    with cb_c:
-                        checked = st.checkbox(label, value=inf.get(cb_key, False), key=cb_key)
-                    with wid_c:
-                        if is_multi and text_opts:
-                            val = st.multiselect("", text_opts,
-                                default=inf.get(text_key, []) if isinstance(inf.get(text_key,[]),list) else [],
-                                key=text_key + "_sel",
-                                label_visibility="collapsed",
-                                disabled=not checked)
-                        elif is_select and text_opts:
-                            val = st.selectbox("", text_opts,
-                                index=text_opts.index(inf.get(text_key, text_opts[0])) if inf.get(text_key, "") in text_opts else 0,
-                                key=text_key + "_sel",
-                                label_visibility="collapsed",
-                                disabled=not checked)
-                        else:
-                            val = st.text_input("", value=inf.get(text_key, ""),
-                                key=text_key + "_inp",
-                                placeholder="Details...",
-                                label_visibility="collapsed",
-                                disabled=not checked)
-                infusion_schedule_data.update(
-                    _inline_timing(checked, text_key, patient["therapiebeginn"], patient["dauer"], "inf", inf, cols))
-                return checked, val
-
-            _if_cb, infektions_infusion = _wa_row(
-                "Infektions-Infusion / H2O2", "infektions_infusion_cb", "infektions_infusion")
-            _ib_cb, immun_booster = _wa_row(
-                "Immun-Boosterung Typ", "immun_booster_cb", "immun_booster",
-                text_opts=["","Typ 1","Typ 2","Typ 3"], is_select=True)
-            _en_cb, energetisierungsinfusion = _wa_row(
-                "Energetisierungsinfusion mit", "energetisierungsinfusion_cb", "energetisierungsinfusion",
-                text_opts=["Vitamin B Shot","Q10 Boostershot"], is_multi=True)
-            _ns_cb, naehrstoffinfusion = _wa_row(
-                "Nährstoffinfusion mit", "naehrstoffinfusion_cb", "naehrstoffinfusion",
-                text_opts=["Glutathion","Alpha Liponsäure"], is_multi=True)
-            _ei_cb, eisen_infusion = _wa_row(
-                "Eisen Infusion (Ferinject)", "eisen_infusion_cb", "eisen_infusion")
-
-
-        with st.expander("Single Ingredients / Einzel", expanded=inf.get("_sec_single_open", False)):
-            _sched_header()
-            vitamin_c                = _inf_row("Hochdosis Vitamin C (g)",    "single_vitamin_c",               "Hochdosiertes Vitamin C")
-            vitamin_b_komplex        = _inf_row("Vit. B-Komplex",             "single_vitamin_b_komplex",       "Vitamin B-Komplex")
-            vitamin_d                = _inf_row("Vit. D",                     "single_vitamin_d",               "Vitamin D")
-            vitamin_b6_b12_folsaeure = _inf_row("Vit. B6/B12/Folsäure",      "single_vitamin_b6_b12_folsaeure","Vitamin B6, B12 und Folsäure")
-            vitamin_b3               = _inf_row("Vit. B3",                    "single_vitamin_b3",              "Vitamin B3")
-
-        with st.expander("Zusätze & Extras", expanded=inf.get("_sec_zusaetze_open", False)):
-            _extra_rows("inf", "inf", inf, patient["therapiebeginn"], patient["dauer"], infusion_schedule_data)
-            zusaetze = st.multiselect("Zusätze auswählen",
-                ["Vit.B Komplex","Vit.B6/B12/Folsäure","Vit.D 300 kIE","Vit.B3","Biotin","Glycin",
-                 "Cholincitrat","Zink inject","Magnesium 400mg","TAD (red.Glut.)","Arginin","Glutamin",
-                 "Taurin","Ornithin","Prolin/Lysin","Lysin","PC 1000mg","Oxyvenierung","Mito-Energy"],
-                default=inf.get("zusaetze",[]), key="zusaetze_select")
-
-        new_inf = {
-            "inf_custom1_cb": inf_custom1_cb, "inf_custom1_text": inf_custom1_text,
-            "inf_custom2_cb": inf_custom2_cb, "inf_custom2_text": inf_custom2_text,
-            "infektions_infusion_cb": _if_cb, "immun_booster_cb": _ib_cb,
-            "energetisierungsinfusion_cb": _en_cb, "naehrstoffinfusion_cb": _ns_cb,
-            "eisen_infusion_cb": _ei_cb,
-            "revita_immune": revita_immune, "revita_immune_plus": revita_immune_plus,
-            "revita_heal": revita_heal, "revita_bludder": revita_bludder,
-            "revita_ferro": revita_ferro, "revita_energy": revita_energy,
-            "revita_focus": revita_focus, "revita_nad": revita_nad,
-            "revita_relax": revita_relax, "revita_fit": revita_fit,
-            "revita_hangover": revita_hangover, "revita_beauty": revita_beauty,
-            "revita_antiaging": revita_antiaging, "revita_detox": revita_detox,
-            "revita_chelate": revita_chelate, "revita_liver": revita_liver,
-            "revita_leakygut": revita_leakygut, "revita_infection": revita_infection,
-            "revita_joint": revita_joint,
-            # std_* keys match the key_prefix used in _inf_row → timing stored correctly
-            "std_mito_energy": mito_energy, "std_schwermetalltest": schwermetalltest,
-            "std_procain_basen": procain_basen, "std_procain_basen_ml": procain_2percent,
-            "std_artemisinin": artemisinin, "std_perioperative": perioperative,
-            "std_detox_standard": detox_standard, "std_detox_maxi": detox_maxi,
-            "std_aufbauinfusion": aufbauinfusion, "std_oxyvenierung": oxyvenierung,
-            "std_anti_aging": anti_aging, "std_nerven_aufbau": nerven_aufbau,
-            "std_leberentgiftung": leberentgiftung, "std_anti_oxidantien": anti_oxidantien,
-            "std_aminoinfusion": aminoinfusion, "std_relax_infusion": relax_infusion,
-            # alias without std_ prefix for PDF lookup
-            "mito_energy": mito_energy, "schwermetalltest": schwermetalltest,
-            "procain_basen": procain_basen, "artemisinin": artemisinin,
-            "perioperative": perioperative, "detox_standard": detox_standard,
-            "detox_maxi": detox_maxi, "aufbauinfusion": aufbauinfusion,
-            "oxyvenierung": oxyvenierung, "anti_aging": anti_aging,
-            "nerven_aufbau": nerven_aufbau, "leberentgiftung": leberentgiftung,
-            "anti_oxidantien": anti_oxidantien, "aminoinfusion": aminoinfusion,
-            "relax_infusion": relax_infusion,
-            "infektions_infusion": infektions_infusion, "immun_booster": immun_booster,
-            "energetisierungsinfusion": energetisierungsinfusion,
-            "naehrstoffinfusion": naehrstoffinfusion, "eisen_infusion": eisen_infusion,
-            "single_vitamin_c": vitamin_c, "single_vitamin_b_komplex": vitamin_b_komplex,
-            "single_vitamin_d": vitamin_d,
-            "single_vitamin_b6_b12_folsaeure": vitamin_b6_b12_folsaeure,
-            "single_vitamin_b3": vitamin_b3,
-            # alias without single_ for PDF
-            "vitamin_c": vitamin_c, "vitamin_b_komplex": vitamin_b_komplex,
-            "vitamin_d": vitamin_d, "vitamin_b6_b12_folsaeure": vitamin_b6_b12_folsaeure,
-            "vitamin_b3": vitamin_b3, "zusaetze": zusaetze,
+                _inline_timing(checked, text_key, patient["therapiebeginn"], patient["dauer"], "inf", inf, cols))
+            return checked, val
+
+        _if_cb, infektions_infusion = _wa_row(
+            "Infektions-Infusion / H2O2", "infektions_infusion_cb", "infektions_infusion")
+        _ib_cb, immun_booster = _wa_row(
+            "Immun-Boosterung Typ", "immun_booster_cb", "immun_booster",
+            text_opts=["","Typ 1","Typ 2","Typ 3"], is_select=True)
+        _en_cb, energetisierungsinfusion = _wa_row(
+            "Energetisierungsinfusion mit", "energetisierungsinfusion_cb", "energetisierungsinfusion",
+            text_opts=["Vitamin B Shot","Q10 Boostershot"], is_multi=True)
+        _ns_cb, naehrstoffinfusion = _wa_row(
+            "Nährstoffinfusion mit", "naehrstoffinfusion_cb", "naehrstoffinfusion",
+            text_opts=["Glutathion","Alpha Liponsäure"], is_multi=True)
+        _ei_cb, eisen_infusion = _wa_row(
+            "Eisen Infusion (Ferinject)", "eisen_infusion_cb", "eisen_infusion")
+
+
+    with st.expander("Single Ingredients / Einzel", expanded=inf.get("_sec_single_open", False)):
+        _sched_header()
+        vitamin_c                = _inf_row("Hochdosis Vitamin C (g)",    "single_vitamin_c",               "Hochdosiertes Vitamin C")
+        vitamin_b_komplex        = _inf_row("Vit. B-Komplex",             "single_vitamin_b_komplex",       "Vitamin B-Komplex")
+        vitamin_d                = _inf_row("Vit. D",                     "single_vitamin_d",               "Vitamin D")
+        vitamin_b6_b12_folsaeure = _inf_row("Vit. B6/B12/Folsäure",      "single_vitamin_b6_b12_folsaeure","Vitamin B6, B12 und Folsäure")
+        vitamin_b3               = _inf_row("Vit. B3",                    "single_vitamin_b3",              "Vitamin B3")
+
+    with st.expander("Zusätze & Extras", expanded=inf.get("_sec_zusaetze_open", False)):
+        _extra_rows("inf", "inf", inf, patient["therapiebeginn"], patient["dauer"], infusion_schedule_data)
+        zusaetze = st.multiselect("Zusätze auswählen",
+            ["Vit.B Komplex","Vit.B6/B12/Folsäure","Vit.D 300 kIE","Vit.B3","Biotin","Glycin",
+             "Cholincitrat","Zink inject","Magnesium 400mg","TAD (red.Glut.)","Arginin","Glutamin",
+             "Taurin","Ornithin","Prolin/Lysin","Lysin","PC 1000mg","Oxyvenierung","Mito-Energy"],
+            default=inf.get("zusaetze",[]), key=widget_key("zusaetze_select", "tab", "zusaetze"))
+
+    new_inf = {
+        "inf_custom1_cb": inf_custom1_cb, "inf_custom1_text": inf_custom1_text,
+        "inf_custom2_cb": inf_custom2_cb, "inf_custom2_text": inf_custom2_text,
+        "infektions_infusion_cb": _if_cb, "immun_booster_cb": _ib_cb,
+        "energetisierungsinfusion_cb": _en_cb, "naehrstoffinfusion_cb": _ns_cb,
+        "eisen_infusion_cb": _ei_cb,
+        "revita_immune": revita_immune, "revita_immune_plus": revita_immune_plus,
+        "revita_heal": revita_heal, "revita_bludder": revita_bludder,
+        "revita_ferro": revita_ferro, "revita_energy": revita_energy,
+        "revita_focus": revita_focus, "revita_nad": revita_nad,
+        "revita_relax": revita_relax, "revita_fit": revita_fit,
+        "revita_hangover": revita_hangover, "revita_beauty": revita_beauty,
+        "revita_antiaging": revita_antiaging, "revita_detox": revita_detox,
+        "revita_chelate": revita_chelate, "revita_liver": revita_liver,
+        "revita_leakygut": revita_leakygut, "revita_infection": revita_infection,
+        "revita_joint": revita_joint,
+        # std_* keys match the key_prefix used in _inf_row → timing stored correctly
+        "std_mito_energy": mito_energy, "std_schwermetalltest": schwermetalltest,
+        "std_procain_basen": procain_basen, "std_procain_basen_ml": procain_2percent,
+        "std_artemisinin": artemisinin, "std_perioperative": perioperative,
+        "std_detox_standard": detox_standard, "std_detox_maxi": detox_maxi,
+        "std_aufbauinfusion": aufbauinfusion, "std_oxyvenierung": oxyvenierung,
+        "std_anti_aging": anti_aging, "std_nerven_aufbau": nerven_aufbau,
+        "std_leberentgiftung": leberentgiftung, "std_anti_oxidantien": anti_oxidantien,
+        "std_aminoinfusion": aminoinfusion, "std_relax_infusion": relax_infusion,
+        # alias without std_ prefix for PDF lookup
+        "mito_energy": mito_energy, "schwermetalltest": schwermetalltest,
+        "procain_basen": procain_basen, "artemisinin": artemisinin,
+        "perioperative": perioperative, "detox_standard": detox_standard,
+        "detox_maxi": detox_maxi, "aufbauinfusion": aufbauinfusion,
+        "oxyvenierung": oxyvenierung, "anti_aging": anti_aging,
+        "nerven_aufbau": nerven_aufbau, "leberentgiftung": leberentgiftung,
+        "anti_oxidantien": anti_oxidantien, "aminoinfusion": aminoinfusion,
+        "relax_infusion": relax_infusion,
+        "infektions_infusion": infektions_infusion, "immun_booster": immun_booster,
+        "energetisierungsinfusion": energetisierungsinfusion,
+        "naehrstoffinfusion": naehrstoffinfusion, "eisen_infusion": eisen_infusion,
+        "single_vitamin_c": vitamin_c, "single_vitamin_b_komplex": vitamin_b_komplex,
+        "single_vitamin_d": vitamin_d,
+        "single_vitamin_b6_b12_folsaeure": vitamin_b6_b12_folsaeure,
+        "single_vitamin_b3": vitamin_b3,
+        # alias without single_ for PDF
+        "vitamin_c": vitamin_c, "vitamin_b_komplex": vitamin_b_komplex,
+        "vitamin_d": vitamin_d, "vitamin_b6_b12_folsaeure": vitamin_b6_b12_folsaeure,
+        "vitamin_b3": vitamin_b3, "zusaetze": zusaetze,
+    }
+    new_inf.update(infusion_schedule_data)
+    st.session_state.infusion_data = new_inf
+
+    if st.button("Infusionstherapie PDF generieren", key="infusion_pdf_button"):
+        pdf_bytes = generate_pdf(patient, st.session_state.infusion_data, "INFUSIONSTHERAPIE")
+        st.session_state.auto_download_pdf = {
+            "data": pdf_bytes,
+            "filename": f"RevitaClinic_Infusionstherapie_{patient.get('patient','')}.pdf",
+            "mime": "application/pdf"
         }
-        new_inf.update(infusion_schedule_data)
-        st.session_state.infusion_data = new_inf
-
-        if st.button("Infusionstherapie PDF generieren", key="infusion_pdf_button"):
-            pdf_bytes = generate_pdf(patient, st.session_state.infusion_data, "INFUSIONSTHERAPIE")
-            st.session_state.auto_download_pdf = {
-                "data": pdf_bytes,
-                "filename": f"RevitaClinic_Infusionstherapie_{patient.get('patient','')}.pdf",
-                "mime": "application/pdf"
-            }
-            st.rerun()
+        st.rerun()
+
+
+# =========================================================
+# MAIN
+# =========================================================
+def main():
+    catalog = get_catalog()
+    df = catalog.df
+
+    if st.session_state.get('just_loaded_patient', False):
+        st.session_state.just_loaded_patient = False
+
+    # ── Full wipe after delete ───────────────────────────────────────────
+    # st.session_state.clear() removes ALL keys including widget keys.
+    # This is safe here because we are BEFORE patient_inputs() renders,
+    # so no widgets have been instantiated in this run yet.
+    if st.session_state.get("_do_full_wipe"):
+        st.session_state.clear()
+        st.session_state["patient_data"]      = {}
+        st.session_state["nem_prescriptions"] = []
+        st.session_state["therapieplan_data"] = {}
+        st.session_state["ernaehrung_data"]   = {}
+        st.session_state["infusion_data"]     = {}
+        st.session_state["_reset_dropdown"]   = True
+        st.rerun()
+
+    # Cleared for the full run; set again once the tabs' inputs are known
+    st.session_state["_tabs_rendered_with"] = None
+    patient = patient_inputs()
+    st.session_state["_tabs_rendered_with"] = (patient["therapiebeginn"], patient["dauer"])
+
+    for k in ['show_delete_confirmation','show_save_success']:
+        if k not in st.session_state:
+            st.session_state[k] = False
+    if 'auto_download_pdf' not in st.session_state:
+        st.session_state.auto_download_pdf = None
+    if 'nem_pdf_bytes' not in st.session_state:
+        st.session_state.nem_pdf_bytes = None
+
+    # The directory is updated in place by save/delete, so it is never stale here
+    is_saved_patient = bool(patient["patient"] and patient["patient"] in get_patient_directory())
+
+    # ── Action buttons row ──────────────────────────────────────────────────
+    if "show_delete_confirmation" not in st.session_state:
+        st.session_state.show_delete_confirmation = False
+    _btn_cols = st.columns([1, 1, 6])
+    with _btn_cols[0]:
+        save_button = st.button("💾 Speichern", key="save_btn_main", use_container_width=True)
+    with _btn_cols[1]:
+        # Always render button (avoids widget key lifecycle issues),
+        # but only enable it for saved patients
+        del_clicked = st.button("🗑 Löschen", key="del_btn_main",
+                                use_container_width=True,
+                                disabled=not is_saved_patient)
+        if del_clicked and is_saved_patient:
+            st.session_state.show_delete_confirmation = True
+
+    delete_button = False  # legacy compat
+
+    if st.session_state.get("show_save_success", False):
+        st.markdown('<div class="success-message">✅ Alle Daten wurden erfolgreich gespeichert!</div>', unsafe_allow_html=True)
+        time.sleep(3)
+        st.session_state.show_save_success = False
+        st.rerun()
+
+    if st.session_state.get("show_delete_confirmation", False):
+        st.markdown("---")
+        st.warning("⚠️ **ACHTUNG: Dieser Vorgang kann nicht rückgängig gemacht werden!**")
+        st.error(f"Das Löschen wird alle Daten für Patient '{patient['patient']}' unwiderruflich entfernen.")
+        cc1, cc2 = st.columns(2)
+        with cc1:
+            if st.button("Ja, endgültig löschen", use_container_width=True, key="confirm_delete"):
+                if delete_patient_data(patient["patient"]):
+                    # DB deleted. Now wipe session state via two-pass flag.
+                    st.session_state["_do_full_wipe"] = True
+                    st.rerun()
+                else:
+                    st.error("Fehler beim Löschen — prüfen Sie die Konsole.")
+        with cc2:
+            if st.button("Abbrechen", use_container_width=True, key="cancel_delete"):
+                st.session_state.show_delete_confirmation = False
+                st.info("Löschen abgebrochen")
+                st.rerun()
+
+    st.markdown("---")
+    # Each tab is a fragment: a widget change inside it reruns only that tab.
+    # They read the patient from st.session_state.patient_header and write
+    # their data back to st.session_state for the save handler.
+    tab_labels = ["Therapieplan", "Nahrungsergänzungsmittel (NEM)", "Infusionstherapie"]
+    tab_bodies = [therapieplan_tab, nem_tab, infusion_tab]
+    if TAB_ROUTER:
+        # Only the open tab runs; the active tab is kept in st.session_state.active_tab.
+        # therapieplan_data, nem_prescriptions and infusion_data keep the other
+        # tabs' last values, which is what save and the PDFs read.
+        tabs = st.tabs(tab_labels, key="active_tab", on_change="rerun")
+        for tab, body in zip(tabs, tab_bodies):
+            if tab.open:
+                with tab:
+                    body()
+    else:
+        for tab, body in zip(st.tabs(tab_labels), tab_bodies):
+            with tab:
+                body()
 
 
     # =========================================================
@@ -2452,41 +2640,10 @@ def main():
                 "kt24_date":                _d(patient.get("kt24_date")),
             }
 
-            # ── 2. NEM: collect from session state nem_prescriptions ──
-            # The NEM form only commits on its own submit button.
-            # But every time the form renders, the widget session state keys
-            # ARE updated (Streamlit updates them on every interaction).
-            # Collect from widget keys (available even without form submit).
-            nem_to_save = []
-            for _, df_row in df.iterrows():
-                rid  = df_row["id"]
-                name = df_row["name"]
-                if rid.startswith("CAT"): continue
-                gd   = str(st.session_state.get(f"{rid}_gesamt_dosierung","") or "")
-                frm  = str(st.session_state.get(f"{rid}_darreichungsform","") or "")
-                pe   = str(st.session_state.get(f"{rid}_pro_Einnahme","") or "")
-                nue  = str(st.session_state.get(f"{rid}_Nuechtern","") or "")
-                morg = str(st.session_state.get(f"{rid}_Morgens","") or "")
-                mitt = str(st.session_state.get(f"{rid}_Mittags","") or "")
-                abnd = str(st.session_state.get(f"{rid}_Abends","") or "")
-                ncht = str(st.session_state.get(f"{rid}_Nachts","") or "")
-                kom  = str(st.session_state.get(f"{rid}_comment","") or "")
-                if any(x.strip() for x in [gd, pe, nue, morg, mitt, abnd, ncht, kom]):
-                    nem_to_save.append({
-                        "name":              name,
-                        "Gesamt-dosierung":  gd,
-                        "Darreichungsform":  frm,
-                        "Pro Einnahme":      pe,
-                        "Nüchtern":          nue,
-                        "Morgens":           morg,
-                        "Mittags":           mitt,
-                        "Abends":            abnd,
-                        "Nachts":            ncht,
-                        "Kommentar":         kom,
-                    })
-            # Fall back to last committed NEM data if no widget keys found
-            if not nem_to_save:
-                nem_to_save = st.session_state.get("nem_prescriptions", [])
+            # ── 2. NEM: rows with values from the columnar store ──
+            # Current as of the last NEM edit (or the load, if the tab wasn't opened).
+            table       = nem_table()
+            nem_to_save = table[_nem_has_values_mask(table)].to_dict("records")
 
             # ── 3. Therapieplan + Infusion (already in session state, updated every render) ──
             tp_db  = _ser(st.session_state.get("therapieplan_data",  {}))
@@ -2499,12 +2656,11 @@ def main():
 
             ok = save_patient_data(patient_for_db, nem_to_save, tp_db, ern_db, inf_db)
             if ok:
-                st.session_state.nem_prescriptions = nem_to_save
+                set_nem_prescriptions(nem_to_save)
                 st.session_state.show_save_success = True
                 st.session_state.last_loaded_patient = patient_for_db["patient"]
                 st.session_state["_set_dropdown"] = patient_for_db["patient"]
-                # Flag: treat as saved patient immediately on next render
-                st.session_state["_just_saved_patient"] = patient_for_db["patient"]
+                st.session_state.pop("patient_picker", None)
                 st.rerun()
             else:
                 st.error("❌ Fehler beim Speichern! Konsole prüfen.")
@@ -2521,6 +2677,10 @@ def main():
         )
         st.session_state.auto_download_pdf = None
 
+    if DEBUG_SESSION_SIZE:
+        n_keys, n_bytes = session_footprint()
+        print(f"Session state: {n_keys} keys, {n_bytes / 1024:.1f} KB")
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
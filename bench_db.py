@@ -0,0 +1,326 @@
+"""Data-layer benchmark: save / load / delete / catalog / names.
+
+Runs SupabaseDB against the in-process stand-in (fake_supabase, with the
+RPC save and with the per-table save) and the SQLite backend with synthetic patients holding 0, 20 and 80 NEM
+prescriptions and therapy blobs of realistic size. Reports p50/p95 latency,
+requests and payload bytes per operation and exits non-zero if an operation
+exceeds its budget.
+
+    python bench_db.py                       # all backends, 5 patients per size
+    python bench_db.py --backend fake --latency 0.03 --iterations 10
+    python bench_db.py --output bench_output.txt
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import Dict, List
+
+from fake_supabase import FakeSupabase
+from sqlite_db import SQLiteDB
+from supabase_db import SupabaseDB
+
+NEM_SIZES = (0, 20, 80)
+N_SUPPLEMENTS = 300
+N_CATEGORIES = 12
+
+# Max requests per call, by backend. For SQLite a "request" is one SQL
+# statement. An unchanged save still costs the patients.revision check (in the
+# RPC itself, or a select plus a final read on the per-table path).
+REQUEST_BUDGETS = {
+    'fake': {
+        'fetch_supplements':    1,
+        'fetch_patient_names':  1,
+        'save_new':             1,
+        'save_unchanged':       1,
+        'save_one_nem_changed': 1,
+        'load':                 1,
+        'delete':               5,
+    },
+    'fake-rest': {
+        'fetch_supplements':    1,
+        'fetch_patient_names':  1,
+        'save_new':             8,
+        'save_unchanged':       1,
+        'save_one_nem_changed': 4,
+        'load':                 1,
+        'delete':               5,
+    },
+    'sqlite': {
+        'fetch_supplements':    1,
+        'fetch_patient_names':  1,
+        'save_new':             7,
+        'save_unchanged':       7,
+        'save_one_nem_changed': 7,
+        'load':                 5,
+        'delete':               5,
+    },
+}
+
+# Max bytes sent by one call (request payloads as JSON). The RPC save sends
+# only changed sections and, of the NEM list, only changed rows plus the kept
+# supplement ids, so editing one prescription must not resend the list.
+SENT_BUDGETS = {
+    'fake': {
+        'save_unchanged':       600,
+        'save_one_nem_changed': 1500,
+    },
+    'fake-rest': {
+        'save_unchanged':       100,
+        'save_one_nem_changed': 500,
+    },
+}
+
+# Max p95 latency per call. For the fake backend in round trips of the
+# injected latency: concurrent requests overlap, so this is the depth of the
+# request chain rather than the request count. For SQLite in milliseconds.
+LATENCY_BUDGETS = {
+    'fake': {
+        'fetch_supplements':    1,
+        'fetch_patient_names':  1,
+        'save_new':             1,
+        'save_unchanged':       1,
+        'save_one_nem_changed': 1,
+        'load':                 1,
+        'delete':               5,
+    },
+    'fake-rest': {
+        'fetch_supplements':    1,
+        'fetch_patient_names':  1,
+        'save_new':             5,
+        'save_unchanged':       1,
+        'save_one_nem_changed': 4,
+        'load':                 1,
+        'delete':               5,
+    },
+    'sqlite': {
+        'fetch_supplements':    50,
+        'fetch_patient_names':  50,
+        'save_new':             50,
+        'save_unchanged':       50,
+        'save_one_nem_changed': 50,
+        'load':                 20,
+        'delete':               20,
+    },
+}
+
+
+# ──────────────────────────────────────────────────────────
+# SYNTHETIC DATA
+# ──────────────────────────────────────────────────────────
+
+def make_supplements() -> List[Dict]:
+    rows = []
+    per_cat = N_SUPPLEMENTS // N_CATEGORIES
+    for c in range(1, N_CATEGORIES + 1):
+        rows.append({'id': f'CAT{c}', 'name': f'CATEGORY: Kategorie {c}', 'category': c})
+        for i in range(per_cat):
+            n = (c - 1) * per_cat + i + 1
+            rows.append({'id': f'S{n:03d}', 'name': f'Supplement {n:03d}', 'category': c})
+    return rows
+
+
+def make_nem(n: int, rng: random.Random) -> List[Dict]:
+    names = rng.sample([f'Supplement {i:03d}' for i in range(1, N_SUPPLEMENTS + 1)], n)
+    return [{
+        'name':             name,
+        'Gesamt-dosierung': str(rng.choice([30, 60, 90, 120])),
+        'Darreichungsform': rng.choice(['Kapseln', 'Tabletten', 'Pulver', 'Tropfen']),
+        'Pro Einnahme':     rng.choice(['1', '2', '1/2', '5 Tropfen']),
+        'Nüchtern':         rng.choice(['', '1']),
+        'Morgens':          rng.choice(['', '1', '2']),
+        'Mittags':          rng.choice(['', '1']),
+        'Abends':           rng.choice(['', '1']),
+        'Nachts':           '',
+        'Kommentar':        rng.choice(['', '', 'mit Mahlzeit']),
+    } for name in names]
+
+
+def make_blob(prefix: str, rows: int, rng: random.Random) -> Dict:
+    """A therapy blob shaped like the app's: checkbox + timing per row."""
+    start = date(2025, 1, 6)
+    data = {}
+    for i in range(rows):
+        slug = f'{prefix}_item{i:03d}'
+        checked = rng.random() < 0.15
+        data[slug] = checked
+        w_start = rng.randint(1, 6) if checked else 1
+        w_end = w_start + rng.randint(0, 4) if checked else 1
+        data[f'{slug}_w_start'] = str(w_start)
+        data[f'{slug}_w_end'] = str(w_end)
+        data[f'{slug}_date_start'] = (start + timedelta(weeks=w_start - 1)).isoformat()
+        data[f'{slug}_date_end'] = (start + timedelta(weeks=w_end) - timedelta(days=1)).isoformat()
+        data[f'{slug}_freq'] = rng.choice(['1x/Woche', '2x/Woche']) if checked else ''
+        data[f'{slug}_comment'] = 'Kontrolle' if checked and rng.random() < 0.3 else ''
+    return data
+
+
+def make_patient(name: str, nem_size: int, rng: random.Random):
+    patient = {
+        'patient': name, 'geburtsdatum': '1980-05-17', 'geschlecht': rng.choice(['M', 'W']),
+        'groesse': 175, 'gewicht': 72, 'therapiebeginn': '2025-01-06', 'dauer': 6,
+        'tw_besprochen': 'Ja', 'allergie': '', 'diagnosen': 'Erschöpfung',
+        'kontrolltermin_4': True, 'kontrolltermin_12': False, 'kontrolltermin_24': False,
+        'kontrolltermin_kommentar': '', 'kt4_date': '2025-02-03', 'kt12_date': None, 'kt24_date': None,
+    }
+    return (patient, make_nem(nem_size, rng),
+            make_blob('tp', 150, rng), make_blob('ern', 20, rng), make_blob('inf', 60, rng))
+
+
+# ──────────────────────────────────────────────────────────
+# MEASUREMENT
+# ──────────────────────────────────────────────────────────
+
+class Recorder:
+    def __init__(self, db, client=None):
+        self.db = db
+        self.client = client
+        self.samples: Dict[str, List[tuple]] = {}
+
+    def run(self, op: str, fn):
+        requests_before = self.db.request_count
+        bytes_before, sent_before = self._bytes()
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        nbytes, sent = self._bytes()
+        self.samples.setdefault(op, []).append(
+            (elapsed, self.db.request_count - requests_before, nbytes - bytes_before, sent - sent_before))
+        return result
+
+    def _bytes(self):
+        """(bytes sent + received, bytes sent) so far."""
+        if self.client is None:
+            return 0, 0
+        return self.client.bytes_sent + self.client.bytes_received, self.client.bytes_sent
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * p
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def run_backend(name: str, db, client, iterations: int, seed: int) -> Recorder:
+    rec = Recorder(db, client)
+    rng = random.Random(seed)
+    rec.run('fetch_supplements', db.fetch_supplements)
+    db.get_catalog()
+    db.get_patient_directory()
+
+    for size in NEM_SIZES:
+        for i in range(iterations):
+            pname = f'Bench {name} {size:02d}-{i:03d}'
+            patient, nem, tp, ern, inf = make_patient(pname, size, rng)
+            # One session's record of what it last loaded or saved
+            sections = {}
+            assert rec.run('save_new', lambda: db.save_patient_data(patient, nem, tp, ern, inf, sections))
+            assert rec.run('save_unchanged', lambda: db.save_patient_data(patient, nem, tp, ern, inf, sections))
+            if nem:
+                nem[0] = dict(nem[0], Kommentar='geändert')
+                assert rec.run('save_one_nem_changed',
+                               lambda: db.save_patient_data(patient, nem, tp, ern, inf, sections))
+            loaded = rec.run('load', lambda: db.load_patient_data(pname, sections))
+            assert loaded[0] is not None and len(loaded[1]) == size, f'load mismatch for {pname}'
+            assert loaded[2] == tp, f'therapieplan did not round-trip for {pname}'
+
+    rec.run('fetch_patient_names', db.fetch_patient_names)
+    for pname in list(db.get_patient_directory().names()):
+        if pname.startswith(f'Bench {name} '):
+            assert rec.run('delete', lambda: db.delete_patient_data(pname))
+    return rec
+
+
+def report(backend: str, title: str, rec: Recorder, latency: float, lines: List[str]) -> List[str]:
+    failures = []
+    lines.append(f'\n=== {title} ===')
+    lines.append(f"{'operation':<22}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'req':>6}{'bytes':>10}{'max sent':>10}")
+    for op, samples in rec.samples.items():
+        times = [s[0] for s in samples]
+        reqs = max(s[1] for s in samples)
+        nbytes = sum(s[2] for s in samples) // len(samples)
+        sent = max(s[3] for s in samples)
+        p50, p95 = percentile(times, 0.5), percentile(times, 0.95)
+        lines.append(f'{op:<22}{len(samples):>5}{p50 * 1000:>10.1f}{p95 * 1000:>10.1f}'
+                     f'{reqs:>6}{nbytes if rec.client else "-":>10}{sent if rec.client else "-":>10}')
+
+        max_reqs = REQUEST_BUDGETS[backend].get(op)
+        if max_reqs is not None and reqs > max_reqs:
+            failures.append(f'{backend}/{op}: {reqs} requests > budget {max_reqs}')
+        max_sent = SENT_BUDGETS.get(backend, {}).get(op)
+        if max_sent is not None and sent > max_sent:
+            failures.append(f'{backend}/{op}: {sent} bytes sent > budget {max_sent}')
+        budget = LATENCY_BUDGETS[backend].get(op)
+        if budget is None:
+            continue
+        if backend.startswith('fake'):
+            # One extra round trip of slack for local work and scheduling.
+            limit = (budget + 1) * latency
+        else:
+            limit = budget / 1000
+        if p95 > limit:
+            failures.append(f'{backend}/{op}: p95 {p95 * 1000:.1f} ms > budget {limit * 1000:.1f} ms')
+    return failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=['fake', 'fake-rest', 'sqlite', 'all'], default='all')
+    parser.add_argument('--iterations', type=int, default=5, help='patients per NEM size')
+    parser.add_argument('--latency', type=float, default=0.02, help='fake round-trip seconds')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args(argv)
+
+    lines, failures = [], []
+    if args.backend in ('fake', 'all'):
+        client = FakeSupabase(latency=args.latency)
+        client.seed('supplements', make_supplements())
+        db = SupabaseDB(client=client)
+        rec = run_backend('fake', db, client, args.iterations, args.seed)
+        failures += report('fake', f'fake, RPC save (latency {args.latency * 1000:.0f} ms)',
+                           rec, args.latency, lines)
+
+    if args.backend in ('fake-rest', 'all'):
+        # Database without the save_patient_document function: per-table save
+        client = FakeSupabase(latency=args.latency, functions=False)
+        client.seed('supplements', make_supplements())
+        db = SupabaseDB(client=client, atomic_save=False)
+        rec = run_backend('fake-rest', db, client, args.iterations, args.seed)
+        failures += report('fake-rest', f'fake, per-table save (latency {args.latency * 1000:.0f} ms)',
+                           rec, args.latency, lines)
+
+    if args.backend in ('sqlite', 'all'):
+        tmp = tempfile.mkdtemp(prefix='bench_db_')
+        try:
+            db = SQLiteDB(os.path.join(tmp, 'bench.db'), supplements_csv=None)
+            db._conn().executemany("INSERT INTO supplements (id, name, category) VALUES (?, ?, ?)",
+                                   [(r['id'], r['name'], r['category']) for r in make_supplements()])
+            rec = run_backend('sqlite', db, None, args.iterations, args.seed)
+            failures += report('sqlite', 'sqlite', rec, 0.0, lines)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    if failures:
+        lines.append('\n❌ Budget regressions:')
+        lines += [f'  - {f}' for f in failures]
+    else:
+        lines.append('\n✅ All operations within budget')
+
+    text = '\n'.join(lines)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
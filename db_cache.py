@@ -0,0 +1,141 @@
+import bisect
+import heapq
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+
+class SupplementCatalog:
+    """In-process index over the supplements table.
+
+    Built once from fetch_supplements() and shared by every session of the
+    server process. Holds the raw DataFrame plus dict lookups by id and by
+    name and the category grouping used by the NEM tab.
+    """
+
+    def __init__(self, df: pd.DataFrame, version: Any = None):
+        self.df = df
+        self.version = version
+        self.by_id: Dict[str, Dict] = {}
+        self.by_name: Dict[str, Dict] = {}
+        # category name -> supplement rows, in table order (CAT rows excluded)
+        self.categories: "OrderedDict[str, List[Dict]]" = OrderedDict()
+
+        current_category = None
+        for row in (df.to_dict('records') if not df.empty else []):
+            row_id = str(row.get('id', ''))
+            if row_id.startswith('CAT'):
+                current_category = str(row.get('name', '')).replace('CATEGORY: ', '')
+                self.categories[current_category] = []
+                continue
+            self.by_id[row_id] = row
+            self.by_name[row.get('name', '')] = row
+            if current_category is not None:
+                self.categories[current_category].append(row)
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    @property
+    def empty(self) -> bool:
+        return not self.by_id
+
+    def id_for(self, name: str) -> Optional[str]:
+        row = self.by_name.get(name)
+        return row['id'] if row else None
+
+
+def name_tokens(text: str) -> List[str]:
+    """Lower-cased words of a name or query ("Müller-Lüdenscheidt, Anna" ->
+    ["müller", "lüdenscheidt", "anna"])."""
+    return re.findall(r"\w+", str(text).lower())
+
+
+class PatientDirectory:
+    """Process-wide patient name directory.
+
+    Loaded once from the patients table, then kept current in place by
+    save_patient_data / delete_patient_data instead of being re-fetched.
+    Gives O(1) membership checks and the name -> patient_id map used by the
+    save, load and delete paths, plus a sorted (token, name) index for the
+    prefix search behind the name suggestions.
+    """
+
+    def __init__(self, rows: Iterable[Dict]):
+        self._lock = threading.Lock()
+        self.ids: Dict[str, Any] = {r['patient_name']: r['id'] for r in rows if r.get('patient_name')}
+        self._names: List[str] = sorted(self.ids)
+        self._tokens: List[Tuple[str, str]] = sorted(
+            {(t, n) for n in self.ids for t in name_tokens(n)})
+
+    def __contains__(self, name) -> bool:
+        return name in self.ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def names(self) -> List[str]:
+        """Sorted patient names. The list is shared — do not mutate it."""
+        return self._names
+
+    def id_for(self, name: str) -> Optional[Any]:
+        return self.ids.get(name)
+
+    def search(self, query: str, limit: int = 9) -> List[str]:
+        """Names with a word starting with any word of ``query``.
+
+        Ranked by the number of query words matched, then by exact word
+        matches, then alphabetically. Each query word is a bisect into the
+        token index, so the cost follows the number of matches, not the
+        number of patients.
+        """
+        words = set(name_tokens(query))
+        if not words or limit <= 0:
+            return []
+        tokens = self._tokens
+        matched: Dict[str, int] = {}
+        exact: Dict[str, int] = {}
+        for word in words:
+            hits = set()
+            i = bisect.bisect_left(tokens, (word, ''))
+            while i < len(tokens) and tokens[i][0].startswith(word):
+                token, name = tokens[i]
+                if name not in hits:
+                    hits.add(name)
+                    matched[name] = matched.get(name, 0) + 1
+                if token == word:
+                    exact[name] = exact.get(name, 0) + 1
+                i += 1
+        return heapq.nsmallest(limit, matched,
+                               key=lambda n: (-matched[n], -exact.get(n, 0), n.lower(), n))
+
+    def add(self, name: str, patient_id: Any):
+        with self._lock:
+            if name not in self.ids:
+                names = list(self._names)
+                bisect.insort(names, name)
+                self._names = names
+                tokens = list(self._tokens)
+                for t in set(name_tokens(name)):
+                    bisect.insort(tokens, (t, name))
+                self._tokens = tokens
+            self.ids[name] = patient_id
+
+    def remove(self, name: str):
+        with self._lock:
+            if self.ids.pop(name, None) is None:
+                return
+            names = list(self._names)
+            i = bisect.bisect_left(names, name)
+            if i < len(names) and names[i] == name:
+                del names[i]
+            self._names = names
+            tokens = list(self._tokens)
+            for t in set(name_tokens(name)):
+                i = bisect.bisect_left(tokens, (t, name))
+                if i < len(tokens) and tokens[i] == (t, name):
+                    del tokens[i]
+            self._tokens = tokens
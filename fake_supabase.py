@@ -0,0 +1,501 @@
+"""In-process stand-in for the Supabase client used by SupabaseDB.
+
+Supports the subset of the PostgREST query builder the data layer uses:
+
+    client.table(name).select(cols, count='exact').eq/neq/in_/ilike/gt/gte/lt/lte
+          .order(col, desc=...).limit(n).range(a, b).execute()
+    client.table(name).insert(rows) / update(values) / upsert(rows, on_conflict=...)
+    client.table(name).delete().eq(...)
+    client.rpc(name, params).execute()
+
+including embedded selects such as '*, patient_prescriptions(*, supplements(name))'.
+Every execute() counts as one request, sleeps for the configured latency and
+adds the JSON size of request and response to the byte counters, so save/load
+round trips can be measured without a network.
+
+    client = FakeSupabase(latency=0.02)
+    client.seed('supplements', rows)
+    db = SupabaseDB(client=client)
+"""
+import copy
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+class FakeAPIError(Exception):
+    """Raised where PostgREST would answer with an error."""
+
+    def __init__(self, message: str, code: str = ''):
+        self.code = code
+        super().__init__(f"{code}: {message}" if code else message)
+
+
+# table -> primary key, auto-increment id, unique columns, known columns
+SCHEMA: Dict[str, Dict[str, Any]] = {
+    'supplements': {
+        'auto': False, 'unique': (),
+        'columns': ('id', 'name', 'category'),
+    },
+    'patients': {
+        'auto': True, 'unique': ('patient_name',),
+        'columns': ('id', 'patient_name', 'geburtsdatum', 'geschlecht', 'groesse', 'gewicht',
+                    'therapiebeginn', 'dauer', 'tw_besprochen', 'allergie', 'diagnosen',
+                    'kontrolltermin_4', 'kontrolltermin_12', 'kontrolltermin_24',
+                    'kontrolltermin_kommentar', 'kt4_date', 'kt12_date', 'kt24_date',
+                    'created_at', 'revision'),
+    },
+    'patient_prescriptions': {
+        'auto': True, 'unique': (),
+        'columns': ('id', 'patient_id', 'supplement_id', 'dauer', 'darreichungsform', 'dosierung',
+                    'nuechtern', 'morgens', 'mittags', 'abends', 'nachts', 'kommentar'),
+    },
+    'patient_therapieplan': {'auto': True, 'unique': ('patient_id',), 'columns': ('id', 'patient_id', 'data')},
+    'patient_ernaehrung':   {'auto': True, 'unique': ('patient_id',), 'columns': ('id', 'patient_id', 'data')},
+    'patient_infusion':     {'auto': True, 'unique': ('patient_id',), 'columns': ('id', 'patient_id', 'data')},
+}
+
+# (table, column) -> referenced table (always by its id)
+FOREIGN_KEYS: Dict[tuple, str] = {
+    ('patient_prescriptions', 'supplement_id'): 'supplements',
+    ('patient_prescriptions', 'patient_id'):    'patients',
+    ('patient_therapieplan', 'patient_id'):     'patients',
+    ('patient_ernaehrung', 'patient_id'):       'patients',
+    ('patient_infusion', 'patient_id'):         'patients',
+}
+
+
+class FakeResponse:
+    def __init__(self, data: Any, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+def _split_columns(spec: str) -> List[str]:
+    """Split a select spec on top-level commas ('a, b(c, d)' -> ['a', 'b(c, d)'])."""
+    parts, depth, current = [], 0, ''
+    for ch in spec:
+        if ch == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+            continue
+        depth += (ch == '(') - (ch == ')')
+        current += ch
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def _ilike(pattern: str) -> re.Pattern:
+    """ILIKE pattern as a regex; backslash escapes the next character."""
+    regex, escaped = '', False
+    for c in pattern:
+        if escaped:
+            regex, escaped = regex + re.escape(c), False
+        elif c == '\\':
+            escaped = True
+        else:
+            regex += '.*' if c == '%' else '.' if c == '_' else re.escape(c)
+    return re.compile(f'^{regex}$', re.IGNORECASE | re.DOTALL)
+
+
+class FakeQuery:
+    """One request being built; mirrors the postgrest request builder."""
+
+    def __init__(self, client: 'FakeSupabase', table: str):
+        if table not in client.tables:
+            raise FakeAPIError(f'relation "public.{table}" does not exist', '42P01')
+        self.client = client
+        self.table = table
+        self.action = 'select'
+        self.columns = '*'
+        self.count_mode = None
+        self.payload: Any = None
+        self.on_conflict: Optional[str] = None
+        self.filters: List[Callable[[Dict], bool]] = []
+        self.orders: List[tuple] = []
+        self.limit_n: Optional[int] = None
+        self.offset = 0
+
+    # ── actions ─────────────────────────────────────────────
+    def select(self, columns: str = '*', count: Optional[str] = None):
+        self.action, self.columns, self.count_mode = 'select', columns, count
+        return self
+
+    def insert(self, rows):
+        self.action, self.payload = 'insert', rows
+        return self
+
+    def update(self, values: Dict):
+        self.action, self.payload = 'update', values
+        return self
+
+    def upsert(self, rows, on_conflict: str = ''):
+        self.action, self.payload, self.on_conflict = 'upsert', rows, on_conflict or 'id'
+        return self
+
+    def delete(self):
+        self.action = 'delete'
+        return self
+
+    # ── filters / modifiers ─────────────────────────────────
+    def _filter(self, column: str, test: Callable[[Any], bool]):
+        self.client._check_columns(self.table, [column])
+        self.filters.append(lambda row: test(row.get(column)))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, lambda v: v == value)
+
+    def neq(self, column, value):
+        return self._filter(column, lambda v: v != value)
+
+    def in_(self, column, values):
+        values = list(values)
+        return self._filter(column, lambda v: v in values)
+
+    def gt(self, column, value):
+        return self._filter(column, lambda v: v is not None and v > value)
+
+    def gte(self, column, value):
+        return self._filter(column, lambda v: v is not None and v >= value)
+
+    def lt(self, column, value):
+        return self._filter(column, lambda v: v is not None and v < value)
+
+    def lte(self, column, value):
+        return self._filter(column, lambda v: v is not None and v <= value)
+
+    def ilike(self, column, pattern):
+        rx = _ilike(pattern)
+        return self._filter(column, lambda v: v is not None and bool(rx.match(str(v))))
+
+    def order(self, column, desc: bool = False):
+        self.client._check_columns(self.table, [column])
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, n: int):
+        self.limit_n = n
+        return self
+
+    def range(self, start: int, end: int):
+        self.offset, self.limit_n = start, end - start + 1
+        return self
+
+    def execute(self) -> FakeResponse:
+        return self.client._execute(self)
+
+
+class FakeRPC:
+    def __init__(self, client: 'FakeSupabase', name: str, params: Dict):
+        self.client, self.name, self.params = client, name, params
+
+    def execute(self) -> FakeResponse:
+        return self.client._execute_rpc(self)
+
+
+class FakeSupabase:
+    """In-memory tables behind a Supabase-like client.
+
+    latency: seconds slept per request (plus up to `jitter` random seconds),
+    outside the data lock so concurrent requests overlap like real ones.
+    max_rows: server-side row cap applied to selects (PostgREST db-max-rows).
+    functions: register the database functions from migrations/ (see below).
+    revisions: emulate patients.revision and its triggers
+    (migrations/002_patient_revision.sql); without it the column is missing.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, max_rows: int = 1000,
+                 functions: bool = True, revisions: bool = True):
+        self.latency = latency
+        self.jitter = jitter
+        self.max_rows = max_rows
+        self.revisions = revisions
+        self.tables: Dict[str, List[Dict]] = {name: [] for name in SCHEMA}
+        self.functions: Dict[str, Callable[['FakeSupabase', Dict], Any]] = {}
+        self._next_id: Dict[str, int] = {name: 1 for name in SCHEMA}
+        self._lock = threading.RLock()
+        self.reset_stats()
+        if functions:
+            self.register_rpc('save_patient_document', save_patient_document)
+
+    # ── setup / stats ───────────────────────────────────────
+    def seed(self, table: str, rows: List[Dict]):
+        """Insert rows directly, without counting a request."""
+        with self._lock:
+            self._insert(table, copy.deepcopy(rows))
+
+    def register_rpc(self, name: str, fn: Callable[['FakeSupabase', Dict], Any]):
+        """Make fn(client, params) callable as client.rpc(name, params)."""
+        self.functions[name] = fn
+
+    def reset_stats(self):
+        self.request_count = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.requests_by_table: Dict[str, int] = {}
+
+    # ── client API ──────────────────────────────────────────
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def from_(self, name: str) -> FakeQuery:
+        return self.table(name)
+
+    def rpc(self, name: str, params: Optional[Dict] = None) -> FakeRPC:
+        return FakeRPC(self, name, params or {})
+
+    # ── request handling ────────────────────────────────────
+    def _round_trip(self, target: str, payload: Any):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            self.request_count += 1
+            self.requests_by_table[target] = self.requests_by_table.get(target, 0) + 1
+            if payload is not None:
+                self.bytes_sent += len(json.dumps(payload, default=str))
+
+    def _account_response(self, data: Any):
+        with self._lock:
+            self.bytes_received += len(json.dumps(data, default=str))
+
+    def _execute(self, q: FakeQuery) -> FakeResponse:
+        self._round_trip(q.table, q.payload)
+        with self._lock:
+            if q.action == 'select':
+                rows = self._select(q)
+                total = len(rows)
+                rows = rows[q.offset:]
+                cap = self.max_rows if q.limit_n is None else min(q.limit_n, self.max_rows)
+                rows = rows[:cap]
+                data = [self._project(q.table, r, q.columns) for r in rows]
+                result = FakeResponse(data, total if q.count_mode else None)
+            elif q.action == 'insert':
+                rows = q.payload if isinstance(q.payload, list) else [q.payload]
+                self._check_columns(q.table, [c for r in rows for c in r])
+                result = FakeResponse(copy.deepcopy(self._insert(q.table, copy.deepcopy(rows))))
+            elif q.action == 'update':
+                self._check_columns(q.table, list(q.payload))
+                matched = self._matching(q)
+                for row in matched:
+                    self._check_unique(q.table, {**row, **q.payload}, ignore=row)
+                    self._update_row(q.table, row, copy.deepcopy(q.payload))
+                result = FakeResponse(copy.deepcopy(matched))
+            elif q.action == 'upsert':
+                rows = q.payload if isinstance(q.payload, list) else [q.payload]
+                self._check_columns(q.table, [c for r in rows for c in r])
+                result = FakeResponse(copy.deepcopy(self._upsert(q.table, copy.deepcopy(rows), q.on_conflict)))
+            elif q.action == 'delete':
+                if not q.filters:
+                    raise FakeAPIError('DELETE requires a WHERE clause', '21000')
+                matched = self._matching(q)
+                ids = {id(r) for r in matched}
+                self.tables[q.table] = [r for r in self.tables[q.table] if id(r) not in ids]
+                self._touch_patients(q.table, matched)
+                result = FakeResponse(copy.deepcopy(matched))
+            else:
+                raise FakeAPIError(f'unsupported action {q.action}')
+        self._account_response(result.data)
+        return result
+
+    def _execute_rpc(self, call: FakeRPC) -> FakeResponse:
+        self._round_trip(f'rpc/{call.name}', call.params)
+        fn = self.functions.get(call.name)
+        if fn is None:
+            raise FakeAPIError(f'function public.{call.name} does not exist', 'PGRST202')
+        with self._lock:
+            # Emulates a transaction: the tables are restored if fn raises.
+            # Rows are flat dicts, so copying each row is enough.
+            snapshot = {t: [dict(r) for r in rows] for t, rows in self.tables.items()}, dict(self._next_id)
+            try:
+                data = fn(self, call.params)
+            except Exception:
+                self.tables, self._next_id = snapshot
+                raise
+        self._account_response(data)
+        return FakeResponse(data)
+
+    # ── table operations (called with the lock held) ────────
+    def _columns(self, table: str):
+        columns = SCHEMA[table]['columns']
+        if table == 'patients' and not self.revisions:
+            columns = tuple(c for c in columns if c != 'revision')
+        return columns
+
+    def _check_columns(self, table: str, columns):
+        known = self._columns(table)
+        for c in columns:
+            if c not in known:
+                raise FakeAPIError(f'column {table}.{c} does not exist', '42703')
+
+    def _check_unique(self, table: str, row: Dict, ignore: Optional[Dict] = None):
+        for col in ('id',) + tuple(SCHEMA[table]['unique']):
+            if row.get(col) is None:
+                continue
+            for other in self.tables[table]:
+                if other is not ignore and other.get(col) == row[col]:
+                    raise FakeAPIError(f'duplicate key value violates unique constraint "{table}_{col}_key"', '23505')
+
+    def _insert(self, table: str, rows: List[Dict]) -> List[Dict]:
+        inserted = []
+        for row in rows:
+            row = {c: row.get(c) for c in self._columns(table) if c in row or c != 'created_at'}
+            if 'revision' in row and row['revision'] is None:
+                row['revision'] = 0
+            if SCHEMA[table]['auto'] and row.get('id') is None:
+                row['id'] = self._next_id[table]
+            if isinstance(row.get('id'), int):
+                self._next_id[table] = max(self._next_id[table], row['id'] + 1)
+            self._check_unique(table, row)
+            self.tables[table].append(row)
+            inserted.append(row)
+        if table != 'patients':  # a new patient starts at revision 0
+            self._touch_patients(table, inserted)
+        return inserted
+
+    def _upsert(self, table: str, rows: List[Dict], on_conflict: str) -> List[Dict]:
+        keys = [c.strip() for c in on_conflict.split(',')]
+        result = []
+        for row in rows:
+            existing = None
+            if all(row.get(k) is not None for k in keys):
+                existing = next((r for r in self.tables[table]
+                                 if all(r.get(k) == row[k] for k in keys)), None)
+            if existing is not None:
+                self._check_unique(table, {**existing, **row}, ignore=existing)
+                self._update_row(table, existing, row)
+                result.append(existing)
+            else:
+                result.extend(self._insert(table, [row]))
+        return result
+
+    def _update_row(self, table: str, row: Dict, values: Dict):
+        changed = any(row.get(k) != v for k, v in values.items())
+        row.update(values)
+        if changed and 'revision' not in values:
+            self._touch_patients(table, [row])
+
+    def _touch_patients(self, table: str, rows: List[Dict]):
+        """Emulates the bump_patient_revision triggers: a changed patients row
+        or a written child row increments patients.revision."""
+        if not self.revisions or not rows:
+            return
+        if table == 'patients':
+            ids = {r.get('id') for r in rows}
+        elif ('patient_id' in SCHEMA[table]['columns']
+              and FOREIGN_KEYS.get((table, 'patient_id')) == 'patients'):
+            ids = {r.get('patient_id') for r in rows}
+        else:
+            return
+        for p in self.tables['patients']:
+            if p.get('id') in ids:
+                p['revision'] = (p.get('revision') or 0) + 1
+
+    def _matching(self, q: FakeQuery) -> List[Dict]:
+        return [r for r in self.tables[q.table] if all(f(r) for f in q.filters)]
+
+    def _select(self, q: FakeQuery) -> List[Dict]:
+        rows = self._matching(q)
+        for column, desc in reversed(q.orders):
+            rows.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+        return rows
+
+    def _project(self, table: str, row: Dict, spec: str) -> Dict:
+        out: Dict[str, Any] = {}
+        for part in _split_columns(spec):
+            if part == '*':
+                out.update(copy.deepcopy(row))
+            elif '(' in part:
+                name, inner = part.split('(', 1)
+                name, inner = name.strip(), inner.rsplit(')', 1)[0]
+                out[name] = self._embed(table, row, name, inner)
+            else:
+                self._check_columns(table, [part])
+                out[part] = copy.deepcopy(row.get(part))
+        return out
+
+    def _embed(self, table: str, row: Dict, target: str, spec: str):
+        if target not in self.tables:
+            raise FakeAPIError(f'Could not find a relationship between {table} and {target}', 'PGRST200')
+        # many-to-one: this table references target
+        for (src, col), ref in FOREIGN_KEYS.items():
+            if src == table and ref == target:
+                parent = next((r for r in self.tables[target] if r.get('id') == row.get(col)), None)
+                return self._project(target, parent, spec) if parent is not None else None
+        # one-to-many (or one-to-one when the referencing column is unique)
+        for (src, col), ref in FOREIGN_KEYS.items():
+            if src == target and ref == table:
+                children = [self._project(target, r, spec)
+                            for r in self.tables[target] if r.get(col) == row.get('id')]
+                if col in SCHEMA[target]['unique']:
+                    return children[0] if children else None
+                return children
+        raise FakeAPIError(f'Could not find a relationship between {table} and {target}', 'PGRST200')
+
+
+# ──────────────────────────────────────────────────────────
+# DATABASE FUNCTIONS (emulating migrations/*.sql)
+# ──────────────────────────────────────────────────────────
+
+def save_patient_document(client: FakeSupabase, params: Dict) -> Dict:
+    """Emulates migrations/001_save_patient_document.sql.
+
+    Runs under the client lock inside _execute_rpc, which restores all tables
+    if this raises — the same all-or-nothing outcome as the SQL transaction.
+    """
+    doc = params.get('doc') or {}
+    patient = dict(doc.get('patient') or {})
+    if not patient.get('patient_name'):
+        raise FakeAPIError('save_patient_document: patient.patient_name is required', 'P0001')
+    patient.pop('id', None)
+    client._check_columns('patients', list(patient))
+
+    existing = next((r for r in client.tables['patients']
+                     if r.get('patient_name') == patient['patient_name']), None)
+    if 'expected_revision' in doc and (existing is None
+                                       or existing.get('revision') != doc['expected_revision']):
+        return {'patient_id': existing['id'] if existing else None, 'stale': True}
+    if existing is None:
+        existing = client._insert('patients', [patient])[0]
+    else:
+        client._update_row('patients', existing, patient)
+    pid = existing['id']
+
+    n_insert = n_update = n_delete = None
+    if 'prescriptions' in doc:
+        spec = doc.get('prescriptions') or {}
+        keep = {str(i) for i in spec.get('ids') or []}
+        removed = [r for r in client.tables['patient_prescriptions']
+                   if r.get('patient_id') == pid and str(r.get('supplement_id')) not in keep]
+        removed_ids = {id(r) for r in removed}
+        client.tables['patient_prescriptions'] = [
+            r for r in client.tables['patient_prescriptions'] if id(r) not in removed_ids]
+        client._touch_patients('patient_prescriptions', removed)
+        n_delete, n_insert, n_update = len(removed), 0, 0
+        for row in spec.get('rows') or []:
+            row = dict(row, patient_id=pid)
+            client._check_columns('patient_prescriptions', list(row))
+            if not any(s.get('id') == row.get('supplement_id') for s in client.tables['supplements']):
+                raise FakeAPIError('insert or update on table "patient_prescriptions" violates '
+                                   'foreign key constraint', '23503')
+            stored = next((r for r in client.tables['patient_prescriptions']
+                           if r.get('patient_id') == pid and r.get('supplement_id') == row['supplement_id']),
+                          None)
+            if stored is None:
+                client._insert('patient_prescriptions', [row])
+                n_insert += 1
+            elif any(stored.get(k) != v for k, v in row.items()):
+                client._update_row('patient_prescriptions', stored, row)
+                n_update += 1
+
+    for key in ('therapieplan', 'ernaehrung', 'infusion'):
+        if key in doc:
+            client._upsert(f'patient_{key}', [{'patient_id': pid, 'data': doc[key]}], 'patient_id')
+
+    return {'patient_id': pid, 'prescriptions_inserted': n_insert, 'prescriptions_updated': n_update,
+            'prescriptions_deleted': n_delete, 'revision': existing.get('revision')}
@@ -0,0 +1,182 @@
+-- Atomic patient save used by SupabaseDB.save_patient_data (atomic_save=True).
+--
+-- Run once in the Supabase SQL editor, after 002_patient_revision.sql. Until it
+-- exists the app falls back to the per-table save.
+--
+-- doc = {
+--   "patient":       { patients columns, patient_name required },
+--   "prescriptions": {
+--       "rows": [ { supplement_id, dauer, darreichungsform, dosierung,
+--                   nuechtern, morgens, mittags, abends, nachts, kommentar } ],
+--       "ids":  [ every supplement_id the patient keeps ] },
+--   "therapieplan":  "<serialized blob>",
+--   "ernaehrung":    "<serialized blob>",
+--   "infusion":      "<serialized blob>",
+--   "expected_revision": <patients.revision the client diffed against>
+-- }
+--
+-- Every key except "patient" is optional; a missing key leaves that part of the
+-- stored patient unchanged. "prescriptions.rows" holds only new or changed rows
+-- and is upserted on (patient_id, supplement_id); stored rows whose
+-- supplement_id is not in "prescriptions.ids" are deleted. The whole document
+-- is applied in the function's transaction: on any error nothing is written.
+-- With "expected_revision", nothing is written unless the stored revision still
+-- equals it; the answer is then { "patient_id", "stale": true } and the client
+-- resends the full document.
+--
+-- Returns { "patient_id": ..., "prescriptions_inserted", "prescriptions_updated",
+--           "prescriptions_deleted": <row counts, null without "prescriptions">,
+--           "revision": <after the save> }.
+
+-- One row per patient and supplement (older saves could leave duplicates)
+delete from public.patient_prescriptions a
+ using public.patient_prescriptions b
+ where a.patient_id = b.patient_id
+   and a.supplement_id = b.supplement_id
+   and a.id > b.id;
+
+create unique index if not exists patient_prescriptions_patient_supplement
+    on public.patient_prescriptions (patient_id, supplement_id);
+
+create or replace function public.save_patient_document(doc jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+    p         public.patients;
+    pid       public.patients.id%type;
+    rev       public.patients.revision%type;
+    n_insert  integer := null;
+    n_update  integer := null;
+    n_delete  integer := null;
+begin
+    if doc->'patient'->>'patient_name' is null or doc->'patient'->>'patient_name' = '' then
+        raise exception 'save_patient_document: patient.patient_name is required';
+    end if;
+
+    -- jsonb_populate_record casts every field to its column type
+    p := jsonb_populate_record(null::public.patients, doc->'patient');
+
+    -- ── 1. Patient row ──────────────────────────────────────
+    select id, revision into pid, rev
+      from public.patients
+     where patient_name = p.patient_name
+     for update;
+
+    if doc ? 'expected_revision'
+       and (pid is null or rev is distinct from (doc->>'expected_revision')::bigint) then
+        return jsonb_build_object('patient_id', pid, 'stale', true);
+    end if;
+
+    if pid is null then
+        insert into public.patients (
+            patient_name, geburtsdatum, geschlecht, groesse, gewicht, therapiebeginn,
+            dauer, tw_besprochen, allergie, diagnosen,
+            kontrolltermin_4, kontrolltermin_12, kontrolltermin_24, kontrolltermin_kommentar,
+            kt4_date, kt12_date, kt24_date)
+        values (
+            p.patient_name, p.geburtsdatum, p.geschlecht, p.groesse, p.gewicht, p.therapiebeginn,
+            p.dauer, p.tw_besprochen, p.allergie, p.diagnosen,
+            p.kontrolltermin_4, p.kontrolltermin_12, p.kontrolltermin_24, p.kontrolltermin_kommentar,
+            p.kt4_date, p.kt12_date, p.kt24_date)
+        returning id into pid;
+    else
+        update public.patients set
+            geburtsdatum             = p.geburtsdatum,
+            geschlecht               = p.geschlecht,
+            groesse                  = p.groesse,
+            gewicht                  = p.gewicht,
+            therapiebeginn           = p.therapiebeginn,
+            dauer                    = p.dauer,
+            tw_besprochen            = p.tw_besprochen,
+            allergie                 = p.allergie,
+            diagnosen                = p.diagnosen,
+            kontrolltermin_4         = p.kontrolltermin_4,
+            kontrolltermin_12        = p.kontrolltermin_12,
+            kontrolltermin_24        = p.kontrolltermin_24,
+            kontrolltermin_kommentar = p.kontrolltermin_kommentar,
+            kt4_date                 = p.kt4_date,
+            kt12_date                = p.kt12_date,
+            kt24_date                = p.kt24_date
+         where id = pid
+           and (geburtsdatum, geschlecht, groesse, gewicht, therapiebeginn, dauer, tw_besprochen,
+                allergie, diagnosen, kontrolltermin_4, kontrolltermin_12, kontrolltermin_24,
+                kontrolltermin_kommentar, kt4_date, kt12_date, kt24_date)
+               is distinct from
+               (p.geburtsdatum, p.geschlecht, p.groesse, p.gewicht, p.therapiebeginn, p.dauer,
+                p.tw_besprochen, p.allergie, p.diagnosen, p.kontrolltermin_4, p.kontrolltermin_12,
+                p.kontrolltermin_24, p.kontrolltermin_kommentar, p.kt4_date, p.kt12_date,
+                p.kt24_date);
+    end if;
+
+    -- ── 2. NEM prescriptions (changed rows only) ────────────
+    if doc ? 'prescriptions' then
+        delete from public.patient_prescriptions
+         where patient_id = pid
+           and supplement_id::text not in (
+               select jsonb_array_elements_text(coalesce(doc->'prescriptions'->'ids', '[]'::jsonb)));
+        get diagnostics n_delete = row_count;
+
+        -- xmax = 0 only for freshly inserted rows; unchanged rows are not touched
+        with written as (
+            insert into public.patient_prescriptions as t (
+                patient_id, supplement_id, dauer, darreichungsform, dosierung,
+                nuechtern, morgens, mittags, abends, nachts, kommentar)
+            select pid, r.supplement_id, r.dauer, r.darreichungsform, r.dosierung,
+                   r.nuechtern, r.morgens, r.mittags, r.abends, r.nachts, r.kommentar
+              from jsonb_populate_recordset(null::public.patient_prescriptions,
+                                            coalesce(doc->'prescriptions'->'rows', '[]'::jsonb)) r
+            on conflict (patient_id, supplement_id) do update set
+                dauer            = excluded.dauer,
+                darreichungsform = excluded.darreichungsform,
+                dosierung        = excluded.dosierung,
+                nuechtern        = excluded.nuechtern,
+                morgens          = excluded.morgens,
+                mittags          = excluded.mittags,
+                abends           = excluded.abends,
+                nachts           = excluded.nachts,
+                kommentar        = excluded.kommentar
+             where (t.dauer, t.darreichungsform, t.dosierung, t.nuechtern, t.morgens,
+                    t.mittags, t.abends, t.nachts, t.kommentar)
+                   is distinct from
+                   (excluded.dauer, excluded.darreichungsform, excluded.dosierung,
+                    excluded.nuechtern, excluded.morgens, excluded.mittags, excluded.abends,
+                    excluded.nachts, excluded.kommentar)
+            returning (t.xmax = 0) as inserted
+        )
+        select count(*) filter (where inserted), count(*) filter (where not inserted)
+          into n_insert, n_update
+          from written;
+    end if;
+
+    -- ── 3. JSON blobs ───────────────────────────────────────
+    if doc ? 'therapieplan' then
+        insert into public.patient_therapieplan (patient_id, data)
+        values (pid, doc->>'therapieplan')
+        on conflict (patient_id) do update set data = excluded.data;
+    end if;
+
+    if doc ? 'ernaehrung' then
+        insert into public.patient_ernaehrung (patient_id, data)
+        values (pid, doc->>'ernaehrung')
+        on conflict (patient_id) do update set data = excluded.data;
+    end if;
+
+    if doc ? 'infusion' then
+        insert into public.patient_infusion (patient_id, data)
+        values (pid, doc->>'infusion')
+        on conflict (patient_id) do update set data = excluded.data;
+    end if;
+
+    select revision into rev from public.patients where id = pid;
+
+    return jsonb_build_object(
+        'patient_id',             pid,
+        'prescriptions_inserted', n_insert,
+        'prescriptions_updated',  n_update,
+        'prescriptions_deleted',  n_delete,
+        'revision',               rev);
+end;
+$$;
+
+grant execute on function public.save_patient_document(jsonb) to anon, authenticated, service_role;
@@ -0,0 +1,59 @@
+-- Per-patient revision counter used by SupabaseDB to skip unchanged sections.
+--
+-- Run once in the Supabase SQL editor, before 001. Every change to a
+-- patients row or to one of its child rows increments patients.revision, no
+-- matter who writes it: this app, another app server, or a manual edit. A save
+-- only skips a section the session did not change while the revision it loaded
+-- is still current. Without this migration every save writes all sections.
+
+alter table public.patients add column if not exists revision bigint not null default 0;
+
+create or replace function public.bump_patient_revision()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_table_name = 'patients' then
+        -- BEFORE UPDATE: count real changes; leave explicit revision writes alone
+        if new.revision = old.revision and new is distinct from old then
+            new.revision := old.revision + 1;
+        end if;
+        return new;
+    end if;
+
+    if tg_op = 'DELETE' then
+        update public.patients set revision = revision + 1 where id = old.patient_id;
+    else
+        update public.patients set revision = revision + 1 where id = new.patient_id;
+        if tg_op = 'UPDATE' and old.patient_id is distinct from new.patient_id then
+            update public.patients set revision = revision + 1 where id = old.patient_id;
+        end if;
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists patients_revision on public.patients;
+create trigger patients_revision
+    before update on public.patients
+    for each row execute function public.bump_patient_revision();
+
+drop trigger if exists patient_prescriptions_revision on public.patient_prescriptions;
+create trigger patient_prescriptions_revision
+    after insert or update or delete on public.patient_prescriptions
+    for each row execute function public.bump_patient_revision();
+
+drop trigger if exists patient_therapieplan_revision on public.patient_therapieplan;
+create trigger patient_therapieplan_revision
+    after insert or update or delete on public.patient_therapieplan
+    for each row execute function public.bump_patient_revision();
+
+drop trigger if exists patient_ernaehrung_revision on public.patient_ernaehrung;
+create trigger patient_ernaehrung_revision
+    after insert or update or delete on public.patient_ernaehrung
+    for each row execute function public.bump_patient_revision();
+
+drop trigger if exists patient_infusion_revision on public.patient_infusion;
+create trigger patient_infusion_revision
+    after insert or update or delete on public.patient_infusion
+    for each row execute function public.bump_patient_revision();
@@ -0,0 +1,417 @@
+import csv
+import os
+import sqlite3
+import threading
+from typing import Optional, Dict, List, Any, Tuple
+import pandas as pd
+
+from supabase_db import SupabaseDB, _op_requests
+
+DB_PATH = "app.db"
+SUPPLEMENTS_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "supplements.csv")
+
+# Full schema of the app tables. Matches db_init.py plus the columns added
+# later on the Supabase side (Kontrolltermine).
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS supplements (
+        id TEXT PRIMARY KEY,
+        name TEXT,
+        category INTEGER
+    );
+
+    CREATE TABLE IF NOT EXISTS patients (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_name TEXT UNIQUE,
+        geburtsdatum DATE,
+        geschlecht TEXT,
+        groesse INTEGER,
+        gewicht REAL,
+        therapiebeginn DATE,
+        dauer INTEGER,
+        tw_besprochen TEXT,
+        allergie TEXT,
+        diagnosen TEXT,
+        kontrolltermin_4 BOOLEAN DEFAULT 0,
+        kontrolltermin_12 BOOLEAN DEFAULT 0,
+        kontrolltermin_24 BOOLEAN DEFAULT 0,
+        kontrolltermin_kommentar TEXT DEFAULT '',
+        kt4_date DATE,
+        kt12_date DATE,
+        kt24_date DATE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS patient_prescriptions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER,
+        supplement_id TEXT,
+        dauer INTEGER,
+        darreichungsform TEXT,
+        dosierung TEXT,
+        nuechtern TEXT DEFAULT '',
+        morgens TEXT DEFAULT '',
+        mittags TEXT DEFAULT '',
+        abends TEXT DEFAULT '',
+        nachts TEXT DEFAULT '',
+        kommentar TEXT DEFAULT '',
+        FOREIGN KEY (patient_id) REFERENCES patients (id) ON DELETE CASCADE,
+        FOREIGN KEY (supplement_id) REFERENCES supplements (id)
+    );
+
+    CREATE TABLE IF NOT EXISTS patient_therapieplan (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER UNIQUE,
+        data TEXT,
+        FOREIGN KEY (patient_id) REFERENCES patients (id) ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS patient_ernaehrung (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER UNIQUE,
+        data TEXT,
+        FOREIGN KEY (patient_id) REFERENCES patients (id) ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS patient_infusion (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER UNIQUE,
+        data TEXT,
+        FOREIGN KEY (patient_id) REFERENCES patients (id) ON DELETE CASCADE
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_supplements_category ON supplements (category, id);
+    CREATE INDEX IF NOT EXISTS idx_supplements_name ON supplements (name);
+    CREATE INDEX IF NOT EXISTS idx_prescriptions_patient ON patient_prescriptions (patient_id);
+"""
+
+# Columns missing from databases created by older versions of db_init.py
+PATIENT_EXTRA_COLUMNS = {
+    'kontrolltermin_4':         "BOOLEAN DEFAULT 0",
+    'kontrolltermin_12':        "BOOLEAN DEFAULT 0",
+    'kontrolltermin_24':        "BOOLEAN DEFAULT 0",
+    'kontrolltermin_kommentar': "TEXT DEFAULT ''",
+    'kt4_date':                 "DATE",
+    'kt12_date':                "DATE",
+    'kt24_date':                "DATE",
+}
+
+BLOB_TABLES = ('patient_therapieplan', 'patient_ernaehrung', 'patient_infusion')
+
+
+class SQLiteDB(SupabaseDB):
+    """Local SQLite backend with the same public interface as SupabaseDB.
+
+    Uses the schema of db_init.py (created if missing, with the supplements
+    from supplements.csv), WAL journaling and one connection per thread. A
+    save is a single transaction. Catalog, patient directory and blob
+    encoding are shared with SupabaseDB.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, supplements_csv: Optional[str] = SUPPLEMENTS_CSV):
+        """supplements_csv: catalog loaded into a database without supplements
+        (None to start with an empty catalog)."""
+        try:
+            self.db_path = db_path
+            self.supplements_csv = supplements_csv
+            self._local = threading.local()
+            self._init_common(None, embedded_load=False, concurrent=False, atomic_save=False)
+            self._ensure_schema()
+            print(f"✅ Connected to SQLite ({db_path})")
+
+        except Exception as e:
+            print(f"❌ Failed to open SQLite database: {e}")
+            raise
+
+    # ──────────────────────────────────────────────────────────
+    # HELPERS
+    # ──────────────────────────────────────────────────────────
+
+    def _conn(self) -> sqlite3.Connection:
+        """Connection of the current thread (Streamlit runs sessions on threads)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _sql(self, sql: str, params=()) -> List[Dict]:
+        """Run one statement, count it like a request and return the rows."""
+        with self._count_lock:
+            self.request_count += 1
+            op = _op_requests.get()
+            if op is not None:
+                op[0] += 1
+        return [dict(r) for r in self._conn().execute(sql, params).fetchall()]
+
+    def _sql_many(self, sql: str, rows: List[Tuple]):
+        with self._count_lock:
+            self.request_count += 1
+            op = _op_requests.get()
+            if op is not None:
+                op[0] += 1
+        self._conn().executemany(sql, rows)
+
+    def _ensure_schema(self):
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        existing = {r['name'] for r in conn.execute("PRAGMA table_info(patients)")}
+        for column, decl in PATIENT_EXTRA_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE patients ADD COLUMN {column} {decl}")
+        if conn.execute("SELECT 1 FROM supplements LIMIT 1").fetchone() is None:
+            self._seed_supplements(conn)
+
+    def _seed_supplements(self, conn: sqlite3.Connection):
+        """Fill an empty supplements table from supplements.csv (id,name,category).
+        Names are not quoted there and may contain commas."""
+        if not self.supplements_csv or not os.path.exists(self.supplements_csv):
+            return
+        with open(self.supplements_csv, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)  # header
+            rows = [(r[0], ','.join(r[1:-1]), int(r[-1])) for r in reader if len(r) >= 3]
+        conn.executemany("INSERT INTO supplements (id, name, category) VALUES (?, ?, ?)", rows)
+        print(f"✅ Loaded {len(rows)} supplements from {self.supplements_csv}")
+
+    # ──────────────────────────────────────────────────────────
+    # SUPPLEMENTS
+    # ──────────────────────────────────────────────────────────
+
+    def fetch_supplements(self) -> pd.DataFrame:
+        try:
+            return pd.DataFrame(self._sql("SELECT * FROM supplements ORDER BY category, id"))
+        except Exception as e:
+            print(f"Error fetching supplements: {e}")
+            return pd.DataFrame()
+
+    def _catalog_version(self):
+        try:
+            row = self._sql("SELECT COUNT(*) AS n, MAX(id) AS max_id FROM supplements")[0]
+            return (row['n'], row['max_id'])
+        except Exception as e:
+            print(f"Error checking supplement catalog version: {e}")
+            return None
+
+    # ──────────────────────────────────────────────────────────
+    # PATIENT NAMES
+    # ──────────────────────────────────────────────────────────
+
+    def fetch_patient_names(self) -> pd.DataFrame:
+        try:
+            return pd.DataFrame(self._sql("SELECT patient_name FROM patients ORDER BY patient_name"))
+        except Exception as e:
+            print(f"Error fetching patient names: {e}")
+            return pd.DataFrame()
+
+    def _fetch_directory_rows(self) -> List[Dict]:
+        return self._sql("SELECT id, patient_name FROM patients ORDER BY patient_name")
+
+    def search_patients(self, prefix: str = '', after: Optional[str] = None,
+                        limit: int = 50) -> Tuple[List[str], bool]:
+        try:
+            pattern = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            rows = self._sql(
+                "SELECT patient_name FROM patients WHERE patient_name LIKE ? ESCAPE '\\' "
+                "AND patient_name > ? ORDER BY patient_name LIMIT ?",
+                (pattern, after if after is not None else '', limit + 1))
+            names = [r['patient_name'] for r in rows]
+            return names[:limit], len(names) > limit
+        except Exception as e:
+            print(f"Error searching patients: {e}")
+            return [], False
+
+    def _patient_id(self, patient_name: str):
+        patient_id = self.get_patient_directory().id_for(patient_name)
+        if patient_id is not None:
+            return patient_id
+        rows = self._sql("SELECT id FROM patients WHERE patient_name = ?", (patient_name,))
+        if not rows:
+            return None
+        patient_id = rows[0]['id']
+        self.get_patient_directory().add(patient_name, patient_id)
+        return patient_id
+
+    # ──────────────────────────────────────────────────────────
+    # SAVE
+    # ──────────────────────────────────────────────────────────
+
+    def save_patient_data(
+        self,
+        patient_data: Dict,
+        nem_prescriptions: List[Dict],
+        therapieplan_data: Dict,
+        ernaehrung_data: Dict,
+        infusion_data: Dict,
+        sections: Optional[Dict] = None,
+    ) -> bool:
+        """Save the whole patient in one transaction. Every section is written,
+        so ``sections`` is only cleared (kept for the SupabaseDB interface)."""
+        if sections is not None:
+            sections.clear()
+        op_requests = [0]
+        op_token = _op_requests.set(op_requests)
+        conn = self._conn()
+        try:
+            patient_record = self._patient_record(patient_data)
+            columns = list(patient_record)
+            blobs = {
+                'patient_therapieplan': therapieplan_data or {},
+                'patient_ernaehrung':   ernaehrung_data or {},
+                'patient_infusion':     infusion_data or {},
+            }
+            supplement_ids = self._supplement_ids([p.get('name', '') for p in nem_prescriptions or []])
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # ── 1. Upsert patient record ──────────────────────
+                self._sql(
+                    f"INSERT INTO patients ({', '.join(columns)}) "
+                    f"VALUES ({', '.join('?' for _ in columns)}) "
+                    f"ON CONFLICT(patient_name) DO UPDATE SET "
+                    f"{', '.join(f'{c} = excluded.{c}' for c in columns if c != 'patient_name')}",
+                    [patient_record[c] for c in columns])
+                patient_id = self._sql("SELECT id FROM patients WHERE patient_name = ?",
+                                       (patient_record['patient_name'],))[0]['id']
+
+                # ── 2. NEM prescriptions ──────────────────────────
+                self._sql("DELETE FROM patient_prescriptions WHERE patient_id = ?", (patient_id,))
+                rows = []
+                for prescription in nem_prescriptions or []:
+                    supplement_id = supplement_ids.get(prescription.get('name', ''))
+                    if supplement_id is None:
+                        print(f"⚠️  Supplement not found in DB: {prescription.get('name', '')}")
+                        continue
+                    row = self._prescription_row(patient_id, supplement_id, prescription)
+                    rows.append(tuple(row[c] for c in ('patient_id', 'supplement_id') + self.PRESCRIPTION_FIELDS))
+                if rows:
+                    fields = ('patient_id', 'supplement_id') + self.PRESCRIPTION_FIELDS
+                    self._sql_many(
+                        f"INSERT INTO patient_prescriptions ({', '.join(fields)}) "
+                        f"VALUES ({', '.join('?' for _ in fields)})", rows)
+
+                # ── 3. JSON blobs ─────────────────────────────────
+                for table, data in blobs.items():
+                    self._sql(f"INSERT INTO {table} (patient_id, data) VALUES (?, ?) "
+                              f"ON CONFLICT(patient_id) DO UPDATE SET data = excluded.data",
+                              (patient_id, self._serialize(data)))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            self.get_patient_directory().add(patient_record['patient_name'], patient_id)
+            self.last_save_requests = op_requests[0]
+            self.last_save_summary = {
+                'patient_id':    patient_id,
+                'requests':      self.last_save_requests,
+                'prescriptions': {'inserted': len(rows)},
+                'skipped':       [],
+            }
+            print(f"✅ Saved patient '{patient_record['patient_name']}' (id={patient_id}, "
+                  f"{len(rows)} NEM, {self.last_save_requests} statements)")
+            return True
+
+        except Exception as e:
+            print(f"❌ save_patient_data error: {e}")
+            import traceback; traceback.print_exc()
+            return False
+        finally:
+            _op_requests.reset(op_token)
+
+    def _supplement_ids(self, names: List[str]) -> Dict[str, Any]:
+        catalog = self.get_catalog()
+        ids = {n: catalog.id_for(n) for n in set(names) if catalog.id_for(n) is not None}
+        missing = [n for n in set(names) if n not in ids]
+        if missing:
+            rows = self._sql(f"SELECT id, name FROM supplements WHERE name IN "
+                             f"({', '.join('?' for _ in missing)})", missing)
+            ids.update({row['name']: row['id'] for row in rows})
+        return ids
+
+    # ──────────────────────────────────────────────────────────
+    # LOAD
+    # ──────────────────────────────────────────────────────────
+
+    def load_patient_data(self, patient_name: str, sections: Optional[Dict] = None) -> Tuple:
+        """Returns (patient_data, nem_prescriptions, therapieplan, ernaehrung, infusion)
+        or (None, [], {}, {}, {}) on failure. The selects share one read
+        transaction, so a concurrent save is seen entirely or not at all."""
+        if sections is not None:
+            sections.clear()
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN")
+            try:
+                rows = self._sql("SELECT * FROM patients WHERE patient_name = ?", (patient_name,))
+                if not rows:
+                    self.get_patient_directory().remove(patient_name)
+                    return None, [], {}, {}, {}
+                p = rows[0]
+                patient_id = p['id']
+
+                nem_rows = self._sql(
+                    "SELECT pp.*, s.name AS supplement_name FROM patient_prescriptions pp "
+                    "JOIN supplements s ON s.id = pp.supplement_id "
+                    "WHERE pp.patient_id = ? ORDER BY pp.id", (patient_id,))
+
+                blobs = {}
+                for table in BLOB_TABLES:
+                    blob = self._sql(f"SELECT data FROM {table} WHERE patient_id = ?", (patient_id,))
+                    blobs[table] = self._deserialize(blob[0]['data']) if blob else {}
+            finally:
+                conn.execute("COMMIT")
+
+            self.get_patient_directory().add(patient_name, patient_id)
+            for row in nem_rows:
+                row['supplements'] = {'name': row.pop('supplement_name')}
+                # dauer has INTEGER affinity in db_init.py; the app expects text
+                row['dauer'] = self._to_str(row.get('dauer'))
+
+            print(f"✅ Loaded patient '{patient_name}'")
+            return (
+                self._patient_data_from_row(p),
+                self._nem_from_rows(nem_rows),
+                blobs['patient_therapieplan'],
+                blobs['patient_ernaehrung'],
+                blobs['patient_infusion'],
+            )
+
+        except Exception as e:
+            print(f"❌ load_patient_data error: {e}")
+            import traceback; traceback.print_exc()
+            return None, [], {}, {}, {}
+
+    # ──────────────────────────────────────────────────────────
+    # DELETE
+    # ──────────────────────────────────────────────────────────
+
+    def delete_patient_data(self, patient_name: str) -> bool:
+        conn = self._conn()
+        try:
+            patient_id = self._patient_id(patient_name)
+            if patient_id is None:
+                print(f"Patient '{patient_name}' not found")
+                return False
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for table in ('patient_prescriptions',) + BLOB_TABLES:
+                    self._sql(f"DELETE FROM {table} WHERE patient_id = ?", (patient_id,))
+                self._sql("DELETE FROM patients WHERE id = ?", (patient_id,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            self.get_patient_directory().remove(patient_name)
+            print(f"✅ Deleted patient '{patient_name}'")
+            return True
+
+        except Exception as e:
+            print(f"❌ delete_patient_data error: {e}")
+            import traceback; traceback.print_exc()
+            return False
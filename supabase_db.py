@@ -1,13 +1,67 @@
 import os
 import json
+import time
+import hashlib
+import base64
+import zlib
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
-from typing import Optional, Dict, List, Any, Tuple
+from typing import Optional, Dict, List, Any, Tuple, Callable
 import pandas as pd
 
+from db_cache import SupplementCatalog, PatientDirectory
+
+# Request counter of the data-layer operation running in the current context.
+# Copied into worker threads by _run_parallel, so concurrent calls add to it.
+_op_requests: contextvars.ContextVar = contextvars.ContextVar('_op_requests', default=None)
+
+
+class ParallelTaskError(Exception):
+    """One or more of the independent calls run by _run_parallel failed."""
+
+    def __init__(self, errors: Dict[str, Exception]):
+        self.errors = errors
+        super().__init__("; ".join(f"{name}: {err}" for name, err in errors.items()))
+
+
+class RPCMissingError(Exception):
+    """The save_patient_document database function is not installed."""
+
+
 class SupabaseDB:
-    def __init__(self, use_streamlit_secrets=True):
+    # Seconds between catalog version probes. Reruns inside this window
+    # are served from the in-process catalog without any request.
+    CATALOG_CHECK_SECONDS = 300
+
+    # Embedded select that returns a patient with all child tables at once.
+    PATIENT_EMBED = ('*, patient_prescriptions(*, supplements(name)), '
+                     'patient_therapieplan(data), patient_ernaehrung(data), patient_infusion(data)')
+
+    # Upper bound on concurrent requests issued by one save or load.
+    MAX_WORKERS = 4
+    # Marker of the sparse blob encoding; blobs without it are plain JSON dicts
+    SPARSE_FORMAT = 'sparse/1'
+    # Serialized blobs at least this long are stored zlib-compressed
+    COMPRESS_MIN_BYTES = 4096
+    # Rows per patients page. Must not exceed the server's db-max-rows, or
+    # pages come back short; the paged reads tolerate that but take more trips.
+    PATIENT_PAGE_SIZE = 1000
+
+    # patient_prescriptions value columns compared by the diff-based save.
+    PRESCRIPTION_FIELDS = ('dauer', 'darreichungsform', 'dosierung', 'nuechtern',
+                           'morgens', 'mittags', 'abends', 'nachts', 'kommentar')
+
+    def __init__(self, use_streamlit_secrets=True, embedded_load=True, concurrent=True, client=None,
+                 atomic_save=True):
+        """client: an already created Supabase client (e.g. fake_supabase.FakeSupabase);
+        when given, no credentials are read.
+        atomic_save: save through the save_patient_document RPC when it exists."""
         try:
-            if use_streamlit_secrets:
+            if client is not None:
+                url = key = None
+            elif use_streamlit_secrets:
                 try:
                     import streamlit as st
                     url = st.secrets["SUPABASE_URL"]
@@ -19,24 +73,93 @@ class SupabaseDB:
                 url = os.environ.get("SUPABASE_URL")
                 key = os.environ.get("SUPABASE_KEY")
 
-            if not url or not key:
+            if client is None and (not url or not key):
                 raise ValueError(
                     "Missing Supabase credentials. Set SUPABASE_URL and SUPABASE_KEY "
                     "in .streamlit/secrets.toml or as environment variables."
                 )
 
-            from supabase import create_client
-            self.supabase = create_client(url, key)
+            if client is None:
+                from supabase import create_client
+                client = create_client(url, key)
+            self._init_common(client, embedded_load=embedded_load, concurrent=concurrent,
+                              atomic_save=atomic_save)
             print("✅ Connected to Supabase")
 
         except Exception as e:
             print(f"❌ Failed to connect to Supabase: {e}")
             raise
 
+    def _init_common(self, client, embedded_load: bool, concurrent: bool, atomic_save: bool):
+        """State shared with SQLiteDB, which passes client=None."""
+        self.supabase = client
+        self.embedded_load = embedded_load
+        self.atomic_save = atomic_save
+        self._rpc_available = client is not None
+        self.concurrent = concurrent
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        self._count_lock = threading.Lock()
+        self.request_count = 0
+        self.last_save_requests = 0
+        self.last_save_summary: Dict[str, Any] = {}
+        # False once a select on patients.revision failed (migration 002 not run)
+        self._has_revision = client is not None
+        self._catalog: Optional[SupplementCatalog] = None
+        self._catalog_checked = 0.0
+        self._catalog_lock = threading.Lock()
+        self._catalog_has_updated_at = client is not None
+        self._directory: Optional[PatientDirectory] = None
+        self._directory_lock = threading.Lock()
+
     # ──────────────────────────────────────────────────────────
     # HELPERS
     # ──────────────────────────────────────────────────────────
 
+    def _execute(self, query):
+        """Execute a PostgREST query and count the round trip."""
+        with self._count_lock:
+            self.request_count += 1
+            op = _op_requests.get()
+            if op is not None:
+                op[0] += 1
+        return query.execute()
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        """The shared thread pool, created once even when sessions race for it."""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.MAX_WORKERS,
+                                                thread_name_prefix='supabase-db')
+            return self._pool
+
+    def _run_parallel(self, tasks: Dict[str, Callable[[], Any]]) -> Dict[str, Any]:
+        """Run independent calls and return their results by name.
+
+        With concurrent=True they run on a bounded thread pool, so the wall
+        time is that of the slowest call. Every task runs to completion even
+        if another one fails; all failures are then raised together as a
+        ParallelTaskError.
+        """
+        results, errors = {}, {}
+        if self.concurrent and len(tasks) > 1:
+            futures = {name: self._get_pool().submit(contextvars.copy_context().run, fn)
+                       for name, fn in tasks.items()}
+            for name, future in futures.items():
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    errors[name] = e
+        else:
+            for name, fn in tasks.items():
+                try:
+                    results[name] = fn()
+                except Exception as e:
+                    errors[name] = e
+        if errors:
+            raise ParallelTaskError(errors)
+        return results
+
     @staticmethod
     def _to_str(v) -> str:
         """Safely convert value to string for DB storage."""
@@ -47,48 +170,240 @@ class SupabaseDB:
         return str(v)
 
     @staticmethod
-    def _serialize(obj) -> str:
-        """JSON-serialize a dict, converting date objects to ISO strings."""
+    def _serialize(obj, compress: Optional[bool] = None) -> str:
+        """JSON-serialize a blob dict in the sparse format (see _sparse_encode).
+
+        Dates become ISO strings. Encodings larger than COMPRESS_MIN_BYTES are
+        zlib-compressed and stored as "z:<base64>" unless compress is given.
+        """
         def _default(o):
             if isinstance(o, date):
                 return o.isoformat()
             raise TypeError(f"Object of type {type(o)} is not JSON serializable")
-        return json.dumps(obj, default=_default)
+        payload = SupabaseDB._sparse_encode(obj) if isinstance(obj, dict) else obj
+        raw = json.dumps(payload, default=_default, ensure_ascii=False, separators=(',', ':'))
+        if compress is None:
+            compress = len(raw) >= SupabaseDB.COMPRESS_MIN_BYTES
+        if compress:
+            return 'z:' + base64.b64encode(zlib.compress(raw.encode('utf-8'), 9)).decode('ascii')
+        return raw
 
     @staticmethod
     def _deserialize(s: str) -> dict:
-        """JSON-deserialize a string, returning {} on failure."""
+        """JSON-deserialize a blob, returning {} on failure.
+
+        Accepts compressed ("z:") and sparse encodings as well as the plain
+        JSON dicts written by older versions.
+        """
         if not s:
             return {}
         try:
-            return json.loads(s)
+            if s.startswith('z:'):
+                s = zlib.decompress(base64.b64decode(s[2:])).decode('utf-8')
+            obj = json.loads(s)
+            if not isinstance(obj, dict):
+                return {}
+            if obj.get('_fmt') == SupabaseDB.SPARSE_FORMAT:
+                return SupabaseDB._sparse_decode(obj)
+            return obj
         except Exception:
             return {}
 
+    # Blob keys holding a value equal to one of these are listed by name
+    # instead of stored as key/value pairs.
+    _SPARSE_DEFAULTS = (('f', False), ('e', ''), ('n', None))
+    # Timing fields of a row left at its defaults (week 1 - 1, no frequency)
+    _TIMING_DEFAULTS = (('_w_start', '1'), ('_w_end', '1'), ('_freq', ''))
+
+    @staticmethod
+    def _sparse_encode(data: Dict) -> Dict:
+        """Split a blob dict into explicit values and lists of default keys.
+
+        {"_fmt": ..., "v": {key: value}, "f": [keys == False],
+         "e": [keys == ""], "n": [keys == None], "t": [timing row prefixes]}
+        """
+        values = dict(data)
+        enc: Dict[str, Any] = {'_fmt': SupabaseDB.SPARSE_FORMAT}
+
+        timing = []
+        for key in data:
+            if not key.endswith('_w_start'):
+                continue
+            base = key[:-len('_w_start')]
+            fields = [base + sfx for sfx, _ in SupabaseDB._TIMING_DEFAULTS]
+            if all(f in values and type(values[f]) is str and values[f] == default
+                   for f, (_, default) in zip(fields, SupabaseDB._TIMING_DEFAULTS)):
+                timing.append(base)
+                for f in fields:
+                    del values[f]
+        if timing:
+            enc['t'] = timing
+
+        for tag, default in SupabaseDB._SPARSE_DEFAULTS:
+            keys = [k for k, v in values.items()
+                    if v is default or (type(v) is type(default) and v == default)]
+            if keys:
+                enc[tag] = keys
+                for k in keys:
+                    del values[k]
+        enc['v'] = values
+        return enc
+
+    @staticmethod
+    def _sparse_decode(enc: Dict) -> Dict:
+        """Inverse of _sparse_encode."""
+        data = dict(enc.get('v') or {})
+        for tag, default in SupabaseDB._SPARSE_DEFAULTS:
+            for k in enc.get(tag) or []:
+                data[k] = default
+        for base in enc.get('t') or []:
+            for sfx, default in SupabaseDB._TIMING_DEFAULTS:
+                data[base + sfx] = default
+        return data
+
     # ──────────────────────────────────────────────────────────
     # SUPPLEMENTS
     # ──────────────────────────────────────────────────────────
 
     def fetch_supplements(self) -> pd.DataFrame:
         try:
-            resp = self.supabase.table('supplements').select('*').order('category').order('id').execute()
+            resp = self._execute(self.supabase.table('supplements').select('*').order('category').order('id'))
             return pd.DataFrame(resp.data)
         except Exception as e:
             print(f"Error fetching supplements: {e}")
             return pd.DataFrame()
 
+    def get_catalog(self) -> SupplementCatalog:
+        """Process-wide supplement catalog, rebuilt only when its version changes."""
+        with self._catalog_lock:
+            now = time.monotonic()
+            if self._catalog is not None and now - self._catalog_checked < self.CATALOG_CHECK_SECONDS:
+                return self._catalog
+            version = self._catalog_version()
+            if self._catalog is None or version is None or version != self._catalog.version:
+                df = self.fetch_supplements()
+                if not df.empty or self._catalog is None:
+                    self._catalog = SupplementCatalog(df, version)
+                    print(f"✅ Supplement catalog loaded ({len(self._catalog)} items)")
+            self._catalog_checked = now
+            return self._catalog
+
+    def invalidate_catalog(self):
+        """Force the next get_catalog() call to re-check the catalog version."""
+        with self._catalog_lock:
+            self._catalog_checked = 0.0
+
+    def _catalog_version(self):
+        """Cheap change marker for the supplements table.
+
+        Uses (row count, max updated_at) when the table has an updated_at
+        column, otherwise (row count, max id). Returns None if the probe fails.
+        """
+        try:
+            if self._catalog_has_updated_at:
+                try:
+                    resp = self._execute(self.supabase.table('supplements')
+                        .select('updated_at', count='exact')
+                        .order('updated_at', desc=True)
+                        .limit(1))
+                    return (resp.count, resp.data[0]['updated_at'] if resp.data else None)
+                except Exception:
+                    self._catalog_has_updated_at = False
+            resp = self._execute(self.supabase.table('supplements')
+                .select('id', count='exact')
+                .order('id', desc=True)
+                .limit(1))
+            return (resp.count, resp.data[0]['id'] if resp.data else None)
+        except Exception as e:
+            print(f"Error checking supplement catalog version: {e}")
+            return None
+
     # ──────────────────────────────────────────────────────────
     # PATIENT NAMES
     # ──────────────────────────────────────────────────────────
 
     def fetch_patient_names(self) -> pd.DataFrame:
         try:
-            resp = self.supabase.table('patients').select('patient_name').order('patient_name').execute()
-            return pd.DataFrame(resp.data)
+            return pd.DataFrame(self._fetch_patient_pages('patient_name'))
         except Exception as e:
             print(f"Error fetching patient names: {e}")
             return pd.DataFrame()
 
+    def _fetch_patient_pages(self, columns: str) -> List[Dict]:
+        """All patients rows, ordered by name, read in keyset pages so the
+        server's row cap can't truncate the result. The first page carries
+        the total count; reading stops once it is reached."""
+        rows, total, after = [], None, None
+        while True:
+            query = (self.supabase.table('patients')
+                     .select(columns, count='exact' if total is None else None)
+                     .order('patient_name')
+                     .limit(self.PATIENT_PAGE_SIZE))
+            if after is not None:
+                query = query.gt('patient_name', after)
+            resp = self._execute(query)
+            page = resp.data or []
+            if total is None:
+                total = resp.count
+            rows.extend(page)
+            if not page or (total is not None and len(rows) >= total) \
+                    or (total is None and len(page) < self.PATIENT_PAGE_SIZE):
+                return rows
+            after = page[-1]['patient_name']
+
+    def search_patients(self, prefix: str = '', after: Optional[str] = None,
+                        limit: int = 50) -> Tuple[List[str], bool]:
+        """One page of patient names starting with ``prefix`` (case-insensitive),
+        ordered by name. ``after`` is the last name of the previous page.
+        Returns (names, more)."""
+        try:
+            query = (self.supabase.table('patients')
+                     .select('patient_name')
+                     .order('patient_name')
+                     .limit(limit + 1))
+            if prefix:
+                escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                query = query.ilike('patient_name', f'{escaped}%')
+            if after is not None:
+                query = query.gt('patient_name', after)
+            names = [r['patient_name'] for r in (self._execute(query).data or [])]
+            return names[:limit], len(names) > limit
+        except Exception as e:
+            print(f"Error searching patients: {e}")
+            return [], False
+
+    def get_patient_directory(self) -> PatientDirectory:
+        """Process-wide patient name directory, loaded on first use only."""
+        with self._directory_lock:
+            if self._directory is None:
+                try:
+                    self._directory = PatientDirectory(self._fetch_directory_rows())
+                    print(f"✅ Patient directory loaded ({len(self._directory)} patients)")
+                except Exception as e:
+                    # Not cached: the next call retries the load.
+                    print(f"Error loading patient directory: {e}")
+                    return PatientDirectory([])
+            return self._directory
+
+    def _fetch_directory_rows(self) -> List[Dict]:
+        """All (id, patient_name) rows, used to build the patient directory."""
+        return self._fetch_patient_pages('id, patient_name')
+
+    def _patient_id(self, patient_name: str):
+        """Patient id from the directory, querying patients only for names
+        the directory does not know (e.g. created by another server)."""
+        patient_id = self.get_patient_directory().id_for(patient_name)
+        if patient_id is not None:
+            return patient_id
+        resp = self._execute(self.supabase.table('patients')
+            .select('id')
+            .eq('patient_name', patient_name))
+        if not resp.data:
+            return None
+        patient_id = resp.data[0]['id']
+        self.get_patient_directory().add(patient_name, patient_id)
+        return patient_id
+
     # ──────────────────────────────────────────────────────────
     # SAVE
     # ──────────────────────────────────────────────────────────
@@ -100,201 +415,536 @@ class SupabaseDB:
         therapieplan_data: Dict,
         ernaehrung_data: Dict,
         infusion_data: Dict,
+        sections: Optional[Dict] = None,
     ) -> bool:
+        """Save the whole patient. Uses the save_patient_document RPC (one
+        request, one transaction) when atomic_save is on and the function
+        exists, otherwise the per-table requests.
+
+        sections: the caller's (per session) record of what it last loaded
+        or saved, filled by load_patient_data and updated here. Sections whose
+        content hash is unchanged are skipped, but only while the stored
+        patients.revision still matches the recorded one.
+        """
+        op_requests = [0]
+        op_token = _op_requests.set(op_requests)
         try:
-            # ── 1. Upsert patient record ──────────────────────
-            patient_record = {
-                'patient_name':             str(patient_data.get('patient', '')),
-                'geburtsdatum':             self._to_str(patient_data.get('geburtsdatum')),
-                'geschlecht':               str(patient_data.get('geschlecht', 'M')),
-                'groesse':                  int(patient_data.get('groesse', 0) or 0),
-                'gewicht':                  int(patient_data.get('gewicht', 0) or 0),
-                'therapiebeginn':           self._to_str(patient_data.get('therapiebeginn')),
-                'dauer':                    int(patient_data.get('dauer', 6) or 6),
-                'tw_besprochen':            str(patient_data.get('tw_besprochen', 'Ja')),
-                'allergie':                 str(patient_data.get('allergie', '')),
-                'diagnosen':                str(patient_data.get('diagnosen', '')),
-                'kontrolltermin_4':         bool(patient_data.get('kontrolltermin_4', False)),
-                'kontrolltermin_12':        bool(patient_data.get('kontrolltermin_12', False)),
-                'kontrolltermin_24':        bool(patient_data.get('kontrolltermin_24', False)),
-                'kontrolltermin_kommentar': str(patient_data.get('kontrolltermin_kommentar', '')),
-                'kt4_date':                 self._to_str(patient_data.get('kt4_date')) or None,
-                'kt12_date':                self._to_str(patient_data.get('kt12_date')) or None,
-                'kt24_date':                self._to_str(patient_data.get('kt24_date')) or None,
+            patient_record = self._patient_record(patient_data)
+            blobs = {
+                'patient_therapieplan': therapieplan_data or {},
+                'patient_ernaehrung':   ernaehrung_data or {},
+                'patient_infusion':     infusion_data or {},
             }
+            hashes = self._section_hashes_for(patient_record, nem_prescriptions, blobs)
 
-            existing = self.supabase.table('patients') \
-                .select('id') \
-                .eq('patient_name', patient_record['patient_name']) \
-                .execute()
-
-            if existing.data:
-                patient_id = existing.data[0]['id']
-                # Try full update; if columns missing, retry with base columns only
-                try:
-                    self.supabase.table('patients').update(patient_record).eq('id', patient_id).execute()
-                except Exception as col_err:
-                    print(f"Full update failed ({col_err}), trying base columns...")
-                    base = {k: v for k, v in patient_record.items()
-                            if k in ('patient_name','geburtsdatum','geschlecht','groesse',
-                                     'gewicht','therapiebeginn','dauer','tw_besprochen',
-                                     'allergie','diagnosen','kontrolltermin_4',
-                                     'kontrolltermin_12','kontrolltermin_kommentar')}
-                    self.supabase.table('patients').update(base).eq('id', patient_id).execute()
-            else:
+            save = self._save_patient_rest
+            if self.atomic_save and self._rpc_available:
+                save = self._save_patient_rpc
+            try:
                 try:
-                    resp = self.supabase.table('patients').insert(patient_record).execute()
-                except Exception as col_err:
-                    print(f"Full insert failed ({col_err}), trying base columns...")
-                    base = {k: v for k, v in patient_record.items()
-                            if k in ('patient_name','geburtsdatum','geschlecht','groesse',
-                                     'gewicht','therapiebeginn','dauer','tw_besprochen',
-                                     'allergie','diagnosen','kontrolltermin_4',
-                                     'kontrolltermin_12','kontrolltermin_kommentar')}
-                    resp = self.supabase.table('patients').insert(base).execute()
-                patient_id = resp.data[0]['id']
-
-            # ── 2. NEM prescriptions ─────────────────────────
-            self.supabase.table('patient_prescriptions').delete().eq('patient_id', patient_id).execute()
-
-            for prescription in (nem_prescriptions or []):
-                supp_resp = self.supabase.table('supplements') \
-                    .select('id') \
-                    .eq('name', prescription.get('name', '')) \
-                    .execute()
-                if not supp_resp.data:
-                    continue
-                self.supabase.table('patient_prescriptions').insert({
-                    'patient_id':      patient_id,
-                    'supplement_id':   supp_resp.data[0]['id'],
-                    'dauer':           self._to_str(prescription.get('Gesamt-dosierung', '')),
-                    'darreichungsform': self._to_str(prescription.get('Darreichungsform', '')),
-                    'dosierung':       self._to_str(prescription.get('Pro Einnahme', '')),
-                    'nuechtern':       self._to_str(prescription.get('Nüchtern', '')),
-                    'morgens':         self._to_str(prescription.get('Morgens', '')),
-                    'mittags':         self._to_str(prescription.get('Mittags', '')),
-                    'abends':          self._to_str(prescription.get('Abends', '')),
-                    'nachts':          self._to_str(prescription.get('Nachts', '')),
-                    'kommentar':       self._to_str(prescription.get('Kommentar', '')),
-                }).execute()
-
-            # ── 3. JSON blobs ────────────────────────────────
-            for table, data in [
-                ('patient_therapieplan', therapieplan_data),
-                ('patient_ernaehrung',   ernaehrung_data),
-                ('patient_infusion',     infusion_data),
-            ]:
-                self.supabase.table(table).upsert(
-                    {'patient_id': patient_id, 'data': self._serialize(data or {})},
-                    on_conflict='patient_id',
-                ).execute()
-
-            print(f"✅ Saved patient '{patient_record['patient_name']}' (id={patient_id})")
+                    patient_id, nem_summary, unchanged, revision = save(
+                        patient_record, nem_prescriptions, blobs, hashes, sections)
+                except RPCMissingError as e:
+                    print(f"save_patient_document RPC not available ({e}), using per-table save...")
+                    self._rpc_available = False
+                    patient_id, nem_summary, unchanged, revision = self._save_patient_rest(
+                        patient_record, nem_prescriptions, blobs, hashes, sections)
+            except Exception:
+                # Some sections may have been written: the next save sends everything
+                if sections is not None:
+                    sections.clear()
+                raise
+            if sections is not None:
+                sections.clear()
+                sections.update({'patient_id': patient_id, 'revision': revision, 'hashes': hashes,
+                                 'prescriptions': self._prescription_rows(nem_prescriptions)})
+
+            self.get_patient_directory().add(patient_record['patient_name'], patient_id)
+
+            self.last_save_requests = op_requests[0]
+            self.last_save_summary = {
+                'patient_id':    patient_id,
+                'requests':      self.last_save_requests,
+                'prescriptions': nem_summary,
+                'skipped':       sorted(unchanged),
+            }
+            nem_text = (f"NEM +{nem_summary['inserted']} ~{nem_summary['updated']} -{nem_summary['deleted']}"
+                        if nem_summary else "NEM unchanged")
+            print(f"✅ Saved patient '{patient_record['patient_name']}' (id={patient_id}, "
+                  f"{nem_text}, {len(unchanged)} sections skipped, {self.last_save_requests} requests)")
             return True
 
         except Exception as e:
             print(f"❌ save_patient_data error: {e}")
             import traceback; traceback.print_exc()
             return False
+        finally:
+            _op_requests.reset(op_token)
+
+    @staticmethod
+    def _known_sections(patient_id, sections: Optional[Dict]) -> Optional[Dict]:
+        """The caller's sections if they describe this patient at a recorded
+        revision, else None (nothing to diff against)."""
+        if (patient_id is None or not sections or sections.get('patient_id') != patient_id
+                or sections.get('revision') is None):
+            return None
+        return sections
+
+    @classmethod
+    def _unchanged_sections(cls, patient_id, hashes: Dict[str, str], sections: Optional[Dict]) -> set:
+        """Sections whose content hash matches what the caller last loaded or
+        saved for this patient. Empty without a recorded revision to check."""
+        known = cls._known_sections(patient_id, sections)
+        if known is None:
+            return set()
+        return {t for t, h in hashes.items() if (known.get('hashes') or {}).get(t) == h}
+
+    def _patient_revision(self, patient_id):
+        """Current patients.revision, or None when the column doesn't exist
+        (migrations/002_patient_revision.sql not run)."""
+        if not self._has_revision:
+            return None
+        try:
+            resp = self._execute(self.supabase.table('patients').select('revision').eq('id', patient_id))
+            return resp.data[0]['revision'] if resp.data else None
+        except Exception as e:
+            print(f"patients.revision not available ({e}), unchanged sections are always saved")
+            self._has_revision = False
+            return None
+
+    def _save_patient_rest(self, patient_record: Dict, nem_prescriptions: List[Dict],
+                           blobs: Dict[str, Dict], hashes: Dict[str, str], sections: Optional[Dict]):
+        """Per-table save. Returns (patient_id, prescription summary or None,
+        unchanged sections, revision). Not atomic: a failure may leave some
+        tables written, and the revision check is a separate request."""
+        # ── 1. Upsert patient record ──────────────────────
+        patient_id = self._patient_id(patient_record['patient_name'])
+        unchanged = self._unchanged_sections(patient_id, hashes, sections)
+        if unchanged and self._patient_revision(patient_id) != sections['revision']:
+            unchanged = set()  # written by someone else since the caller's load
+
+        if patient_id is not None and 'patients' in unchanged:
+            pass  # patient header unchanged since last load/save
+        elif patient_id is not None:
+            # Try full update; if columns missing, retry with base columns only
+            try:
+                resp = self._execute(self.supabase.table('patients').update(patient_record).eq('id', patient_id))
+            except Exception as col_err:
+                print(f"Full update failed ({col_err}), trying base columns...")
+                base = {k: v for k, v in patient_record.items()
+                        if k in ('patient_name','geburtsdatum','geschlecht','groesse',
+                                 'gewicht','therapiebeginn','dauer','tw_besprochen',
+                                 'allergie','diagnosen','kontrolltermin_4',
+                                 'kontrolltermin_12','kontrolltermin_kommentar')}
+                resp = self._execute(self.supabase.table('patients').update(base).eq('id', patient_id))
+            if not resp.data:
+                # Deleted by another server since the directory cached the id
+                print(f"Patient id {patient_id} no longer exists, inserting '{patient_record['patient_name']}' again")
+                self.get_patient_directory().remove(patient_record['patient_name'])
+                patient_id, unchanged = None, set()
+        if patient_id is None:
+            try:
+                resp = self._execute(self.supabase.table('patients').insert(patient_record))
+            except Exception as col_err:
+                print(f"Full insert failed ({col_err}), trying base columns...")
+                base = {k: v for k, v in patient_record.items()
+                        if k in ('patient_name','geburtsdatum','geschlecht','groesse',
+                                 'gewicht','therapiebeginn','dauer','tw_besprochen',
+                                 'allergie','diagnosen','kontrolltermin_4',
+                                 'kontrolltermin_12','kontrolltermin_kommentar')}
+                resp = self._execute(self.supabase.table('patients').insert(base))
+            patient_id = resp.data[0]['id']
+
+        # ── 2. NEM prescriptions + 3. JSON blobs ─────────
+        # Independent once patient_id is known, so they run concurrently.
+        tasks = {}
+        if 'patient_prescriptions' not in unchanged:
+            tasks['patient_prescriptions'] = lambda: self._save_prescriptions(patient_id, nem_prescriptions)
+        for table, data in blobs.items():
+            if table in unchanged:
+                continue
+            tasks[table] = (lambda table=table, data=data: self._execute(
+                self.supabase.table(table).upsert(
+                    {'patient_id': patient_id, 'data': self._serialize(data)},
+                    on_conflict='patient_id',
+                )))
+        results = self._run_parallel(tasks)
+        revision = sections['revision'] if len(unchanged) == len(hashes) else self._patient_revision(patient_id)
+        return patient_id, results.get('patient_prescriptions'), unchanged, revision
+
+    def _save_patient_rpc(self, patient_record: Dict, nem_prescriptions: List[Dict],
+                          blobs: Dict[str, Dict], hashes: Dict[str, str], sections: Optional[Dict]):
+        """Atomic save through the save_patient_document database function
+        (migrations/001_save_patient_document.sql).
+
+        Sends one document holding the patient row plus only the changed
+        sections and the revision they were diffed against; of the NEM list
+        only new or changed rows go out, with the ids of all kept rows. If the
+        stored revision moved on, the function writes nothing and answers
+        "stale"; the full document is then sent. A failure leaves the stored
+        patient untouched.
+        """
+        patient_id = self.get_patient_directory().id_for(patient_record['patient_name'])
+        known = self._known_sections(patient_id, sections)
+        unchanged = self._unchanged_sections(patient_id, hashes, sections)
+
+        doc: Dict[str, Any] = {'patient': patient_record}
+        if known is not None:
+            doc['expected_revision'] = known['revision']
+        if 'patient_prescriptions' not in unchanged:
+            baseline = (known or {}).get('prescriptions') or {}
+            current = self._prescription_rows(nem_prescriptions)
+            supplement_ids = self._supplement_ids(list(current))
+            rows, ids = [], []
+            for name, row in current.items():
+                supplement_id = supplement_ids.get(name)
+                if supplement_id is None:
+                    print(f"⚠️  Supplement not found in DB: {name}")
+                    continue
+                ids.append(supplement_id)
+                if baseline.get(name) != row:
+                    rows.append({**{k: v for k, v in row.items() if k != 'patient_id'},
+                                 'supplement_id': supplement_id})
+            doc['prescriptions'] = {'rows': rows, 'ids': ids}
+        for table, data in blobs.items():
+            if table not in unchanged:
+                doc[table[len('patient_'):]] = self._serialize(data)
+
+        try:
+            resp = self._execute(self.supabase.rpc('save_patient_document', {'doc': doc}))
+        except Exception as e:
+            text = str(e)
+            if 'PGRST202' in text or ('save_patient_document' in text and 'does not exist' in text):
+                raise RPCMissingError(text) from e
+            raise
+        result = resp.data or {}
+        if result.get('stale'):
+            print(f"Patient '{patient_record['patient_name']}' changed since it was loaded, saving all sections")
+            return self._save_patient_rpc(patient_record, nem_prescriptions, blobs, hashes, None)
+        nem_summary = None
+        if 'prescriptions' in doc:
+            inserted = result.get('prescriptions_inserted') or 0
+            updated = result.get('prescriptions_updated') or 0
+            nem_summary = {'inserted': inserted, 'updated': updated,
+                           'deleted': result.get('prescriptions_deleted') or 0,
+                           'unchanged': len(doc['prescriptions']['ids']) - inserted - updated}
+        return result['patient_id'], nem_summary, unchanged, result.get('revision')
+
+    def _patient_record(self, patient_data: Dict) -> Dict:
+        """Map the app-side patient_data dict to a patients row."""
+        return {
+            'patient_name':             str(patient_data.get('patient', '')),
+            'geburtsdatum':             self._to_str(patient_data.get('geburtsdatum')),
+            'geschlecht':               str(patient_data.get('geschlecht', 'M')),
+            'groesse':                  int(patient_data.get('groesse', 0) or 0),
+            'gewicht':                  int(patient_data.get('gewicht', 0) or 0),
+            'therapiebeginn':           self._to_str(patient_data.get('therapiebeginn')),
+            'dauer':                    int(patient_data.get('dauer', 6) or 6),
+            'tw_besprochen':            str(patient_data.get('tw_besprochen', 'Ja')),
+            'allergie':                 str(patient_data.get('allergie', '')),
+            'diagnosen':                str(patient_data.get('diagnosen', '')),
+            'kontrolltermin_4':         bool(patient_data.get('kontrolltermin_4', False)),
+            'kontrolltermin_12':        bool(patient_data.get('kontrolltermin_12', False)),
+            'kontrolltermin_24':        bool(patient_data.get('kontrolltermin_24', False)),
+            'kontrolltermin_kommentar': str(patient_data.get('kontrolltermin_kommentar', '')),
+            'kt4_date':                 self._to_str(patient_data.get('kt4_date')) or None,
+            'kt12_date':                self._to_str(patient_data.get('kt12_date')) or None,
+            'kt24_date':                self._to_str(patient_data.get('kt24_date')) or None,
+        }
+
+    @staticmethod
+    def _content_hash(obj) -> str:
+        """Stable hash of a JSON-compatible value (dict key order ignored)."""
+        def _default(o):
+            if isinstance(o, date):
+                return o.isoformat()
+            return str(o)
+        raw = json.dumps(obj, sort_keys=True, default=_default, ensure_ascii=False)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _section_hashes_for(self, patient_record: Dict, nem_prescriptions: List[Dict],
+                            blobs: Dict[str, Dict]) -> Dict[str, str]:
+        """Content hash per saved table, used to skip unchanged sections."""
+        nem_rows = self._prescription_rows(nem_prescriptions)
+        hashes = {
+            'patients':              self._content_hash(patient_record),
+            'patient_prescriptions': self._content_hash([nem_rows[n] for n in sorted(nem_rows)]),
+        }
+        hashes.update({table: self._content_hash(data) for table, data in blobs.items()})
+        return hashes
+
+    def _remember_loaded(self, sections: Optional[Dict], row: Dict, result: Tuple):
+        """Record a freshly loaded patient's revision and section hashes in the
+        caller's sections dict."""
+        if sections is None:
+            return
+        patient_data, nem_prescriptions, tp, ern, inf = result
+        sections.clear()
+        sections.update({
+            'patient_id':    row['id'],
+            'revision':      row.get('revision'),
+            'hashes':        self._section_hashes_for(
+                self._patient_record(patient_data), nem_prescriptions, {
+                    'patient_therapieplan': tp,
+                    'patient_ernaehrung':   ern,
+                    'patient_infusion':     inf,
+                }),
+            'prescriptions': self._prescription_rows(nem_prescriptions),
+        })
+
+    def _prescription_rows(self, nem_prescriptions: List[Dict]) -> Dict[str, Dict]:
+        """NEM rows keyed by supplement name (supplement_id holds the name
+        until resolved); the baseline the RPC save diffs against."""
+        return {p.get('name', ''): self._prescription_row(None, p.get('name', ''), p)
+                for p in (nem_prescriptions or []) if p.get('name')}
+
+    def _save_prescriptions(self, patient_id, nem_prescriptions: List[Dict]) -> Dict[str, int]:
+        """Bring the patient's NEM rows in line with nem_prescriptions.
+
+        Compares against the stored rows keyed by supplement_id and only
+        deletes removed rows, upserts changed rows (by primary key) and
+        inserts new ones. Returns counts of inserted/updated/deleted/unchanged.
+        """
+        supplement_ids = self._supplement_ids(
+            [p.get('name', '') for p in (nem_prescriptions or [])])
+        wanted = {}
+        for prescription in (nem_prescriptions or []):
+            supplement_id = supplement_ids.get(prescription.get('name', ''))
+            if supplement_id is None:
+                continue
+            wanted[supplement_id] = self._prescription_row(patient_id, supplement_id, prescription)
+
+        stored_resp = self._execute(self.supabase.table('patient_prescriptions')
+            .select('id, supplement_id, ' + ', '.join(self.PRESCRIPTION_FIELDS))
+            .eq('patient_id', patient_id))
+        stored, removed = {}, []
+        for row in (stored_resp.data or []):
+            if row['supplement_id'] in stored:
+                removed.append(row['id'])  # duplicate from an older save
+            else:
+                stored[row['supplement_id']] = row
+
+        added, changed = [], []
+        for supplement_id, row in wanted.items():
+            old = stored.get(supplement_id)
+            if old is None:
+                added.append(row)
+            elif any(self._to_str(old.get(f)) != row[f] for f in self.PRESCRIPTION_FIELDS):
+                changed.append({**row, 'id': old['id']})
+        removed += [row['id'] for sid, row in stored.items() if sid not in wanted]
+
+        if removed:
+            self._execute(self.supabase.table('patient_prescriptions')
+                .delete()
+                .eq('patient_id', patient_id)
+                .in_('id', removed))
+        if changed:
+            self._execute(self.supabase.table('patient_prescriptions').upsert(changed))
+        if added:
+            self._execute(self.supabase.table('patient_prescriptions').insert(added))
+
+        return {
+            'inserted':  len(added),
+            'updated':   len(changed),
+            'deleted':   len(removed),
+            'unchanged': len(wanted) - len(added) - len(changed),
+        }
+
+    def _supplement_ids(self, names: List[str]) -> Dict[str, Any]:
+        """Resolve supplement names to ids from the catalog; unknown names
+        are looked up together in a single request."""
+        names = {n for n in names if n}
+        catalog = self._catalog
+        ids = {}
+        if catalog is not None:
+            ids = {n: catalog.by_name[n]['id'] for n in names if n in catalog.by_name}
+        missing = sorted(names - ids.keys())
+        if missing:
+            resp = self._execute(self.supabase.table('supplements').select('id, name').in_('name', missing))
+            ids.update({row['name']: row['id'] for row in (resp.data or [])})
+        return ids
+
+    def _prescription_row(self, patient_id, supplement_id, prescription: Dict) -> Dict:
+        """Map an app-side NEM prescription dict to a patient_prescriptions row."""
+        return {
+            'patient_id':      patient_id,
+            'supplement_id':   supplement_id,
+            'dauer':           self._to_str(prescription.get('Gesamt-dosierung', '')),
+            'darreichungsform': self._to_str(prescription.get('Darreichungsform', '')),
+            'dosierung':       self._to_str(prescription.get('Pro Einnahme', '')),
+            'nuechtern':       self._to_str(prescription.get('Nüchtern', '')),
+            'morgens':         self._to_str(prescription.get('Morgens', '')),
+            'mittags':         self._to_str(prescription.get('Mittags', '')),
+            'abends':          self._to_str(prescription.get('Abends', '')),
+            'nachts':          self._to_str(prescription.get('Nachts', '')),
+            'kommentar':       self._to_str(prescription.get('Kommentar', '')),
+        }
 
     # ──────────────────────────────────────────────────────────
     # LOAD
     # ──────────────────────────────────────────────────────────
 
-    def load_patient_data(self, patient_name: str) -> Tuple:
+    def load_patient_data(self, patient_name: str, sections: Optional[Dict] = None) -> Tuple:
         """Returns (patient_data, nem_prescriptions, therapieplan, ernaehrung, infusion)
-        or (None, [], {}, {}, {}) on failure."""
+        or (None, [], {}, {}, {}) on failure. ``sections`` (see save_patient_data)
+        is reset to the loaded patient.
+
+        With embedded_load (the default) the patient and all child tables come
+        back from one embedded select. If that fails — e.g. the relationships
+        are not exposed by PostgREST — the sequential per-table load is used.
+        """
+        if sections is not None:
+            sections.clear()
         try:
-            # ── Patient ──────────────────────────────────────
-            p_resp = self.supabase.table('patients') \
-                .select('*') \
-                .eq('patient_name', patient_name) \
-                .execute()
-            if not p_resp.data:
-                return None, [], {}, {}, {}
-
-            p = p_resp.data[0]
-            patient_id = p['id']
-
-            patient_data = {
-                'patient':                  p.get('patient_name', ''),
-                'geburtsdatum':             p.get('geburtsdatum', ''),
-                'geschlecht':               p.get('geschlecht', 'M'),
-                'groesse':                  p.get('groesse', 0) or 0,
-                'gewicht':                  p.get('gewicht', 0) or 0,
-                'therapiebeginn':           p.get('therapiebeginn', ''),
-                'dauer':                    p.get('dauer', 6) or 6,
-                'tw_besprochen':            p.get('tw_besprochen', 'Ja'),
-                'allergie':                 p.get('allergie', ''),
-                'diagnosen':                p.get('diagnosen', ''),
-                'kontrolltermin_4':         bool(p.get('kontrolltermin_4', False)),
-                'kontrolltermin_12':        bool(p.get('kontrolltermin_12', False)),
-                'kontrolltermin_24':        bool(p.get('kontrolltermin_24', False)),
-                'kontrolltermin_kommentar': p.get('kontrolltermin_kommentar', ''),
-                'kt4_date':                 p.get('kt4_date'),
-                'kt12_date':                p.get('kt12_date'),
-                'kt24_date':                p.get('kt24_date'),
-            }
+            if self.embedded_load:
+                try:
+                    result = self._load_patient_embedded(patient_name, sections)
+                except Exception as e:
+                    print(f"Embedded load failed ({e}), falling back to per-table load...")
+                    result = self._load_patient_sequential(patient_name, sections)
+            else:
+                result = self._load_patient_sequential(patient_name, sections)
 
-            # ── NEM prescriptions ─────────────────────────────
-            pr_resp = self.supabase.table('patient_prescriptions') \
-                .select('*, supplements(name)') \
-                .eq('patient_id', patient_id) \
-                .execute()
-
-            nem_prescriptions = []
-            for row in (pr_resp.data or []):
-                nem_prescriptions.append({
-                    'name':              row['supplements']['name'],
-                    'Gesamt-dosierung':  row.get('dauer', ''),
-                    'Darreichungsform':  row.get('darreichungsform', ''),
-                    'Pro Einnahme':      row.get('dosierung', ''),
-                    'Nüchtern':          row.get('nuechtern', ''),
-                    'Morgens':           row.get('morgens', ''),
-                    'Mittags':           row.get('mittags', ''),
-                    'Abends':            row.get('abends', ''),
-                    'Nachts':            row.get('nachts', ''),
-                    'Kommentar':         row.get('kommentar', ''),
-                })
-
-            # ── JSON blobs ────────────────────────────────────
-            def _load_blob(table: str) -> dict:
-                resp = self.supabase.table(table).select('data').eq('patient_id', patient_id).execute()
-                return self._deserialize(resp.data[0]['data']) if resp.data else {}
-
-            therapieplan_data = _load_blob('patient_therapieplan')
-            ernaehrung_data   = _load_blob('patient_ernaehrung')
-            infusion_data     = _load_blob('patient_infusion')
-
-            print(f"✅ Loaded patient '{patient_name}'")
-            return patient_data, nem_prescriptions, therapieplan_data, ernaehrung_data, infusion_data
+            if result[0] is not None:
+                print(f"✅ Loaded patient '{patient_name}'")
+            return result
 
         except Exception as e:
             print(f"❌ load_patient_data error: {e}")
             import traceback; traceback.print_exc()
             return None, [], {}, {}, {}
 
+    def _patient_query(self, patient_name: str, columns: str):
+        """Select on patients by directory id when known, else by name."""
+        known_id = self.get_patient_directory().id_for(patient_name)
+        query = self.supabase.table('patients').select(columns)
+        if known_id is not None:
+            return known_id, query.eq('id', known_id)
+        return None, query.eq('patient_name', patient_name)
+
+    def _fetch_patient_row(self, patient_name: str, columns: str) -> Optional[Dict]:
+        known_id, query = self._patient_query(patient_name, columns)
+        resp = self._execute(query)
+        if not resp.data:
+            if known_id is not None:
+                self.get_patient_directory().remove(patient_name)
+            return None
+        p = resp.data[0]
+        if known_id is None:
+            self.get_patient_directory().add(patient_name, p['id'])
+        return p
+
+    def _load_patient_embedded(self, patient_name: str, sections: Optional[Dict] = None) -> Tuple:
+        p = self._fetch_patient_row(patient_name, self.PATIENT_EMBED)
+        if p is None:
+            return None, [], {}, {}, {}
+
+        def _blob(value) -> dict:
+            # One-to-one embeds come back as an object, older PostgREST
+            # versions return a (single element) list instead.
+            if isinstance(value, list):
+                value = value[0] if value else None
+            return self._deserialize(value['data']) if value else {}
+
+        result = (
+            self._patient_data_from_row(p),
+            self._nem_from_rows(p.get('patient_prescriptions') or []),
+            _blob(p.get('patient_therapieplan')),
+            _blob(p.get('patient_ernaehrung')),
+            _blob(p.get('patient_infusion')),
+        )
+        self._remember_loaded(sections, p, result)
+        return result
+
+    def _load_patient_sequential(self, patient_name: str, sections: Optional[Dict] = None) -> Tuple:
+        p = self._fetch_patient_row(patient_name, '*')
+        if p is None:
+            return None, [], {}, {}, {}
+        patient_id = p['id']
+
+        def _load_prescriptions() -> List[Dict]:
+            resp = self._execute(self.supabase.table('patient_prescriptions')
+                .select('*, supplements(name)')
+                .eq('patient_id', patient_id))
+            return self._nem_from_rows(resp.data or [])
+
+        def _load_blob(table: str) -> dict:
+            resp = self._execute(self.supabase.table(table).select('data').eq('patient_id', patient_id))
+            return self._deserialize(resp.data[0]['data']) if resp.data else {}
+
+        results = self._run_parallel({
+            'patient_prescriptions': _load_prescriptions,
+            'patient_therapieplan':  lambda: _load_blob('patient_therapieplan'),
+            'patient_ernaehrung':    lambda: _load_blob('patient_ernaehrung'),
+            'patient_infusion':      lambda: _load_blob('patient_infusion'),
+        })
+        result = (
+            self._patient_data_from_row(p),
+            results['patient_prescriptions'],
+            results['patient_therapieplan'],
+            results['patient_ernaehrung'],
+            results['patient_infusion'],
+        )
+        self._remember_loaded(sections, p, result)
+        return result
+
+    @staticmethod
+    def _patient_data_from_row(p: Dict) -> Dict:
+        """Map a patients row to the app-side patient_data dict."""
+        return {
+            'patient':                  p.get('patient_name', ''),
+            'geburtsdatum':             p.get('geburtsdatum', ''),
+            'geschlecht':               p.get('geschlecht', 'M'),
+            'groesse':                  p.get('groesse', 0) or 0,
+            'gewicht':                  p.get('gewicht', 0) or 0,
+            'therapiebeginn':           p.get('therapiebeginn', ''),
+            'dauer':                    p.get('dauer', 6) or 6,
+            'tw_besprochen':            p.get('tw_besprochen', 'Ja'),
+            'allergie':                 p.get('allergie', ''),
+            'diagnosen':                p.get('diagnosen', ''),
+            'kontrolltermin_4':         bool(p.get('kontrolltermin_4', False)),
+            'kontrolltermin_12':        bool(p.get('kontrolltermin_12', False)),
+            'kontrolltermin_24':        bool(p.get('kontrolltermin_24', False)),
+            'kontrolltermin_kommentar': p.get('kontrolltermin_kommentar', ''),
+            'kt4_date':                 p.get('kt4_date'),
+            'kt12_date':                p.get('kt12_date'),
+            'kt24_date':                p.get('kt24_date'),
+        }
+
+    @staticmethod
+    def _nem_from_rows(rows: List[Dict]) -> List[Dict]:
+        """Map patient_prescriptions rows (with embedded supplements(name))
+        to the app-side NEM prescription dicts."""
+        return [{
+            'name':              row['supplements']['name'],
+            'Gesamt-dosierung':  row.get('dauer', ''),
+            'Darreichungsform':  row.get('darreichungsform', ''),
+            'Pro Einnahme':      row.get('dosierung', ''),
+            'Nüchtern':          row.get('nuechtern', ''),
+            'Morgens':           row.get('morgens', ''),
+            'Mittags':           row.get('mittags', ''),
+            'Abends':            row.get('abends', ''),
+            'Nachts':            row.get('nachts', ''),
+            'Kommentar':         row.get('kommentar', ''),
+        } for row in rows if row.get('supplements')]
+
     # ──────────────────────────────────────────────────────────
     # DELETE
     # ──────────────────────────────────────────────────────────
 
     def delete_patient_data(self, patient_name: str) -> bool:
         try:
-            p_resp = self.supabase.table('patients') \
-                .select('id') \
-                .eq('patient_name', patient_name) \
-                .execute()
-            if not p_resp.data:
+            patient_id = self._patient_id(patient_name)
+            if patient_id is None:
                 print(f"Patient '{patient_name}' not found")
                 return False
 
-            patient_id = p_resp.data[0]['id']
-
             for table in ['patient_prescriptions', 'patient_therapieplan',
                           'patient_ernaehrung', 'patient_infusion']:
-                self.supabase.table(table).delete().eq('patient_id', patient_id).execute()
+                self._execute(self.supabase.table(table).delete().eq('patient_id', patient_id))
 
-            self.supabase.table('patients').delete().eq('id', patient_id).execute()
+            self._execute(self.supabase.table('patients').delete().eq('id', patient_id))
+            self.get_patient_directory().remove(patient_name)
             print(f"✅ Deleted patient '{patient_name}'")
             return True
 
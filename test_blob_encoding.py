@@ -0,0 +1,92 @@
+"""Blob format of patient_therapieplan / _ernaehrung / _infusion.data."""
+import base64
+import json
+import zlib
+from datetime import date
+
+import pytest
+
+from supabase_db import SupabaseDB
+
+encode, decode = SupabaseDB._sparse_encode, SupabaseDB._sparse_decode
+serialize, deserialize = SupabaseDB._serialize, SupabaseDB._deserialize
+
+TIMING_ROW = {'zaehne': True, 'zaehne_w_start': '1', 'zaehne_w_end': '1', 'zaehne_freq': ''}
+
+
+# ──────────────────────────────────────────────────────────
+# ROUND TRIPS
+# ──────────────────────────────────────────────────────────
+
+@pytest.mark.parametrize('data', [
+    {},
+    {'a': False, 'b': '', 'c': None},
+    {'zero': 0, 'one': 1, 'true': True, 'empty_list': [], 'text': 'Kontrolle', 'float': 0.0},
+    TIMING_ROW,
+    {'zaehne_w_start': '2', 'zaehne_w_end': '1', 'zaehne_freq': ''},
+    {'zaehne_w_start': '1', 'zaehne_w_end': '1'},  # incomplete timing row
+    {'nested': {'x': [1, {'y': False}], 'z': ''}, 'list': ['', None, False]},
+    {'umlaut_ä': 'Nüchtern', 'f': 'v', 'e': 'x', 't': 'y', 'v': 'z', '_fmt': 'not ours'},
+], ids=['empty', 'defaults', 'non-defaults', 'timing', 'timing-changed', 'timing-partial',
+        'nested', 'tag-like-keys'])
+@pytest.mark.parametrize('compress', [False, True], ids=['plain', 'zlib'])
+def test_round_trip(data, compress):
+    assert decode(encode(data)) == data
+    assert deserialize(serialize(data, compress=compress)) == data
+
+
+def test_dates_round_trip_as_iso_strings():
+    data = {'zaehne_date_start': date(2025, 1, 6), 'kt4': date(2025, 2, 3), 'x': False}
+    assert deserialize(serialize(data)) == {'zaehne_date_start': '2025-01-06', 'kt4': '2025-02-03', 'x': False}
+
+
+def test_non_default_values_keep_their_type():
+    enc = encode({'zero': 0, 'false': False, 'one_text': '1', 'none': None})
+    assert enc['v'] == {'zero': 0, 'one_text': '1'}
+    assert enc['f'] == ['false'] and enc['n'] == ['none']
+
+
+def test_default_timing_rows_collapse():
+    enc = encode(TIMING_ROW)
+    assert enc['t'] == ['zaehne']
+    assert enc['v'] == {'zaehne': True}
+
+
+def test_large_blobs_are_compressed():
+    data = {f'row{i:03d}_comment': f'Kommentar {i}' for i in range(500)}
+    stored = serialize(data)
+    assert stored.startswith('z:')
+    assert deserialize(stored) == data
+    assert not serialize({'a': 'b'}).startswith('z:')
+
+
+# ──────────────────────────────────────────────────────────
+# LEGACY AND BROKEN BLOBS
+# ──────────────────────────────────────────────────────────
+
+def test_legacy_plain_json_blobs():
+    legacy = {'zaehne': True, 'zaehne_w_start': '1', 'zaehne_w_end': '1', 'zaehne_freq': '', 'x': False}
+    assert deserialize(json.dumps(legacy)) == legacy
+    assert deserialize(json.dumps(legacy, ensure_ascii=False, indent=2)) == legacy
+    assert deserialize('{}') == {}
+
+
+def test_legacy_compressed_plain_json():
+    legacy = {'a': 1}
+    stored = 'z:' + base64.b64encode(zlib.compress(json.dumps(legacy).encode())).decode()
+    assert deserialize(stored) == legacy
+
+
+@pytest.mark.parametrize('stored', [
+    None, '', 'not json', '{"a": ', 'null', '[1, 2]', '"text"', '42',
+    'z:', 'z:not base64!', 'z:' + base64.b64encode(b'not zlib').decode(),
+], ids=['none', 'empty', 'garbage', 'truncated-json', 'null', 'list', 'string', 'number',
+        'z-empty', 'z-bad-base64', 'z-bad-zlib'])
+def test_corrupt_blobs_load_empty(stored):
+    assert deserialize(stored) == {}
+
+
+def test_truncated_blobs_load_empty():
+    data = {f'row{i:03d}_comment': f'Kommentar {i}' for i in range(500)}
+    for stored in (serialize(data, compress=True), serialize(data, compress=False)):
+        assert deserialize(stored[:len(stored) // 2]) == {}
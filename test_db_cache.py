@@ -0,0 +1,80 @@
+"""PatientDirectory: token index, ranking and in-place maintenance."""
+import pytest
+
+from db_cache import PatientDirectory, name_tokens
+
+NAMES = ['Anna Müller', 'Anna Schmidt', 'Hannah Anders', 'Müller-Lüdenscheidt, Anna',
+         'Max Mustermann', 'Maximilian Muster', 'müller anna']
+
+
+@pytest.fixture
+def directory():
+    return PatientDirectory({'id': i, 'patient_name': n} for i, n in enumerate(NAMES, 1))
+
+
+def test_name_tokens():
+    assert name_tokens('Müller-Lüdenscheidt, Anna') == ['müller', 'lüdenscheidt', 'anna']
+    assert name_tokens('A_B 50%') == ['a_b', '50']
+
+
+def test_search_ranking(directory):
+    # Most query words matched first ...
+    assert directory.search('anna müller') == [
+        'Anna Müller', 'müller anna', 'Müller-Lüdenscheidt, Anna', 'Anna Schmidt']
+    # ... then exact word matches before prefix matches ...
+    assert directory.search('muster') == ['Maximilian Muster', 'Max Mustermann']
+    # ... then alphabetical, ignoring case
+    assert directory.search('an') == [
+        'Anna Müller', 'Anna Schmidt', 'Hannah Anders', 'müller anna', 'Müller-Lüdenscheidt, Anna']
+    assert directory.search('muster', limit=1) == ['Maximilian Muster']
+
+
+def test_search_matches_word_prefixes_only(directory):
+    assert directory.search('ll') == []
+    assert directory.search('nna') == []
+    assert directory.search('lüd') == ['Müller-Lüdenscheidt, Anna']
+    assert directory.search('ANN') == directory.search('ann')
+
+
+def test_search_empty_query_and_limit(directory):
+    assert directory.search('') == []
+    assert directory.search('  ,-') == []
+    assert directory.search('anna', limit=0) == []
+
+
+def test_search_treats_wildcards_literally():
+    directory = PatientDirectory([{'id': 1, 'patient_name': 'A_B'}, {'id': 2, 'patient_name': 'AxB'},
+                                  {'id': 3, 'patient_name': '50% Test'}, {'id': 4, 'patient_name': '500 Test'}])
+    assert directory.search('a_') == ['A_B']
+    assert directory.search('%') == []
+    assert directory.search('50%') == ['50% Test', '500 Test']
+
+
+def test_add_and_remove_keep_index_current(directory):
+    directory.add('Zoe Anker', 99)
+    assert 'Zoe Anker' in directory and directory.id_for('Zoe Anker') == 99
+    assert directory.names() == sorted(NAMES + ['Zoe Anker'])
+    assert directory.search('zoe') == ['Zoe Anker']
+    assert 'Zoe Anker' in directory.search('an', limit=20)
+
+    # Re-adding updates the id without duplicating tokens
+    directory.add('Zoe Anker', 100)
+    assert directory.id_for('Zoe Anker') == 100
+    assert directory.search('zoe') == ['Zoe Anker']
+
+    directory.remove('Zoe Anker')
+    assert 'Zoe Anker' not in directory
+    assert directory.search('zoe') == []
+    assert directory.names() == sorted(NAMES)
+    directory.remove('Zoe Anker')  # unknown names are ignored
+
+    directory.remove('Anna Müller')
+    assert directory.search('anna müller')[0] == 'müller anna'
+    assert len(directory) == len(NAMES) - 1
+
+
+def test_names_list_is_replaced_not_mutated(directory):
+    before = directory.names()
+    directory.add('Aaron', 50)
+    assert 'Aaron' not in before
+    assert directory.names()[0] == 'Aaron'
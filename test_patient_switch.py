@@ -0,0 +1,71 @@
+"""Switching patients in the app: no widget keeps the previous patient's value."""
+import os
+
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from sqlite_db import SQLiteDB
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+SUPPLEMENTS = [('CAT1', 'CATEGORY: Basis', 1), ('S001', 'Magnesium', 1), ('S002', 'Zink', 1)]
+
+ANNA = ({'patient': 'Anna', 'geburtsdatum': '1970-01-01', 'geschlecht': 'W', 'groesse': 168,
+         'therapiebeginn': '2025-01-06', 'dauer': 6, 'allergie': 'Nuss', 'kontrolltermin_4': True,
+         'kt4_date': '2025-02-03'},
+        [{'name': 'Magnesium', 'Darreichungsform': 'Pulver', 'Morgens': '1', 'Kommentar': 'mit Mahlzeit'}],
+        {'zaehne': True, 'diag_zaehne_w_start': '2', 'diag_zaehne_w_end': '4', 'diag_zaehne_freq': '1x/Woche',
+         'lab_imd_cb': True, 'lab_imd': 'Profil A', 'diag_extra1_cb': True, 'diag_extra1_text': 'Extra A'},
+        {},
+        {'revita_immune': True, 'inf_revita_immune_freq': '2x/Woche', 'zusaetze': ['Biotin']})
+
+BERND = ({'patient': 'Bernd', 'geburtsdatum': '1980-05-05', 'geschlecht': 'M', 'groesse': 181,
+          'therapiebeginn': '2025-03-03', 'dauer': 3, 'allergie': 'Gluten'},
+         [{'name': 'Zink', 'Darreichungsform': 'Kapseln', 'Abends': '1'}],
+         {'darm_biofilm': True, 'haupt_darm_biofilm_freq': 'täglich'},
+         {},
+         {'revita_nad': True})
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    path = str(tmp_path / 'app.db')
+    db = SQLiteDB(path, supplements_csv=None)
+    db._conn().executemany('INSERT INTO supplements (id, name, category) VALUES (?, ?, ?)', SUPPLEMENTS)
+    db._conn().commit()
+    for patient in (ANNA, BERND):
+        assert db.save_patient_data(*patient)
+
+    monkeypatch.setenv('DB_BACKEND', 'sqlite')
+    monkeypatch.setenv('SQLITE_PATH', path)
+    monkeypatch.setenv('TAB_ROUTER', 'off')
+    st.cache_resource.clear()
+    yield lambda: AppTest.from_file(APP, default_timeout=60).run()
+    st.cache_resource.clear()
+
+
+def open_patient(at, name):
+    at.text_input(key='patient_name_input').input(name).run()
+    assert not at.exception
+    return at
+
+
+def widget_values(at):
+    state = at.session_state
+    return {k: state[k] for k in state['widget_fields'] if k in state and not k.startswith('nem_grid_')}
+
+
+def test_switch_renders_like_a_fresh_load(app):
+    fresh = widget_values(open_patient(app(), 'Bernd'))
+    at = open_patient(app(), 'Anna')
+    assert at.session_state['allergie_input'] == 'Nuss'
+    assert at.session_state['S001_Morgens'] == '1'
+
+    switched = widget_values(open_patient(at, 'Bernd'))
+    assert switched == fresh
+    assert switched['allergie_input'] == 'Gluten'
+    assert switched['zaehne_checkbox'] is False
+    assert switched['S002_Abends'] == '1'
+    assert 'S001_Morgens' not in switched or switched['S001_Morgens'] == ''
+    assert 'inf_revita_immune_cb' in switched and switched['inf_revita_immune_cb'] is False
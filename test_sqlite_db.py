@@ -0,0 +1,66 @@
+"""SQLiteDB: save / load / delete round trip and patient search."""
+import pytest
+
+from sqlite_db import SQLiteDB
+
+PATIENT = {'patient': 'Erika Muster', 'geburtsdatum': '1970-01-01', 'geschlecht': 'W',
+           'groesse': 168, 'gewicht': 60, 'therapiebeginn': '2025-01-06', 'dauer': 6,
+           'allergie': 'Nuss', 'kontrolltermin_4': True, 'kt4_date': '2025-02-03'}
+NEM = [{'name': 'Magnesiumbisglycinat-Pulver', 'Gesamt-dosierung': '60', 'Darreichungsform': 'Pulver',
+        'Pro Einnahme': '1', 'Morgens': '1', 'Kommentar': 'mit Mahlzeit'},
+       {'name': 'Vermox 3 Tage, nach 14 Tagen wiederholen', 'Abends': '1'}]
+
+
+@pytest.fixture
+def db(tmp_path):
+    return SQLiteDB(str(tmp_path / 'app.db'))
+
+
+def test_fresh_database_has_supplements_from_csv(db):
+    names = set(db.fetch_supplements()['name'])
+    assert 'CATEGORY: Basis' in names
+    assert 'Vermox 3 Tage, nach 14 Tagen wiederholen' in names
+
+
+def test_shares_supabase_db_state(db):
+    assert db.supabase is None
+    assert db.atomic_save is False and db._rpc_available is False
+
+
+def test_save_load_delete_round_trip(db):
+    tp = {'zaehne': True, 'zaehne_w_start': '2'}
+    assert db.save_patient_data(PATIENT, NEM, tp, {'ern': 1}, {'inf': 'x'})
+
+    patient, nem, loaded_tp, ern, inf = db.load_patient_data(PATIENT['patient'])
+    assert patient['patient'] == PATIENT['patient']
+    assert patient['allergie'] == 'Nuss'
+    assert patient['kontrolltermin_4'] is True
+    assert [(p['name'], p['Morgens'], p['Abends']) for p in nem] == [
+        ('Magnesiumbisglycinat-Pulver', '1', ''), ('Vermox 3 Tage, nach 14 Tagen wiederholen', '', '1')]
+    assert nem[0]['Gesamt-dosierung'] == '60' and nem[0]['Kommentar'] == 'mit Mahlzeit'
+    assert (loaded_tp, ern, inf) == (tp, {'ern': 1}, {'inf': 'x'})
+
+    # A second save replaces the NEM list instead of appending to it
+    assert db.save_patient_data(PATIENT, NEM[:1], tp, {}, {})
+    assert len(db.load_patient_data(PATIENT['patient'])[1]) == 1
+
+    assert db.delete_patient_data(PATIENT['patient'])
+    assert db.load_patient_data(PATIENT['patient']) == (None, [], {}, {}, {})
+    assert db._sql("SELECT COUNT(*) AS n FROM patient_prescriptions")[0]['n'] == 0
+
+
+def test_load_clears_sections(db):
+    sections = {'patient_id': 1, 'revision': 3, 'hashes': {}}
+    assert db.save_patient_data(PATIENT, [], {}, {}, {})
+    db.load_patient_data(PATIENT['patient'], sections)
+    assert sections == {}
+
+
+def test_search_patients_escapes_like_wildcards(db):
+    for name in ('A_B', 'AxB', '50% Test', '500 Test'):
+        assert db.save_patient_data(dict(PATIENT, patient=name), [], {}, {}, {})
+    assert db.search_patients('A_')[0] == ['A_B']
+    assert db.search_patients('50%')[0] == ['50% Test']
+    assert db.search_patients('')[0] == ['50% Test', '500 Test', 'A_B', 'AxB']
+    assert db.search_patients('', limit=2) == (['50% Test', '500 Test'], True)
+    assert db.search_patients('', after='500 Test') == (['A_B', 'AxB'], False)
@@ -0,0 +1,326 @@
+"""SupabaseDB against the in-process stand-in (fake_supabase)."""
+import pytest
+
+from fake_supabase import FakeAPIError, FakeSupabase
+from supabase_db import ParallelTaskError, SupabaseDB
+
+SUPPLEMENTS = [{'id': 'CAT1', 'name': 'CATEGORY: Basis', 'category': 1},
+               {'id': 'S001', 'name': 'Magnesium', 'category': 1},
+               {'id': 'S002', 'name': 'Zink', 'category': 1},
+               {'id': 'S003', 'name': 'Selen', 'category': 1},
+               {'id': 'S004', 'name': 'Kalium', 'category': 1}]
+
+PATIENT = {'patient': 'Erika Muster', 'geburtsdatum': '1970-01-01', 'therapiebeginn': '2025-01-06',
+           'dauer': 6, 'allergie': ''}
+NEM = [{'name': 'Magnesium', 'Morgens': '1', 'Darreichungsform': 'Kapseln'}]
+
+
+def make_client(**kwargs):
+    client = FakeSupabase(**kwargs)
+    client.seed('supplements', SUPPLEMENTS)
+    return client
+
+
+def make_db(client, rpc=True):
+    return SupabaseDB(client=client, atomic_save=rpc)
+
+
+# ──────────────────────────────────────────────────────────
+# UNCHANGED SECTIONS
+# ──────────────────────────────────────────────────────────
+
+@pytest.mark.parametrize('rpc', [True, False], ids=['rpc', 'rest'])
+def test_unchanged_save_skips_sections(rpc):
+    db = make_db(make_client(functions=rpc), rpc)
+    sections = {}
+    assert db.save_patient_data(PATIENT, NEM, {'zaehne': True}, {}, {}, sections)
+    assert db.save_patient_data(PATIENT, NEM, {'zaehne': True}, {}, {}, sections)
+    assert len(db.last_save_summary['skipped']) == 5
+
+
+@pytest.mark.parametrize('rpc', [True, False], ids=['rpc', 'rest'])
+def test_save_after_other_writer_is_not_skipped(rpc):
+    """Server 1 saved the patient; server 2 changes it. Saving the (unchanged)
+    form on server 1 again must write it, not trust server 1's hashes."""
+    client = make_client(functions=rpc)
+    server1, server2 = make_db(client, rpc), make_db(client, rpc)
+
+    session1 = {}
+    assert server1.save_patient_data(PATIENT, NEM, {'zaehne': True}, {}, {}, session1)
+
+    session2 = {}
+    loaded = server2.load_patient_data(PATIENT['patient'], session2)
+    assert server2.save_patient_data(dict(PATIENT, allergie='Nuss'), [], {'zaehne': False}, {}, {}, session2)
+
+    assert server1.save_patient_data(PATIENT, NEM, {'zaehne': True}, {}, {}, session1)
+    stored = make_db(client, rpc).load_patient_data(PATIENT['patient'])
+    assert stored[0]['allergie'] == ''
+    assert [p['name'] for p in stored[1]] == ['Magnesium']
+    assert stored[2] == {'zaehne': True}
+    assert loaded[2] == {'zaehne': True}
+
+
+def test_save_after_manual_edit_is_not_skipped():
+    client = make_client()
+    db = make_db(client)
+    sections = {}
+    assert db.save_patient_data(PATIENT, NEM, {'zaehne': True}, {}, {}, sections)
+    patient_id = sections['patient_id']
+    client.table('patient_therapieplan').update({'data': '{"zaehne": false}'}).eq('patient_id', patient_id).execute()
+
+    assert db.save_patient_data(PATIENT, NEM, {'zaehne': True}, {}, {}, sections)
+    assert db.load_patient_data(PATIENT['patient'])[2] == {'zaehne': True}
+
+
+def test_sections_are_per_caller():
+    """Hashes recorded by one session's load don't let another session skip."""
+    client = make_client()
+    db = make_db(client)
+    assert db.save_patient_data(PATIENT, NEM, {'zaehne': True}, {}, {}, {})
+    db.load_patient_data(PATIENT['patient'], {})
+
+    assert db.save_patient_data(PATIENT, NEM, {'zaehne': True}, {}, {}, {})
+    assert db.last_save_summary['skipped'] == []
+
+
+def test_without_revision_column_nothing_is_skipped():
+    db = make_db(make_client(functions=False, revisions=False), rpc=False)
+    sections = {}
+    assert db.save_patient_data(PATIENT, NEM, {'zaehne': True}, {}, {}, sections)
+    assert db.save_patient_data(PATIENT, NEM, {'zaehne': True}, {}, {}, sections)
+    assert db.last_save_summary['skipped'] == []
+    assert db.load_patient_data(PATIENT['patient'])[2] == {'zaehne': True}
+
+
+# ──────────────────────────────────────────────────────────
+# LOAD
+# ──────────────────────────────────────────────────────────
+
+@pytest.fixture
+def saved_client():
+    client = make_client()
+    nem = NEM + [{'name': 'Zink', 'Abends': '1', 'Kommentar': 'abends'}]
+    assert make_db(client).save_patient_data(dict(PATIENT, allergie='Nuss'), nem, {'zaehne': True},
+                                             {'diaet': 'basisch'}, {'revita_nad': True})
+    return client
+
+
+def _load(client, embedded_load):
+    db = SupabaseDB(client=client, embedded_load=embedded_load)
+    sections = {}
+    return db.load_patient_data(PATIENT['patient'], sections), sections
+
+
+def test_embedded_and_sequential_load_match(saved_client):
+    embedded, sequential = _load(saved_client, True), _load(saved_client, False)
+    assert embedded == sequential
+    patient, nem, tp, ern, inf = embedded[0]
+    assert patient['allergie'] == 'Nuss'
+    assert sorted(p['name'] for p in nem) == ['Magnesium', 'Zink']
+    assert (tp, ern, inf) == ({'zaehne': True}, {'diaet': 'basisch'}, {'revita_nad': True})
+
+
+def test_embedded_load_falls_back_to_sequential(saved_client, monkeypatch):
+    monkeypatch.setattr(SupabaseDB, 'PATIENT_EMBED', SupabaseDB.PATIENT_EMBED + ', patient_notes(data)')
+    assert _load(saved_client, True) == _load(saved_client, False)
+
+
+def test_embedded_load_accepts_one_to_one_embeds_as_lists(saved_client, monkeypatch):
+    embed = saved_client._embed
+
+    def as_list(table, row, target, spec):
+        value = embed(table, row, target, spec)
+        return [value] if isinstance(value, dict) and table == 'patients' else value
+    monkeypatch.setattr(saved_client, '_embed', as_list)
+    assert isinstance(saved_client.table('patients').select(SupabaseDB.PATIENT_EMBED)
+                      .execute().data[0]['patient_therapieplan'], list)
+    assert _load(saved_client, True) == _load(saved_client, False)
+
+
+# ──────────────────────────────────────────────────────────
+# PARALLEL TASKS
+# ──────────────────────────────────────────────────────────
+
+@pytest.mark.parametrize('concurrent', [True, False], ids=['pool', 'serial'])
+def test_run_parallel_raises_all_failures_after_every_task_ran(concurrent):
+    db = SupabaseDB(client=make_client(), concurrent=concurrent)
+    ran = []
+
+    def task(name, fails):
+        def run():
+            ran.append(name)
+            if fails:
+                raise ValueError(f'{name} failed')
+            return name
+        return run
+
+    with pytest.raises(ParallelTaskError) as info:
+        db._run_parallel({'a': task('a', True), 'b': task('b', False), 'c': task('c', True)})
+    assert sorted(ran) == ['a', 'b', 'c']
+    assert sorted(info.value.errors) == ['a', 'c']
+    assert 'a failed' in str(info.value) and 'c failed' in str(info.value)
+
+
+def test_failed_blob_table_fails_save_and_clears_sections(monkeypatch):
+    client = make_client(functions=False)
+    db = make_db(client, rpc=False)
+    sections = {}
+    assert db.save_patient_data(PATIENT, NEM, {'zaehne': True}, {}, {}, sections)
+
+    table = client.table
+
+    def failing_table(name):
+        if name == 'patient_ernaehrung':
+            raise FakeAPIError('permission denied for table patient_ernaehrung', '42501')
+        return table(name)
+    monkeypatch.setattr(client, 'table', failing_table)
+
+    assert not db.save_patient_data(PATIENT, NEM, {'zaehne': False}, {'diaet': 1}, {'inf': 1}, sections)
+    assert sections == {}
+    # The other tables were still written
+    monkeypatch.setattr(client, 'table', table)
+    stored = make_db(client, rpc=False).load_patient_data(PATIENT['patient'])
+    assert (stored[2], stored[3], stored[4]) == ({'zaehne': False}, {}, {'inf': 1})
+
+
+# ──────────────────────────────────────────────────────────
+# NEM DIFF
+# ──────────────────────────────────────────────────────────
+
+@pytest.mark.parametrize('rpc', [True, False], ids=['rpc', 'rest'])
+def test_save_writes_prescription_diff(rpc):
+    client = make_client(functions=rpc)
+    db = make_db(client, rpc)
+    sections = {}
+    nem = [{'name': 'Magnesium', 'Morgens': '1'}, {'name': 'Zink', 'Abends': '1'},
+           {'name': 'Selen', 'Mittags': '1'}]
+    assert db.save_patient_data(PATIENT, nem, {}, {}, {}, sections)
+    assert db.last_save_summary['prescriptions'] == {'inserted': 3, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+    row_ids = {r['supplement_id']: r['id'] for r in client.tables['patient_prescriptions']}
+
+    # Edit Magnesium, keep Selen, remove Zink, add Kalium
+    nem = [{'name': 'Magnesium', 'Morgens': '2'}, {'name': 'Selen', 'Mittags': '1'},
+           {'name': 'Kalium', 'Nachts': '1'}]
+    assert db.save_patient_data(PATIENT, nem, {}, {}, {}, sections)
+    assert db.last_save_summary['prescriptions'] == {'inserted': 1, 'updated': 1, 'deleted': 1, 'unchanged': 1}
+
+    stored = sorted((r['supplement_id'], r['morgens'], r['mittags'], r['nachts'])
+                    for r in client.tables['patient_prescriptions'])
+    assert stored == [('S001', '2', '', ''), ('S003', '', '1', ''), ('S004', '', '', '1')]
+    # Edited and unchanged rows are updated in place, not re-inserted
+    kept = {r['supplement_id']: r['id'] for r in client.tables['patient_prescriptions']}
+    assert (kept['S001'], kept['S003']) == (row_ids['S001'], row_ids['S003'])
+
+
+@pytest.mark.parametrize('rpc', [True, False], ids=['rpc', 'rest'])
+def test_unknown_supplement_names_cost_one_request(rpc):
+    """Names resolve from the catalog; names it doesn't know (added after it
+    was loaded, or not a supplement at all) are looked up in one request."""
+    client = make_client(functions=rpc)
+    db = make_db(client, rpc)
+    db.get_catalog()
+    db.get_patient_directory()
+    client.seed('supplements', [{'id': 'S005', 'name': 'Vitamin D', 'category': 1}])
+
+    client.reset_stats()
+    assert db.save_patient_data(PATIENT, NEM, {}, {}, {})
+    known_requests = db.last_save_requests
+    assert client.requests_by_table.get('supplements', 0) == 0
+
+    client.reset_stats()
+    nem = NEM + [{'name': 'Vitamin D', 'Morgens': '1'}, {'name': 'Unbekannt', 'Morgens': '1'}]
+    assert db.save_patient_data(dict(PATIENT, patient='Max Muster'), nem, {}, {}, {})
+    assert client.requests_by_table['supplements'] == 1
+    assert db.last_save_requests == known_requests + 1 == client.request_count
+    stored = make_db(client, rpc).load_patient_data('Max Muster')[1]
+    assert sorted(p['name'] for p in stored) == ['Magnesium', 'Vitamin D']
+
+
+def _sent_prescriptions(client, monkeypatch):
+    """Record the 'prescriptions' part of each save_patient_document call."""
+    sent = []
+    rpc = client.rpc
+
+    def spy(name, params=None):
+        sent.append((params or {}).get('doc', {}).get('prescriptions'))
+        return rpc(name, params)
+    monkeypatch.setattr(client, 'rpc', spy)
+    return sent
+
+
+def test_rpc_sends_only_changed_prescriptions(monkeypatch):
+    client = make_client()
+    db = make_db(client)
+    nem = [{'name': 'Magnesium', 'Morgens': '1'}, {'name': 'Zink', 'Abends': '1'}]
+    sections = {}
+    assert db.save_patient_data(PATIENT, nem, {}, {}, {}, sections)
+    assert db.last_save_summary['prescriptions'] == {'inserted': 2, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+
+    sent = _sent_prescriptions(client, monkeypatch)
+    nem = [{'name': 'Magnesium', 'Morgens': '2'}, {'name': 'Zink', 'Abends': '1'}]
+    assert db.save_patient_data(PATIENT, nem, {}, {}, {}, sections)
+    assert [r['supplement_id'] for r in sent[-1]['rows']] == ['S001']
+    assert sorted(sent[-1]['ids']) == ['S001', 'S002']
+    assert db.last_save_summary['prescriptions'] == {'inserted': 0, 'updated': 1, 'deleted': 0, 'unchanged': 1}
+
+    assert db.save_patient_data(PATIENT, nem[:1], {}, {}, {}, sections)
+    assert sent[-1] == {'rows': [], 'ids': ['S001']}
+    assert db.last_save_summary['prescriptions'] == {'inserted': 0, 'updated': 0, 'deleted': 1, 'unchanged': 1}
+
+    stored = make_db(client).load_patient_data(PATIENT['patient'])[1]
+    assert [(p['name'], p['Morgens']) for p in stored] == [('Magnesium', '2')]
+
+
+def test_rpc_resends_all_prescriptions_when_stale(monkeypatch):
+    client = make_client()
+    server1, server2 = make_db(client), make_db(client)
+    nem = [{'name': 'Magnesium', 'Morgens': '1'}, {'name': 'Zink', 'Abends': '1'}]
+    session1 = {}
+    assert server1.save_patient_data(PATIENT, nem, {}, {}, {}, session1)
+    assert server2.save_patient_data(PATIENT, [], {}, {}, {}, {})
+
+    sent = _sent_prescriptions(client, monkeypatch)
+    nem = [{'name': 'Magnesium', 'Morgens': '2'}, {'name': 'Zink', 'Abends': '1'}]
+    assert server1.save_patient_data(PATIENT, nem, {}, {}, {}, session1)
+    assert len(sent) == 2 and len(sent[-1]['rows']) == 2
+    stored = make_db(client).load_patient_data(PATIENT['patient'])[1]
+    assert sorted((p['name'], p['Morgens']) for p in stored) == [('Magnesium', '2'), ('Zink', '')]
+
+
+# ──────────────────────────────────────────────────────────
+# PATIENT SEARCH
+# ──────────────────────────────────────────────────────────
+
+def test_search_patients_escapes_like_wildcards():
+    db = make_db(make_client())
+    for name in ('A_B', 'AxB', '50% Test', '500 Test'):
+        assert db.save_patient_data(dict(PATIENT, patient=name), [], {}, {}, {})
+    assert db.search_patients('a_')[0] == ['A_B']
+    assert db.search_patients('50%')[0] == ['50% Test']
+    assert db.search_patients('', limit=2) == (['50% Test', '500 Test'], True)
+
+
+# ──────────────────────────────────────────────────────────
+# STALE DIRECTORY
+# ──────────────────────────────────────────────────────────
+
+def test_rest_save_after_other_server_deleted_patient():
+    """Server 1's directory still holds the deleted patient's id; its next
+    save must insert the patient again instead of updating nothing."""
+    client = make_client(functions=False)
+    server1, server2 = make_db(client, rpc=False), make_db(client, rpc=False)
+    sections = {}
+    assert server1.save_patient_data(PATIENT, NEM, {'zaehne': True}, {}, {}, sections)
+    old_id = sections['patient_id']
+    assert server2.delete_patient_data(PATIENT['patient'])
+
+    assert server1.save_patient_data(PATIENT, NEM, {'zaehne': True}, {}, {}, sections)
+    assert [p['patient_name'] for p in client.tables['patients']] == [PATIENT['patient']]
+    new_id = client.tables['patients'][0]['id']
+    assert new_id != old_id and sections['patient_id'] == new_id
+    assert server1.get_patient_directory().id_for(PATIENT['patient']) == new_id
+    assert {r['patient_id'] for r in client.tables['patient_prescriptions']} == {new_id}
+
+    stored = make_db(client, rpc=False).load_patient_data(PATIENT['patient'])
+    assert [p['name'] for p in stored[1]] == ['Magnesium']
+    assert stored[2] == {'zaehne': True}